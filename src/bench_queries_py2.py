@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+查询与消息组装的性能基准（Python 2.7 兼容，数据用 SQLite 生成）
+
+用小白能懂的话：
+- 示例库里只有三行数据，看不出改动是变快还是变慢。
+- 这个脚本先生成大的 SQLite 测试库（bench_data/ 下，生成一次后复用）：
+  - bd_jobbasfil：10 万 ~ 1000 万行，重复 jobcode 的比例可调（--dup-ratio）；
+  - formmain_1559 / formmain_1445：模拟 MySQL 上“推送失败项目/产品”两张表（--fail-ratio 的行是失败状态）。
+- 再逐项计时：重复 jobcode 查询、流式汇总、摘要查询、各个 compose_* 消息组装函数、两张表的全量扫描，
+  以及一次完整的 main_py2 --dry-run。
+- 每一项在单独的进程里跑（多次取中位数），报告耗时、吞吐量（行/秒）和峰值内存（RSS），
+  并可以和保存的基线对比，慢了超过阈值时退出码为 1。
+
+用法：
+    python src/bench_queries_py2.py --rows 100000                    # 10 万行
+    python src/bench_queries_py2.py --rows 100000,1000000 --dup-ratio 0.3
+    python src/bench_queries_py2.py --rows 100000 --save-baseline    # 把本次结果保存为基线
+    python src/bench_queries_py2.py --rows 100000 --threshold 0.1    # 与基线对比，慢 10% 以上视为退步
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import subprocess
+try:
+    import resource  # Linux / macOS
+except Exception:
+    resource = None
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SRC_DIR)
+
+from db_client_py2 import (
+    FAILED_PUSH_QUERY,
+    FAILED_PRODUCT_PUSH_QUERY,
+    full_scan_sql,
+    iter_dict_rows,
+    iter_duplicate_jobcodes,
+    query_duplicate_jobcodes,
+    summary_duplicate_jobcodes,
+)
+
+# 每个测试库写入时每批插入的行数
+INSERT_BATCH = 10000
+CASES = [
+    "query_duplicate_jobcodes",
+    "summarize_duplicates",
+    "summary_duplicate_jobcodes",
+    "compose_jobcode",
+    "compose_failed_push",
+    "compose_failed_product_push",
+    "scan_failed_push",
+    "scan_failed_product_push",
+    "main_dry_run",
+]
+
+
+def fixture_path(data_dir, rows, dup_ratio, fail_ratio):
+    return os.path.join(data_dir, "bench_%d_dup%g_fail%g.sqlite" % (rows, dup_ratio, fail_ratio))
+
+
+def _insert(conn, sql, rows):
+    batch = []
+    for r in rows:
+        batch.append(r)
+        if len(batch) >= INSERT_BATCH:
+            conn.executemany(sql, batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+
+
+def build_fixture(path, rows, dup_ratio, fail_ratio, seed=20240101):
+    """
+    生成测试库（已存在时直接复用）。
+
+    参数：
+    - rows：每张表的行数
+    - dup_ratio：bd_jobbasfil 中“与前面某行 jobcode 相同”的行所占比例（0~1）
+    - fail_ratio：formmain_1559 / formmain_1445 中失败状态（'2'）的行所占比例（0~1）
+    """
+    if os.path.isfile(path):
+        return path
+    dir_path = os.path.dirname(path) or "."
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE bd_jobbasfil (id INTEGER PRIMARY KEY AUTOINCREMENT, jobcode TEXT, created_at TEXT)")
+        conn.execute("CREATE TABLE formmain_1559 (id INTEGER PRIMARY KEY AUTOINCREMENT, field0001 TEXT, field0045 TEXT)")
+        conn.execute("CREATE TABLE formmain_1445 (id INTEGER PRIMARY KEY AUTOINCREMENT, field0042 TEXT, field0032 TEXT)")
+
+        def jobcodes():
+            distinct = 0
+            for i in range(rows):
+                if distinct and rng.random() < dup_ratio:
+                    code = rng.randrange(distinct)
+                else:
+                    code = distinct
+                    distinct += 1
+                yield ("JC-%08d" % code, "2024-01-01 00:00:%02d" % (i % 60))
+
+        def failed(prefix):
+            for i in range(rows):
+                status = "2" if rng.random() < fail_ratio else "1"
+                # 约 5% 的产品编码为空，消息中显示为 null
+                value = "" if prefix == "P" and rng.random() < 0.05 else "%s-%08d" % (prefix, i)
+                yield (value, status)
+
+        _insert(conn, "INSERT INTO bd_jobbasfil(jobcode, created_at) VALUES(?, ?)", jobcodes())
+        _insert(conn, "INSERT INTO formmain_1559(field0001, field0045) VALUES(?, ?)", failed("XM"))
+        _insert(conn, "INSERT INTO formmain_1445(field0042, field0032) VALUES(?, ?)", failed("P"))
+        conn.commit()
+    finally:
+        conn.close()
+    os.rename(tmp_path, path)
+    return path
+
+
+def _peak_rss_kb(who):
+    value = resource.getrusage(who).ru_maxrss
+    # Linux 单位是 KB，macOS 是字节
+    return value // 1024 if sys.platform == "darwin" else value
+
+
+def _scan(db_path, query):
+    conn = sqlite3.connect(db_path)
+    try:
+        cur = conn.cursor()
+        cur.execute(full_scan_sql(query))
+        return list(iter_dict_rows(cur))
+    finally:
+        conn.close()
+
+
+def _table_rows(db_path, table):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _write_main_config(db_path, work_dir):
+    path = os.path.join(work_dir, "bench_main.ini")
+    lines = [
+        "[wecom]", "corpid=", "corpsecret=", "agentid=0", "touser=", "token_cache=", "",
+        "[db]", "driver=sqlite", "sqlite_path=%s" % db_path, "",
+    ]
+    for name, query in [("failed_push", FAILED_PUSH_QUERY), ("failed_product_push", FAILED_PRODUCT_PUSH_QUERY)]:
+        lines += [
+            "[check:%s]" % name, "source=db", "sql=%s" % full_scan_sql(query), "key=%s" % query[0][0],
+            "display=%s" % query[0][0], "title=%s" % name, "",
+        ]
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+    return path
+
+
+def run_case(case, db_path, preview):
+    """
+    在当前进程里跑一项基准，返回 {"seconds": 耗时, "rows": 处理的行数}。
+    """
+    # 延迟导入：只有汇总和消息组装相关的测试项才需要加载 main_py2
+    if case.startswith("compose_") or case == "summarize_duplicates":
+        import main_py2
+    if case in ("query_duplicate_jobcodes", "summarize_duplicates", "summary_duplicate_jobcodes", "main_dry_run"):
+        rows = _table_rows(db_path, "bd_jobbasfil")
+    if case == "query_duplicate_jobcodes":
+        start = time.time()
+        query_duplicate_jobcodes(db_path)
+    elif case == "summarize_duplicates":
+        start = time.time()
+        main_py2.summarize_rows(iter_duplicate_jobcodes(db_path), preview)
+    elif case == "summary_duplicate_jobcodes":
+        start = time.time()
+        summary_duplicate_jobcodes(db_path, preview)
+    elif case == "compose_jobcode":
+        data = query_duplicate_jobcodes(db_path)
+        rows = len(data)
+        start = time.time()
+        main_py2.compose_jobcode_text(data, preview)
+        main_py2.compose_jobcode_markdown(data, preview)
+    elif case == "compose_failed_push":
+        data = _scan(db_path, FAILED_PUSH_QUERY)
+        rows = len(data)
+        start = time.time()
+        main_py2.compose_failed_push_text(data, preview)
+        main_py2.compose_failed_push_markdown(data, preview)
+    elif case == "compose_failed_product_push":
+        data = _scan(db_path, FAILED_PRODUCT_PUSH_QUERY)
+        rows = len(data)
+        start = time.time()
+        main_py2.compose_failed_product_push_text(data, preview)
+        main_py2.compose_failed_product_push_markdown(data, preview)
+    elif case in ("scan_failed_push", "scan_failed_product_push"):
+        query = FAILED_PUSH_QUERY if case == "scan_failed_push" else FAILED_PRODUCT_PUSH_QUERY
+        rows = _table_rows(db_path, query[1])
+        start = time.time()
+        _scan(db_path, query)
+    elif case == "main_dry_run":
+        db_path = os.path.abspath(db_path)
+        work_dir = os.path.dirname(db_path)
+        config = _write_main_config(db_path, work_dir)
+        cmd = [sys.executable, os.path.join(SRC_DIR, "main_py2.py"), "--dry-run", "--config", config,
+               "--preview", str(preview), "--state", os.path.join(work_dir, "bench_state.json")]
+        start = time.time()
+        with open(os.devnull, "w") as devnull:
+            code = subprocess.call(cmd, stdout=devnull, stderr=devnull, cwd=work_dir)
+        if code != 0:
+            raise Exception("main_py2 --dry-run 退出码为 %d" % code)
+    else:
+        raise Exception("未知的测试项：%s" % case)
+    seconds = time.time() - start
+    # 完整运行测的是 main_py2 子进程的峰值内存，其他测试项测本进程
+    if resource is None:
+        rss = None
+    elif case == "main_dry_run":
+        rss = _peak_rss_kb(resource.RUSAGE_CHILDREN)
+    else:
+        rss = _peak_rss_kb(resource.RUSAGE_SELF)
+    return {"seconds": seconds, "rows": rows, "peak_rss_kb": rss}
+
+
+def measure(case, db_path, preview, repeat):
+    """
+    在 repeat 个全新进程中各跑一次 case，返回耗时中位数那次的结果（峰值内存取最大值）。
+    """
+    samples = []
+    for _ in range(repeat):
+        cmd = [sys.executable, os.path.abspath(__file__), "--case", case, "--db", db_path, "--preview", str(preview)]
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        if p.returncode != 0:
+            raise Exception("测试项 %s 运行失败：%s" % (case, err.decode("utf-8", "replace").strip().splitlines()[-1:]))
+        samples.append(json.loads(out.decode("utf-8").strip().splitlines()[-1]))
+    samples.sort(key=lambda x: x["seconds"])
+    result = dict(samples[len(samples) // 2])
+    rss = [x["peak_rss_kb"] for x in samples if x["peak_rss_kb"] is not None]
+    result["peak_rss_kb"] = max(rss) if rss else None
+    result["rows_per_sec"] = result["rows"] / result["seconds"] if result["seconds"] > 0 else None
+    return result
+
+
+def load_baseline(path):
+    """
+    读取基线文件，返回 (生成基线的 Python 版本, 结果字典)；文件不存在时返回 (None, {})。
+    """
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+        return data.get("python"), data.get("results", {})
+    except Exception:
+        return None, {}
+
+
+def save_baseline(path, results):
+    dir_path = os.path.dirname(path) or "."
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+    with open(path, "w") as f:
+        json.dump({"python": sys.version.split()[0], "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   "results": results}, f, indent=2, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark query and compose hot paths on synthetic SQLite data")
+    parser.add_argument("--rows", default="100000", help="每张表的行数，多个用逗号分隔，例如 100000,1000000,10000000")
+    parser.add_argument("--dup-ratio", type=float, default=0.1, help="bd_jobbasfil 中重复 jobcode 行的比例（0~1）")
+    parser.add_argument("--fail-ratio", type=float, default=0.01, help="两张表中失败状态行的比例（0~1）")
+    parser.add_argument("--preview", type=int, default=5, help="消息预览条数（同 main_py2 --preview）")
+    parser.add_argument("--repeat", type=int, default=3, help="每项运行次数（取中位数）")
+    parser.add_argument("--cases", default=",".join(CASES), help="要运行的测试项，逗号分隔")
+    parser.add_argument("--data-dir", default="bench_data", help="测试库与基线文件所在目录")
+    parser.add_argument("--baseline", default=None, help="基线文件路径，默认 <data-dir>/baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--threshold", type=float, default=0.2, help="比基线慢超过该比例视为退步（0.2 表示 20%%）")
+    # 内部使用：在子进程中运行单个测试项
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.db, args.preview)))
+        return 0
+
+    baseline_path = args.baseline or os.path.join(args.data_dir, "baseline.json")
+    baseline_python, baseline = load_baseline(baseline_path)
+    if baseline and str(baseline_python) != sys.version.split()[0]:
+        print("注意：基线由 Python %s 生成，与当前 Python %s 不同，对比结果仅供参考" % (str(baseline_python), sys.version.split()[0]))
+    cases = [x.strip() for x in args.cases.split(",") if x.strip()]
+    results = {}
+    regressions = []
+    for rows in [int(x) for x in args.rows.split(",") if x.strip()]:
+        path = fixture_path(args.data_dir, rows, args.dup_ratio, args.fail_ratio)
+        if not os.path.isfile(path):
+            start = time.time()
+            print("正在生成测试库 %s ..." % path)
+            build_fixture(path, rows, args.dup_ratio, args.fail_ratio)
+            print("测试库生成完成（耗时 %.1f 秒）" % (time.time() - start))
+        print("%d 行（重复比例 %g，失败比例 %g），每项 %d 次取中位数：" % (rows, args.dup_ratio, args.fail_ratio, args.repeat))
+        print("  %-28s %10s %14s %12s  %s" % ("测试项", "耗时(秒)", "吞吐(行/秒)", "峰值RSS(MB)", "对比基线"))
+        for case in cases:
+            key = "%s/%d/dup%g/fail%g/preview%d" % (case, rows, args.dup_ratio, args.fail_ratio, args.preview)
+            result = measure(case, path, args.preview, args.repeat)
+            results[key] = result
+            compare = "-"
+            base = baseline.get(key)
+            if base and base.get("seconds"):
+                change = (result["seconds"] - base["seconds"]) / base["seconds"]
+                compare = "%+.1f%%" % (change * 100)
+                if change > args.threshold:
+                    compare += " 退步"
+                    regressions.append(key)
+            print("  %-28s %10.3f %14s %12s  %s" % (
+                case,
+                result["seconds"],
+                "%.0f" % result["rows_per_sec"] if result["rows_per_sec"] else "-",
+                "%.1f" % (result["peak_rss_kb"] / 1024.0) if result["peak_rss_kb"] else "-",
+                compare,
+            ))
+
+    if args.save_baseline:
+        merged = dict(baseline)
+        merged.update(results)
+        save_baseline(baseline_path, merged)
+        print("已保存基线：%s" % baseline_path)
+    if regressions:
+        print("以下测试项比基线慢超过 %.0f%%：%s" % (args.threshold * 100, ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
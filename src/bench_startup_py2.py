@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+启动耗时基准（Python 2.7 兼容）
+
+用小白能懂的话：
+- cron 模式下脚本每分钟都要重新启动一次，导入模块花的时间每次都要付。
+- 这个脚本在全新的 Python 进程里分别导入各个模块，测出每个模块的导入耗时（取多次的中位数），
+  并单独测出每个数据库驱动的导入耗时，方便发现“某次改动让启动变慢了”。
+- 同时检查导入 db_client_py2 之后有没有顺带加载数据库驱动（驱动应该在第一次连接时才导入）。
+
+用法：
+    python src/bench_startup_py2.py                 # 默认每项测 5 次
+    python src/bench_startup_py2.py --repeat 10
+    python src/bench_startup_py2.py --max-ms 300    # main_py2 导入超过 300 毫秒时退出码为 1（可放进 CI）
+    python src/bench_startup_py2.py --importtime    # Python 3.7+：额外列出导入最慢的模块（-X importtime）
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+from db_client_py2 import DRIVER_ORDER
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+# 按依赖从底层到入口排列；每一项都在全新进程里单独导入
+MODULES = [
+    "sqlite3",
+    "metrics_py2",
+    "runlog_py2",
+    "breaker_py2",
+    "template_py2",
+    "http_transport_py2",
+    "db_client_py2",
+    "checks_py2",
+    "sender_py2",
+    "outbox_py2",
+    "result_cache_py2",
+    "wecom_client_py2",
+    "main_py2",
+]
+
+_TIMER = (
+    "import sys, time\n"
+    "sys.path.insert(0, %r)\n"
+    "t = time.time()\n"
+    "try:\n"
+    "    __import__(%r)\n"
+    "except Exception:\n"
+    "    print('-1')\n"
+    "    sys.exit(0)\n"
+    "print('%%.3f' %% ((time.time() - t) * 1000))\n"
+)
+
+_LOADED_DRIVERS = (
+    "import sys\n"
+    "sys.path.insert(0, %r)\n"
+    "import db_client_py2\n"
+    "print(' '.join(sorted(n for n in %r if n in sys.modules)))\n"
+)
+
+
+def _run(code, extra_args=None):
+    cmd = [sys.executable] + (extra_args or []) + ["-c", code]
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=SRC_DIR)
+    out, err = p.communicate()
+    return out.decode("utf-8", "replace"), err.decode("utf-8", "replace")
+
+
+def _median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+
+def time_import(module, repeat):
+    """
+    在 repeat 个全新进程中导入 module，返回导入耗时的中位数（毫秒）；导入失败返回 None。
+    """
+    samples = []
+    for _ in range(repeat):
+        out, _ = _run(_TIMER % (SRC_DIR, module))
+        value = float(out.strip() or -1)
+        if value < 0:
+            return None
+        samples.append(value)
+    return _median(samples)
+
+
+def loaded_drivers():
+    """
+    返回导入 db_client_py2 后已经被加载的数据库驱动模块名列表（正常应为空）。
+    """
+    names = [n for order in DRIVER_ORDER.values() for n in order]
+    out, _ = _run(_LOADED_DRIVERS % (SRC_DIR, names))
+    return out.split()
+
+
+def slowest_imports(module, top):
+    """
+    用 python -X importtime 导入 module，返回自身耗时最长的 top 个模块 [(微秒, 模块名)]。
+    """
+    _, err = _run("import sys; sys.path.insert(0, %r); import %s" % (SRC_DIR, module), ["-X", "importtime"])
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) == 3:
+            rows.append((int(parts[0].strip()), parts[2].strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import-time breakdown of the alert script")
+    parser.add_argument("--repeat", type=int, default=5, help="每项测量次数（取中位数）")
+    parser.add_argument("--max-ms", type=float, default=0, help="main_py2 导入耗时上限（毫秒），超过时退出码为 1；0 表示不检查")
+    parser.add_argument("--importtime", action="store_true", help="列出导入 main_py2 时最慢的模块（需要 Python 3.7+）")
+    parser.add_argument("--top", type=int, default=15, help="--importtime 时列出的模块数")
+    args = parser.parse_args()
+
+    print("Python %s，每项 %d 次取中位数" % (sys.version.split()[0], args.repeat))
+    print("模块导入耗时（毫秒，含其依赖）：")
+    results = {}
+    for module in MODULES:
+        ms = time_import(module, args.repeat)
+        results[module] = ms
+        print("  %-22s %s" % (module, "导入失败" if ms is None else "%8.1f" % ms))
+
+    print("数据库驱动导入耗时（毫秒，第一次连接对应数据库时才会付出）：")
+    for kind in sorted(DRIVER_ORDER):
+        for name in DRIVER_ORDER[kind]:
+            ms = time_import(name, 1)
+            print("  %-10s %-10s %s" % (kind, name, "未安装" if ms is None else "%8.1f" % ms))
+
+    drivers = loaded_drivers()
+    print("导入 db_client_py2 后已加载的驱动：%s" % (" ".join(drivers) if drivers else "无"))
+
+    if args.importtime:
+        if sys.version_info < (3, 7):
+            print("-X importtime 需要 Python 3.7+，已跳过")
+        else:
+            print("导入 main_py2 时自身耗时最长的模块（微秒）：")
+            for us, name in slowest_imports("main_py2", args.top):
+                print("  %8d  %s" % (us, name))
+
+    failed = bool(drivers)
+    main_ms = results.get("main_py2")
+    if args.max_ms and (main_ms is None or main_ms > args.max_ms):
+        print("main_py2 导入耗时超过上限 %.1f 毫秒" % args.max_ms)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
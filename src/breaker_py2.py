@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+数据库熔断器与端口探测（Python 2.7 兼容）
+
+用小白能懂的话：
+- 数据库主机宕机或网络不通时，每次连接都要等满驱动的 connect_timeout（默认 8 秒）才报错；
+  同一台库上的几个查询各等一遍，一轮就被拖慢十几秒，甚至拖进下一分钟的 cron。
+- 熔断器按数据库地址（host:port）记录连续失败次数：
+  - 正常（没有失败记录）时什么都不做，直接连接；
+  - 有失败记录时，先用 TCP 连一下端口（probe_timeout 秒，默认 1 秒）探测，端口不通就直接报错，不再等驱动超时；
+  - 连续失败达到 failure_threshold 次后“熔断”：open_seconds 秒内直接跳过这个库（几乎不花时间）；
+  - 熔断时间过后只放行一个调用去探测（其他调用继续跳过），端口通了就放行一次真正的连接，连接成功即恢复正常；
+    探测失败则重新熔断 open_seconds 秒。
+- 状态保存在本地 JSON 文件（默认 state/breaker.json），cron 每次启动新进程也知道哪个库已经熔断；
+  读改写状态文件时加文件锁，cron 进程与常驻进程同时更新也不会互相覆盖。
+
+配置见 [breaker] 配置节，默认不启用。
+"""
+
+import os
+import json
+import time
+import socket
+import threading
+try:
+    import fcntl  # Linux / macOS 文件锁
+except Exception:
+    fcntl = None
+
+from metrics_py2 import add, stage
+
+
+def check_port(host, port, timeout=5):
+    """
+    端口连通性小测试：尝试 TCP 连接 host:port，成功返回 True，失败返回 False。
+    这个不等于数据库能用，只是说明网络层能到达。
+    """
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect((host, int(port)))
+        sock.close()
+        return True
+    except Exception:
+        return False
+
+
+class _FileLock(object):
+    """
+    状态文件的互斥锁：同一进程内的线程用 thread_lock 互斥，
+    跨进程（cron 进程与常驻进程）再用 fcntl.flock 锁住 path（为空时只用线程锁）。
+    """
+
+    def __init__(self, thread_lock, path):
+        self._thread_lock = thread_lock
+        self.path = path
+        self._f = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            if self.path:
+                dir_path = os.path.dirname(self.path) or "."
+                if not os.path.isdir(dir_path):
+                    os.makedirs(dir_path)
+                self._f = open(self.path, "a")
+                if fcntl is not None:
+                    fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+        except Exception:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self._f is not None:
+                if fcntl is not None:
+                    fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+                self._f.close()
+                self._f = None
+        finally:
+            self._thread_lock.release()
+        return False
+
+
+class CircuitBreaker(object):
+    """
+    按数据库地址（host:port）熔断（线程安全）。
+
+    - enabled：是否启用（不启用时所有方法都不做任何事）
+    - path：状态文件路径（留空表示只在进程内记住）
+    - failure_threshold：连续失败多少次后熔断
+    - open_seconds：熔断后多少秒内直接跳过，不再连接
+    - probe_timeout：有失败记录时，连接前 TCP 探测的超时（秒）
+    """
+
+    def __init__(self, enabled=False, path="", failure_threshold=2, open_seconds=300, probe_timeout=1.0,
+                 clock=time.time, probe=check_port):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._probe = probe
+        self._state = {}
+        self.configure(enabled, path, failure_threshold, open_seconds, probe_timeout)
+
+    def configure(self, enabled=False, path="", failure_threshold=2, open_seconds=300, probe_timeout=1.0):
+        """
+        按 [breaker] 配置调整参数，并从状态文件读入各数据库的失败记录。
+        """
+        with self._lock:
+            self.enabled = enabled
+            self.path = path
+            self.failure_threshold = max(1, int(failure_threshold))
+            self.open_seconds = float(open_seconds)
+            self.probe_timeout = float(probe_timeout)
+        if enabled and path:
+            with self._locked():
+                self._state = self._load()
+
+    def _locked(self):
+        # 读改写状态前加锁；有状态文件时同时加跨进程文件锁，并在锁内重新读入最新状态
+        return _FileLock(self._lock, self.path + ".lock" if self.enabled and self.path else "")
+
+    def _reload(self):
+        if self.path:
+            self._state = self._load()
+
+    def _load(self):
+        try:
+            if not os.path.isfile(self.path):
+                return {}
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception:
+            return {}
+
+    def _save(self):
+        # 先写临时文件再改名，避免写到一半进程被杀导致文件损坏
+        if not self.path:
+            return
+        dir_path = os.path.dirname(self.path) or "."
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(self._state, f, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def before_connect(self, host, port):
+        """
+        连接 host:port 之前调用：熔断中或端口探测失败时直接抛出异常（不再去连接）。
+        """
+        if not self.enabled:
+            return
+        target = "%s:%s" % (host, port)
+        with self._locked():
+            self._reload()
+            entry = self._state.get(target)
+            if not entry or not entry.get("failures"):
+                return
+            now = self._clock()
+            opened_at = entry.get("opened_at")
+            if opened_at is not None:
+                remaining = opened_at + self.open_seconds - now
+                if remaining <= 0 and entry.get("probing_until", 0) > now:
+                    # 熔断时间已过，但这一轮的探测名额已被别的调用（或进程）拿走
+                    remaining = entry["probing_until"] - now
+                if remaining > 0:
+                    failures = entry["failures"]
+                else:
+                    # 半开：只放行这一个调用去探测，名额保留一个熔断周期，期间其他调用继续跳过
+                    entry["probing_until"] = now + self.open_seconds
+                    self._save()
+        if opened_at is not None and remaining > 0:
+            add("breaker_skips", target=target)
+            raise Exception("数据库 %s 已熔断（连续失败 %d 次），%.0f 秒后再探测，本轮跳过"
+                            % (target, failures, remaining))
+        # 有失败记录（或熔断时间已过）：先探测端口，端口不通就不用等驱动的连接超时
+        with stage("probe", target=target):
+            ok = self._probe(host, port, self.probe_timeout)
+        if not ok:
+            self.record_failure(host, port)
+            raise Exception("数据库 %s 端口不通（%.1f 秒内 TCP 探测失败）" % (target, self.probe_timeout))
+
+    def record_success(self, host, port):
+        """连接成功：清除该地址的失败记录。"""
+        if not self.enabled:
+            return
+        target = "%s:%s" % (host, port)
+        with self._locked():
+            self._reload()
+            if target not in self._state:
+                return
+            del self._state[target]
+            self._save()
+        print("数据库 %s 已恢复连接" % target)
+
+    def record_failure(self, host, port):
+        """连接失败：累加失败次数，达到 failure_threshold 时（重新）开始熔断。"""
+        if not self.enabled:
+            return
+        target = "%s:%s" % (host, port)
+        with self._locked():
+            self._reload()
+            entry = self._state.setdefault(target, {"failures": 0, "opened_at": None})
+            entry["failures"] += 1
+            failures = entry["failures"]
+            opened = failures >= self.failure_threshold
+            if opened:
+                entry["opened_at"] = self._clock()
+                entry.pop("probing_until", None)
+            self._save()
+        if opened:
+            add("breaker_opens", target=target)
+            print("数据库 %s 连续失败 %d 次，熔断 %.0f 秒" % (target, failures, self.open_seconds))
+
+    def status(self):
+        """
+        返回各地址的失败记录副本 {"host:port": {"failures": 次数, "opened_at": 熔断开始时间或 None}}；
+        熔断时间已过、正在探测的地址另有 "probing_until"（探测名额的到期时间）。
+        """
+        with self._lock:
+            return dict((k, dict(v)) for k, v in self._state.items())
+
+
+# 进程内共享的熔断器：默认不启用，由 main_py2 按 [breaker] 配置节调用 configure_breaker
+BREAKER = CircuitBreaker()
+
+
+def configure_breaker(enabled=False, path="", failure_threshold=2, open_seconds=300, probe_timeout=1.0):
+    """
+    按 [breaker] 配置调整全局熔断器。
+    """
+    BREAKER.configure(enabled, path, failure_threshold, open_seconds, probe_timeout)
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+声明式检查：在配置文件里用 [check:名称] 配置节描述“查什么、怎么展示”（Python 2.7 兼容）
+
+用小白能懂的话：
+- 以前每加一个检查就要写一个查询函数、一个文本组装函数、一个 Markdown 组装函数，再在主流程里加一段。
+- 现在只需在 config.ini 里加一个配置节，例如：
+
+    [check:failed_push]
+    source=db_mysql
+    sql=SELECT id, field0001 FROM formmain_1559 WHERE field0045 = :status ORDER BY id DESC
+    param.status=2
+    key=field0001
+    title=以下项目推送不成功
+    item_text={field0001}
+
+- SQL 里用 :名称 作为参数占位符，参数值写在 param.名称 里（不要把值直接拼进 SQL）。
+  占位符会按驱动自动换成 ? 或 %s，同一个检查只转换一次，之后直接复用。
+- 所有检查由同一个执行器运行：同一个数据库（source 相同）的检查放在一组，
+  共用一个连接依次执行，而不是每个检查各开一个连接。
+- interval 表示这个检查至少隔多少秒才执行一次（常驻模式下有效；0 表示每轮都执行）。
+  启用 [result_cache] 后改由结果缓存判断（cron 模式也有效，没到时间时使用缓存的结果）。
+- 同一组有多个检查时，MySQL / SQL Server 会把所有 SQL 拼成一批、一次发给服务器（一个来回），
+  再用 nextset() 逐个取回各检查的结果集；这一批在同一个一致性快照里执行，各检查看到的是同一时刻的数据。
+  批量执行出错（例如某个检查的 SQL 写错）时自动改为逐个执行，不影响其他检查。
+"""
+
+import re
+import threading
+import time
+
+from db_client_py2 import drain_cursor, iter_dict_rows, paramstyle_of, run_on_connection, stream_cursor, timed_execute
+from metrics_py2 import labels
+from template_py2 import compile_template
+
+CHECK_PREFIX = "check:"
+# 检查可以使用的数据库连接（对应同名配置节）
+CHECK_SOURCES = ("db", "db_mysql")
+_NAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def _text(value):
+    # Python 2 的 ConfigParser 返回 UTF-8 字节串；消息模板统一转成 unicode，避免与中文拼接时出错
+    if value is not None and not isinstance(value, type(u"")):
+        return value.decode("utf-8")
+    return value
+
+
+def _split_list(value):
+    return [x.strip() for x in (value or "").split("|") if x.strip()]
+
+
+def read_checks(cp):
+    """
+    从 ConfigParser 中读取所有 [check:名称] 配置节，按配置文件中的顺序返回检查列表。
+
+    每个检查是一个字典：
+    - name：检查名称（配置节名去掉 "check:"）
+    - source：使用哪个数据库连接，"db" 或 "db_mysql"
+    - sql：查询语句，参数用 :名称 占位
+    - params：参数字典 {名称: 值}（来自 param.名称 配置项；名称会被转成小写）
+    - key：条目的唯一键字段（差异推送用，可选）
+    - display：展示的字段列表（用 | 分隔；为空时展示全部字段）
+    - title：消息标题；title_text / title_markdown / item_text / item_markdown：消息模板（可选）
+    - filter_blank：是否去掉 key 字段为空的行
+    - interval：最短执行间隔（秒）
+    - timeout：查询截止时间（秒），None 表示使用 [query] timeout
+    - channels：发送到哪些通道（用 | 分隔，例如 robot:product|app；为空时按 [routes] 或默认通道）
+    """
+    checks = []
+    for section in cp.sections():
+        if not section.startswith(CHECK_PREFIX):
+            continue
+        name = section[len(CHECK_PREFIX):].strip()
+        if not _NAME_RE.match(name) or _NAME_RE.match(name).group(0) != name:
+            raise Exception("检查名称只能包含字母、数字和下划线：[%s]" % section)
+
+        def opt(option, default=None):
+            return cp.get(section, option, raw=True) if cp.has_option(section, option) else default
+
+        if (opt("enabled", "true") or "").lower() not in ["true", "1", "yes"]:
+            continue
+        source = (opt("source") or "").strip()
+        if source not in CHECK_SOURCES:
+            raise Exception("[%s] 的 source 必须是 %s 之一" % (section, " / ".join(CHECK_SOURCES)))
+        sql = (opt("sql") or "").strip()
+        if not sql:
+            raise Exception("[%s] 缺少 sql 配置" % section)
+        params = {}
+        for option, value in cp.items(section, raw=True):
+            if option.startswith("param."):
+                params[option[len("param."):].lower()] = value
+        check = {
+            "name": name,
+            "source": source,
+            "sql": sql,
+            "params": params,
+            "key": (opt("key") or "").strip() or None,
+            "display": _split_list(opt("display")),
+            "title": _text(opt("title") or name),
+            "title_text": _text(opt("title_text")),
+            "title_markdown": _text(opt("title_markdown")),
+            "item_text": _text(opt("item_text")),
+            "item_markdown": _text(opt("item_markdown")),
+            "filter_blank": (opt("filter_blank", "false") or "").lower() in ["true", "1", "yes"],
+            "interval": float(opt("interval") or 0),
+            "timeout": float(opt("timeout")) if opt("timeout") else None,
+            "channels": _split_list(opt("channels")),
+        }
+        validate_templates(check)
+        checks.append(check)
+    return checks
+
+
+def validate_templates(check):
+    """
+    启动时编译并检查一个检查的消息模板，写错的占位符立即报错。
+
+    - 标题模板只能用 {title} {count}
+    - 配置了 display 时，条目模板只能用 display 和 key 中的字段；
+      没有配置 display 时字段要等查询后才知道，某行缺少的字段显示为空
+    """
+    where = u"[check:%s]" % _text(check["name"])
+    for option in ("title_text", "title_markdown"):
+        if check[option]:
+            compile_template(check[option]).validate(["title", "count"], u"%s %s" % (where, option))
+    columns = list(check["display"]) + ([check["key"]] if check["key"] else [])
+    for option in ("item_text", "item_markdown"):
+        if check[option]:
+            tpl = compile_template(check[option])
+            if check["display"]:
+                tpl.validate(columns, u"%s %s" % (where, option))
+
+
+def compile_sql(sql, paramstyle):
+    """
+    把 :名称 占位符转换成驱动使用的占位符。
+
+    参数：
+    - sql：配置中的 SQL
+    - paramstyle："qmark"（?）或 "format"（%s）
+
+    返回：
+    - (转换后的 SQL, 参数名列表)；参数名按在 SQL 中出现的顺序，名称统一为小写
+
+    说明：
+    - 引号（' " `）中的内容不做替换，"::" 也不会被当作占位符
+    - format 风格下 SQL 中原有的 % 会被转义为 %%
+    """
+    out = []
+    names = []
+    quote = None
+    i = 0
+    n = len(sql)
+    while i < n:
+        ch = sql[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"', "`"):
+            quote = ch
+        elif ch == ":" and i + 1 < n and sql[i + 1] != ":" and (i == 0 or sql[i - 1] != ":"):
+            m = _NAME_RE.match(sql, i + 1)
+            if m:
+                names.append(m.group(0).lower())
+                out.append("?" if paramstyle == "qmark" else "%s")
+                i = m.end()
+                continue
+        if ch == "%" and paramstyle == "format":
+            out.append("%%")
+        else:
+            out.append(ch)
+        i += 1
+    return "".join(out), names
+
+
+class CheckExecutor(object):
+    """
+    检查执行器：按数据库分组执行检查，缓存转换后的 SQL，记录每个检查上次执行的时间。
+
+    常驻模式下同一个执行器跨轮次使用，interval 才能生效。
+    """
+
+    def __init__(self, clock=time.time, batch=True, sqlserver_snapshot=False):
+        self._clock = clock
+        self.batch = batch
+        self.sqlserver_snapshot = sqlserver_snapshot
+        self._statements = {}
+        self._last_run = {}
+        self._lock = threading.Lock()
+
+    def configure(self, batch=None, sqlserver_snapshot=None):
+        """
+        调整批量执行参数（None 表示不修改）。
+
+        - batch：同一数据库的多个检查是否合并成一批执行
+        - sqlserver_snapshot：SQL Server 批量执行时是否使用 SNAPSHOT 隔离级别
+          （需要数据库已开启 ALLOW_SNAPSHOT_ISOLATION）
+        """
+        if batch is not None:
+            self.batch = batch
+        if sqlserver_snapshot is not None:
+            self.sqlserver_snapshot = sqlserver_snapshot
+
+    def statement(self, check, paramstyle):
+        """
+        返回 (转换后的 SQL, 参数值列表)；同一检查、同一占位符风格只转换一次。
+        """
+        cache_key = (check["name"], check["sql"], paramstyle)
+        with self._lock:
+            compiled = self._statements.get(cache_key)
+            if compiled is None:
+                compiled = compile_sql(check["sql"], paramstyle)
+                self._statements[cache_key] = compiled
+        sql, names = compiled
+        missing = [x for x in names if x not in check["params"]]
+        if missing:
+            raise Exception("[check:%s] 缺少参数：%s" % (check["name"], ", ".join("param." + x for x in missing)))
+        return sql, [check["params"][x] for x in names]
+
+    def due(self, checks, now=None):
+        """
+        返回到了执行时间的检查（从未执行过、或距上次执行已超过 interval 秒）。
+        """
+        now = self._clock() if now is None else now
+        with self._lock:
+            return [
+                c for c in checks
+                if c["name"] not in self._last_run or now - self._last_run[c["name"]] >= c["interval"]
+            ]
+
+    def mark_run(self, names, now=None):
+        """记录这些检查本次已执行。"""
+        now = self._clock() if now is None else now
+        with self._lock:
+            for name in names:
+                self._last_run[name] = now
+
+    def _batch_sql(self, driver, checks, paramstyle):
+        """
+        把一组检查拼成一批 SQL。
+
+        返回：(批量 SQL, 参数列表)
+        """
+        parts = []
+        params = []
+        for check in checks:
+            sql, values = self.statement(check, paramstyle)
+            parts.append(sql.rstrip().rstrip(";"))
+            params.extend(values)
+        if driver == "mysql":
+            # 同一个一致性快照：START TRANSACTION 之后的所有 SELECT 读到的是同一时刻的数据
+            parts = ["START TRANSACTION WITH CONSISTENT SNAPSHOT"] + parts + ["COMMIT"]
+        elif self.sqlserver_snapshot:
+            parts = ["SET NOCOUNT ON", "SET TRANSACTION ISOLATION LEVEL SNAPSHOT", "BEGIN TRANSACTION"] + parts + ["COMMIT"]
+        else:
+            parts = ["SET NOCOUNT ON"] + parts
+        return ";\n".join(parts), params
+
+    def _run_batched(self, conn, driver, checks, consume):
+        sql, params = self._batch_sql(driver, checks, paramstyle_of(conn))
+        results = {}
+        # MySQL 用服务端游标逐行读取，待处理的行再多也不会一次性全部拉到内存
+        cur = stream_cursor(conn)
+        try:
+            timed_execute(cur, sql, params)
+            index = 0
+            while True:
+                # START TRANSACTION / COMMIT 等语句没有结果集（description 为 None），跳过
+                if cur.description is not None:
+                    if index >= len(checks):
+                        raise Exception("批量查询返回的结果集多于检查数量")
+                    check = checks[index]
+                    with labels(check=check["name"]):
+                        results[check["name"]] = consume(check, iter_dict_rows(cur))
+                    drain_cursor(cur)
+                    index += 1
+                if not cur.nextset():
+                    break
+            if index != len(checks):
+                raise Exception("批量查询只返回了 %d 个结果集（应为 %d 个）" % (index, len(checks)))
+        finally:
+            try:
+                cur.close()
+            except Exception:
+                pass
+        return results
+
+    def _run_each(self, conn, checks, consume):
+        style = paramstyle_of(conn)
+        results = {}
+        errors = []
+        for check in checks:
+            cur = None
+            try:
+                sql, params = self.statement(check, style)
+                cur = stream_cursor(conn)
+                with labels(check=check["name"]):
+                    timed_execute(cur, sql, params)
+                    results[check["name"]] = consume(check, iter_dict_rows(cur))
+                    drain_cursor(cur)
+            except Exception as e:
+                results[check["name"]] = e
+                errors.append(e)
+            finally:
+                if cur is not None:
+                    try:
+                        cur.close()
+                    except Exception:
+                        pass
+        if errors and len(errors) == len(checks):
+            raise errors[0]
+        return results
+
+    def run_group(self, db_cfg, checks, consume):
+        """
+        在同一个数据库连接上执行一组检查。
+
+        参数：
+        - db_cfg：连接配置（[db] 或 [db_mysql]）
+        - checks：这一组的检查列表（source 相同）
+        - consume：函数 consume(check, rows)，rows 为逐行产出字典的生成器，返回值作为该检查的结果
+
+        返回：
+        - 字典 {检查名: 结果}；单个检查失败时结果为异常对象，不影响同组其他检查
+          （全部失败时直接抛出第一个异常，让连接池有机会换新连接重试）
+
+        说明：
+        - MySQL / SQL Server 且多于一个检查时合并成一批执行（一个网络来回）；批量失败时回滚并改为逐个执行
+        - SQLite 是本地文件，没有网络来回，逐个执行，但放在同一个读事务里保证数据一致
+        """
+        driver = db_cfg.get("driver") or "mysql"
+
+        def run(conn):
+            if self.batch and len(checks) > 1 and driver in ("mysql", "sqlserver"):
+                try:
+                    return self._run_batched(conn, driver, checks, consume)
+                except Exception as e:
+                    print("批量执行检查失败，改为逐个执行：%s" % str(e))
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+            if driver == "sqlite" and len(checks) > 1:
+                conn.execute("BEGIN")
+                try:
+                    return self._run_each(conn, checks, consume)
+                finally:
+                    conn.rollback()
+            return self._run_each(conn, checks, consume)
+
+        return run_on_connection(db_cfg, run)
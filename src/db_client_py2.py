@@ -10,40 +10,102 @@
 """
 
 import os
+import re
 import sqlite3
 import time
 import sys
+import atexit
+import threading
+
+from metrics_py2 import METRICS, observe, stage
+from breaker_py2 import BREAKER
+
+# 数据库驱动按需导入：第一次真正连接某种数据库时才尝试导入，导入结果（成功或失败）缓存起来。
+# 只用 SQLite 的配置不会去加载任何 SQL Server / MySQL 驱动（有些驱动会加载原生库，导入很慢）。
+# 默认优先顺序：SQL Server 优先 pymssql，其次 pyodbc、pytds；MySQL 优先 MySQLdb，其次 pymysql。
+DRIVER_ORDER = {
+    "sqlserver": ("pymssql", "pyodbc", "pytds"),
+    "mysql": ("MySQLdb", "pymysql"),
+}
+_DRIVER_INSTALL_HINT = {
+    "sqlserver": "请安装 pymssql、pyodbc 或 python-tds（pytds）",
+    "mysql": "请安装 MySQL-python 或 pymysql",
+}
+_DRIVER_NAMES = {"sqlserver": "SQL Server", "mysql": "MySQL"}
+_driver_modules = {}
+# 每个数据源（连接池键）单独配置的驱动优先顺序
+_source_drivers = {}
+_driver_lock = threading.Lock()
+
+
+def load_driver(name):
+    """
+    导入名为 name 的驱动模块，返回模块对象；未安装或导入失败时返回 None。
+    同一个驱动只尝试导入一次，结果会被缓存。
+    """
+    with _driver_lock:
+        if name not in _driver_modules:
+            try:
+                with stage("driver_import", driver=name):
+                    _driver_modules[name] = __import__(name)
+            except Exception:
+                _driver_modules[name] = None
+        return _driver_modules[name]
+
+
+def _check_driver_names(kind, names):
+    for name in names:
+        if name not in DRIVER_ORDER[kind]:
+            raise Exception("不支持的 %s 驱动：%s（可选：%s）" % (_DRIVER_NAMES[kind], name, "、".join(DRIVER_ORDER[kind])))
+
+
+def resolve_driver(kind, order=None):
+    """
+    按优先顺序找到第一个可用的驱动。
+
+    参数：
+    - kind："sqlserver" 或 "mysql"
+    - order：驱动名列表（None 表示使用 DRIVER_ORDER 中的默认顺序）
+
+    返回：
+    - (驱动名, 模块对象)；没有可用驱动时抛出异常
+    """
+    order = order or DRIVER_ORDER[kind]
+    _check_driver_names(kind, order)
+    for name in order:
+        module = load_driver(name)
+        if module is not None:
+            return name, module
+    raise Exception("未检测到可用的 %s 驱动：%s" % (_DRIVER_NAMES[kind], _DRIVER_INSTALL_HINT[kind]))
+
+
+def _pool_key(db_cfg):
+    driver = db_cfg.get("driver") or "mysql"
+    port = db_cfg.get("port") or (1433 if driver == "sqlserver" else 3306)
+    return (driver, db_cfg.get("host"), int(port), db_cfg.get("database"), db_cfg.get("user"))
+
+
+def configure_drivers(db_cfg):
+    """
+    按数据源配置（[db] / [db_mysql] 的 drivers 项）登记该数据源的驱动优先顺序。
+    没有配置 drivers 时使用默认顺序。
+    """
+    kind = db_cfg.get("driver") or "mysql"
+    if kind not in DRIVER_ORDER:
+        return
+    drivers = db_cfg.get("drivers") or None
+    _check_driver_names(kind, drivers or [])
+    with _driver_lock:
+        _source_drivers[_pool_key(db_cfg)] = drivers
+
+
+def _drivers_for(key):
+    with _driver_lock:
+        return _source_drivers.get(key)
 
-# 优先尝试 pymssql，其次 pyodbc，此外支持 pytds（用于 SQL Server 连接）
-_HAS_PYMSSQL = False
-_HAS_PYODBC = False
-_HAS_PYTDS = False
-try:
-    import pymssql
-    _HAS_PYMSSQL = True
-except Exception:
-    try:
-        import pyodbc
-        _HAS_PYODBC = True
-    except Exception:
-        try:
-            import pytds
-            _HAS_PYTDS = True
-        except Exception:
-            pass
-
-# MySQL 驱动检测
-_HAS_MYSQLDB = False
-_HAS_PYMYSQL = False
-try:
-    import MySQLdb
-    _HAS_MYSQLDB = True
-except Exception:
-    try:
-        import pymysql
-        _HAS_PYMYSQL = True
-    except Exception:
-        pass
+
+# 可以拼进 SQL 的字段名（来自配置文件）
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
 
 
 def ensure_dir(path):
@@ -63,11 +125,27 @@ def _connect_sqlite(sqlite_path):
     """
     dir_path = os.path.dirname(sqlite_path) or "."
     ensure_dir(dir_path)
-    conn = sqlite3.connect(sqlite_path)
+    with stage("connect"):
+        conn = sqlite3.connect(sqlite_path)
     return conn
 
 
-def _connect_sqlserver(host, user, password, database, port=1433, timeout=8):
+def _guarded_connect(host, port, open_fn):
+    """
+    经过熔断器建立网络连接：熔断中或端口不通时直接报错；连接结果记入熔断器，耗时计入 connect 阶段。
+    """
+    BREAKER.before_connect(host, port)
+    try:
+        with stage("connect"):
+            conn = open_fn()
+    except Exception:
+        BREAKER.record_failure(host, port)
+        raise
+    BREAKER.record_success(host, port)
+    return conn
+
+
+def _connect_sqlserver(host, user, password, database, port=1433, timeout=8, drivers=None):
     """
     连接到 SQL Server 数据库。
 
@@ -78,28 +156,32 @@ def _connect_sqlserver(host, user, password, database, port=1433, timeout=8):
     - database：数据库名，例如 "U8CLOUD202102"
     - port：端口（默认 1433）
     - timeout：连接超时时间（秒）
+    - drivers：驱动优先顺序，例如 ["pytds", "pymssql"]（None 表示默认顺序）
 
     返回：
-    - 连接对象（pymssql.Connection 或 pyodbc.Connection）
+    - 连接对象（pymssql.Connection、pyodbc.Connection 或 pytds.Connection）
 
     说明：
-    - 优先使用 pymssql（推荐 Linux 安装 FreeTDS），否则使用 pyodbc（需安装 Microsoft ODBC Driver）。
+    - 默认优先使用 pymssql（推荐 Linux 安装 FreeTDS），否则使用 pyodbc（需安装 Microsoft ODBC Driver），最后是 pytds。
     """
-    if _HAS_PYMSSQL:
-        return pymssql.connect(server=host, user=user, password=password, database=database, port=int(port), login_timeout=timeout, timeout=timeout, charset='utf8')
-    if _HAS_PYODBC:
+    name, module = resolve_driver("sqlserver", drivers)
+    return _guarded_connect(host, port, lambda: _open_sqlserver(name, module, host, user, password, database, port, timeout))
+
+
+def _open_sqlserver(name, module, host, user, password, database, port, timeout):
+    if name == "pymssql":
+        return module.connect(server=host, user=user, password=password, database=database, port=int(port), login_timeout=timeout, timeout=timeout, charset='utf8')
+    if name == "pyodbc":
         # 注意：pyodbc 需要系统已安装 ODBC 驱动（如 ODBC Driver 17 for SQL Server）
         dsn = 'DRIVER={ODBC Driver 17 for SQL Server};SERVER=%s,%d;DATABASE=%s;UID=%s;PWD=%s;TrustServerCertificate=Yes' % (
             host, int(port), database, user, password
         )
-        return pyodbc.connect(dsn, timeout=timeout)
-    if _HAS_PYTDS:
-        # pytds 为纯 Python 驱动，安装简单；这里启用 autocommit 方便查询
-        return pytds.connect(server=host, user=user, password=password, database=database, port=int(port), autocommit=True)
-    raise Exception('未检测到可用的 SQL Server 驱动：请安装 pymssql、pyodbc 或 python-tds（pytds）')
+        return module.connect(dsn, timeout=timeout)
+    # pytds 为纯 Python 驱动，安装简单；这里启用 autocommit 方便查询
+    return module.connect(server=host, user=user, password=password, database=database, port=int(port), autocommit=True)
 
 
-def _connect_mysql(host, user, password, database, port=3306, timeout=8):
+def _connect_mysql(host, user, password, database, port=3306, timeout=8, drivers=None):
     """
     连接到 MySQL 数据库。
 
@@ -110,17 +192,22 @@ def _connect_mysql(host, user, password, database, port=3306, timeout=8):
     - database：数据库名
     - port：端口（默认 3306）
     - timeout：连接超时时间（秒）
+    - drivers：驱动优先顺序，例如 ["pymysql"]（None 表示默认顺序）
 
     返回：
     - 连接对象（MySQLdb.Connection 或 pymysql.Connection）
 
     说明：
-    - 优先使用 MySQLdb，否则使用 pymysql（纯 Python 实现）
+    - 默认优先使用 MySQLdb，否则使用 pymysql（纯 Python 实现）
     - 安装方式：pip install MySQL-python 或 pip install pymysql
     """
-    if _HAS_MYSQLDB:
-        import MySQLdb
-        return MySQLdb.connect(
+    name, module = resolve_driver("mysql", drivers)
+    return _guarded_connect(host, port, lambda: _open_mysql(name, module, host, user, password, database, port, timeout))
+
+
+def _open_mysql(name, module, host, user, password, database, port, timeout):
+    if name == "MySQLdb":
+        return module.connect(
             host=host,
             user=user,
             passwd=password,
@@ -129,18 +216,363 @@ def _connect_mysql(host, user, password, database, port=3306, timeout=8):
             connect_timeout=timeout,
             charset='utf8'
         )
-    if _HAS_PYMYSQL:
-        import pymysql
-        return pymysql.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=database,
-            port=int(port),
-            connect_timeout=timeout,
-            charset='utf8'
+    # 同库多个检查合并成一批时一次发送多条语句（见 checks_py2）：MySQLdb 默认允许，
+    # PyMySQL 0.8 起默认不再允许，需要显式打开 MULTI_STATEMENTS
+    from pymysql.constants import CLIENT
+    return module.connect(
+        host=host,
+        user=user,
+        password=password,
+        database=database,
+        port=int(port),
+        connect_timeout=timeout,
+        charset='utf8',
+        client_flag=CLIENT.MULTI_STATEMENTS
+    )
+
+
+class ConnectionPool(object):
+    """
+    数据库连接池（MySQL / SQL Server 共用）。
+
+    用小白能懂的话：
+    - 建立数据库连接（TCP + 登录认证）往往比查询本身还慢，尤其是跨网段的库。
+    - 连接池把用完的连接先“放回池子”，下次同一个库（driver, host, port, database, user）直接拿来用。
+    - 拿出连接前，如果它闲置超过 ping_interval 秒，先 ping/SELECT 1 确认还活着；死了就重连。
+    - 闲置超过 max_idle_age 秒的连接直接关闭，避免被数据库服务端超时踢掉后还在池里。
+    - 线程安全：同一个连接同一时间只会借给一个调用方。
+    """
+
+    def __init__(self, max_idle_age=300, ping_interval=30, max_idle_per_key=4, enabled=True):
+        self.max_idle_age = max_idle_age
+        self.ping_interval = ping_interval
+        self.max_idle_per_key = max_idle_per_key
+        self.enabled = enabled
+        self._idle = {}  # key -> [(conn, last_used), ...]
+        self._lock = threading.Lock()
+
+    def configure(self, max_idle_age=None, ping_interval=None, max_idle_per_key=None, enabled=None):
+        """
+        按配置调整参数（常驻模式重新加载配置时也会调用）。
+        """
+        if max_idle_age is not None:
+            self.max_idle_age = max_idle_age
+        if ping_interval is not None:
+            self.ping_interval = ping_interval
+        if max_idle_per_key is not None:
+            self.max_idle_per_key = max_idle_per_key
+        if enabled is not None:
+            self.enabled = enabled
+            if not enabled:
+                self.close_all()
+
+    def acquire(self, key, factory):
+        """
+        借出一个连接。
+
+        返回：(conn, reused)；reused=True 表示来自池子（可能已被服务端断开）。
+        """
+        now = time.time()
+        while True:
+            with self._lock:
+                idle = self._idle.get(key) or []
+                item = idle.pop() if idle else None
+            if item is None:
+                return factory(), False
+            conn, last_used = item
+            if now - last_used > self.max_idle_age:
+                _close_quietly(conn)
+                continue
+            if now - last_used > self.ping_interval and not _ping(conn):
+                _close_quietly(conn)
+                continue
+            return conn, True
+
+    def release(self, key, conn):
+        """
+        归还连接。归还前回滚，结束只读事务，避免下次查询读到旧快照。
+        """
+        if not self.enabled:
+            _close_quietly(conn)
+            return
+        try:
+            conn.rollback()
+        except Exception:
+            _close_quietly(conn)
+            return
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_key:
+                idle.append((conn, time.time()))
+                return
+        _close_quietly(conn)
+
+    def discard(self, conn):
+        """出错的连接不放回池子，直接关闭。"""
+        _close_quietly(conn)
+
+    def run(self, key, factory, fn):
+        """
+        借一个连接执行 fn(conn) 并归还。
+
+        如果借到的是池里的旧连接且执行失败（常见于服务端已断开），自动换新连接重试一次；
+        新连接仍失败则把异常抛给调用方。
+        """
+        conn, reused = self.acquire(key, factory)
+        try:
+            result = fn(conn)
+        except Exception:
+            self.discard(conn)
+            if not reused:
+                raise
+            conn = factory()
+            try:
+                result = fn(conn)
+            except Exception:
+                self.discard(conn)
+                raise
+        self.release(key, conn)
+        return result
+
+    def close_all(self):
+        """关闭池中所有闲置连接（进程退出时自动调用）。"""
+        with self._lock:
+            items = []
+            for idle in self._idle.values():
+                items.extend(idle)
+            self._idle = {}
+        for conn, _ in items:
+            _close_quietly(conn)
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _ping(conn):
+    """
+    连接存活检查：MySQL 用 ping()，其他驱动执行 SELECT 1。成功返回 True。
+    """
+    try:
+        if hasattr(conn, "ping"):
+            conn.ping()
+            return True
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.fetchall()
+        cur.close()
+        return True
+    except Exception:
+        return False
+
+
+# 进程内共享的连接池：cron 模式一次运行内共享，常驻模式跨轮次共享
+_POOL = ConnectionPool()
+atexit.register(_POOL.close_all)
+
+
+def configure_pool(max_idle_age=None, ping_interval=None, max_idle_per_key=None, enabled=None):
+    """
+    按 [db_pool] 配置调整全局连接池参数。
+    """
+    _POOL.configure(max_idle_age, ping_interval, max_idle_per_key, enabled)
+
+
+def close_pool():
+    """关闭全局连接池中的所有闲置连接。"""
+    _POOL.close_all()
+
+
+def _run_on_sqlserver(host, user, password, database, port, fn):
+    """
+    从连接池借一个 SQL Server 连接执行 fn(conn)。
+    """
+    key = ("sqlserver", host, int(port), database, user)
+    return _POOL.run(key, lambda: _connect_sqlserver(host, user, password, database, port, drivers=_drivers_for(key)), fn)
+
+
+def _run_on_mysql(host, user, password, database, port, fn):
+    """
+    从连接池借一个 MySQL 连接执行 fn(conn)。
+    """
+    key = ("mysql", host, int(port), database, user)
+    return _POOL.run(key, lambda: _connect_mysql(host, user, password, database, port, drivers=_drivers_for(key)), fn)
+
+
+def run_on_connection(db_cfg, fn):
+    """
+    按配置借一个数据库连接执行 fn(conn)，返回 fn 的结果。
+
+    参数：
+    - db_cfg：连接配置字典（[db] 或 [db_mysql]），driver 为 sqlite / sqlserver / mysql
+    - fn：函数 fn(conn)
+
+    说明：
+    - MySQL / SQL Server 走连接池（借到的旧连接失效时换新连接重试一次）
+    - SQLite 连接不能跨线程共享，每次打开、用完即关（本地文件，打开几乎没有开销）
+    """
+    driver = db_cfg.get("driver") or "mysql"
+    if driver == "sqlite":
+        conn = _connect_sqlite(db_cfg["sqlite_path"])
+        try:
+            return fn(conn)
+        finally:
+            conn.close()
+    if driver == "sqlserver":
+        return _run_on_sqlserver(
+            db_cfg["host"], db_cfg["user"], db_cfg["password"], db_cfg["database"], db_cfg.get("port", 1433), fn
         )
-    raise Exception('未检测到可用的 MySQL 驱动：请安装 MySQL-python 或 pymysql')
+    if driver == "mysql":
+        return _run_on_mysql(
+            db_cfg["host"], db_cfg["user"], db_cfg["password"], db_cfg["database"], db_cfg.get("port", 3306), fn
+        )
+    raise Exception("不支持的数据库驱动：%s" % driver)
+
+
+def paramstyle_of(conn):
+    """
+    返回连接所用驱动的参数占位符风格："qmark"（?）或 "format"（%s）。
+
+    sqlite3 与 pyodbc 使用 ?；MySQLdb、pymysql、pymssql、pytds 使用 %s。
+    """
+    module = type(conn).__module__ or ""
+    if module.startswith("sqlite3") or module.startswith("pyodbc"):
+        return "qmark"
+    return "format"
+
+
+# 流式读取时每批从驱动取多少行（fetchmany）
+FETCH_BATCH = 500
+
+
+def timed_execute(cur, *args):
+    """
+    与 cur.execute(*args) 相同，耗时计入 execute 阶段，语句和参数另外记下供慢查询日志使用。
+    """
+    start = time.time()
+    try:
+        return cur.execute(*args)
+    finally:
+        seconds = time.time() - start
+        observe("execute", seconds)
+        METRICS.record_statement(args[0], args[1] if len(args) > 1 else None, seconds)
+
+
+def timed_fetchall(cur):
+    """
+    与 cur.fetchall() 相同，耗时计入 fetch 阶段。
+    """
+    with stage("fetch"):
+        return cur.fetchall()
+
+
+def timed_fetchone(cur):
+    """
+    与 cur.fetchone() 相同，耗时计入 fetch 阶段。
+    """
+    with stage("fetch"):
+        return cur.fetchone()
+
+
+def _iter_cursor(cur, batch_size=FETCH_BATCH):
+    """
+    用 fetchmany 分批读取游标，逐行产出，内存里最多只有一批数据。
+    """
+    while True:
+        with stage("fetch"):
+            rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        for r in rows:
+            yield r
+
+
+def iter_dict_rows(cur, batch_size=FETCH_BATCH):
+    """
+    分批读取已执行的游标，逐行产出 {列名: 值} 字典（列名取自 cursor.description）。
+    """
+    columns = [d[0] for d in cur.description or []]
+    for r in _iter_cursor(cur, batch_size):
+        yield dict(zip(columns, r))
+
+
+def _mysql_stream_cursor(conn):
+    """
+    MySQL 服务端游标（SSCursor）：结果集留在服务端按需读取，不会一次性全部拉到内存。
+    """
+    module = type(conn).__module__ or ""
+    if module.startswith("pymysql"):
+        import pymysql.cursors
+        return conn.cursor(pymysql.cursors.SSCursor)
+    if module.startswith("MySQLdb"):
+        import MySQLdb.cursors
+        return conn.cursor(MySQLdb.cursors.SSCursor)
+    return conn.cursor()
+
+
+def stream_cursor(conn):
+    """
+    读取大结果集用的游标：MySQL 连接返回服务端游标（SSCursor），其他数据库返回普通游标。
+    用完前要把结果读完（或关闭游标），同一连接才能执行下一条语句。
+    """
+    return _mysql_stream_cursor(conn)
+
+
+def drain_cursor(cur, batch_size=FETCH_BATCH):
+    """
+    读掉游标当前结果集里剩下的行（服务端游标必须读完才能 nextset 或执行下一条语句）。
+    """
+    if cur.description is None:
+        return
+    while cur.fetchmany(batch_size):
+        pass
+
+
+def _stream_pooled(key, factory, sql, params, convert, make_cursor=None, batch_size=FETCH_BATCH):
+    """
+    从连接池借连接执行查询，并以生成器方式逐行产出 convert(row) 的结果（返回 None 的行跳过）。
+
+    - 借到的旧连接执行失败时换新连接重试一次（只在产出第一行之前重试）
+    - 完整读完后连接归还连接池；中途出错或调用方提前停止读取时连接直接关闭
+    """
+    make_cursor = make_cursor or (lambda c: c.cursor())
+    conn, reused = _POOL.acquire(key, factory)
+    cur = None
+    finished = False
+    try:
+        try:
+            cur = make_cursor(conn)
+            if params:
+                timed_execute(cur, sql, params)
+            else:
+                timed_execute(cur, sql)
+        except Exception:
+            _POOL.discard(conn)
+            conn = None
+            if not reused:
+                raise
+            conn = factory()
+            cur = make_cursor(conn)
+            if params:
+                timed_execute(cur, sql, params)
+            else:
+                timed_execute(cur, sql)
+        for r in _iter_cursor(cur, batch_size):
+            item = convert(r)
+            if item is not None:
+                yield item
+        finished = True
+    finally:
+        if cur is not None:
+            _close_quietly(cur)
+        if conn is not None:
+            if finished:
+                _POOL.release(key, conn)
+            else:
+                _POOL.discard(conn)
 
 
 def init_demo_if_needed(sqlite_path):
@@ -169,6 +601,15 @@ def init_demo_if_needed(sqlite_path):
         conn.close()
 
 
+# 重复 jobcode 查询（SQLite 与 SQL Server 通用）
+DUP_JOBCODE_SQL = (
+    "SELECT COUNT(jobcode) AS dup_count, jobcode "
+    "FROM bd_jobbasfil GROUP BY jobcode HAVING COUNT(*)>1 ORDER BY jobcode DESC"
+)
+# bd_jobbasfil 上支撑分组统计的索引（示例库初始化时创建；生产库可用 explain_py2.py 检查）
+JOBCODE_INDEX_DDL = "CREATE INDEX IF NOT EXISTS idx_bd_jobbasfil_jobcode ON bd_jobbasfil (jobcode)"
+
+
 def init_demo_jobcodes(sqlite_path):
     """
     初始化示例表 bd_jobbasfil（如果不存在），并插入一组重复的 jobcode 数据。
@@ -187,6 +628,8 @@ def init_demo_jobcodes(sqlite_path):
             "  created_at TEXT\n"
             ")"
         )
+        # 按 jobcode 分组统计要靠索引，否则每次都要全表扫描再排序
+        c.execute(JOBCODE_INDEX_DDL)
         # 插入一组重复 jobcode（两条同一个 jobcode），以及一条不重复数据
         now = time.strftime("%Y-%m-%d %H:%M:%S")
         c.execute("INSERT INTO bd_jobbasfil(jobcode, created_at) VALUES(?, ?)", ("JC-999", now))
@@ -197,72 +640,217 @@ def init_demo_jobcodes(sqlite_path):
         conn.close()
 
 
-def query_duplicate_jobcodes(sqlite_path):
+def iter_duplicate_jobcodes(sqlite_path, batch_size=FETCH_BATCH):
     """
-    执行重复 jobcode 查询，返回满足条件的分组列表。
+    执行重复 jobcode 查询，以生成器方式逐行返回满足条件的分组。
 
     查询语句：
     select count(jobcode) as '重复次数', jobcode
     from bd_jobbasfil group by jobcode having count(*)>1 order by jobcode desc;
 
-    返回：
-    - 列表，每个元素为字典：{"jobcode": "JC-999", "dup_count": 2}
+    产出：
+    - 字典：{"jobcode": "JC-999", "dup_count": 2}
     """
     conn = _connect_sqlite(sqlite_path)
     try:
         c = conn.cursor()
-        c.execute(
-            "SELECT COUNT(jobcode) AS dup_count, jobcode "
-            "FROM bd_jobbasfil GROUP BY jobcode HAVING COUNT(*)>1 ORDER BY jobcode DESC"
-        )
-        rows = c.fetchall()
-        result = []
-        for r in rows:
+        timed_execute(c, DUP_JOBCODE_SQL)
+        for r in _iter_cursor(c, batch_size):
             # r[0] = dup_count, r[1] = jobcode
-            result.append({"dup_count": int(r[0]), "jobcode": r[1]})
-        return result
+            yield {"dup_count": int(r[0]), "jobcode": r[1]}
     finally:
         conn.close()
 
 
-def query_duplicate_jobcodes_sqlserver(host, user, password, database, port=1433):
+def query_duplicate_jobcodes(sqlite_path):
     """
-    在 SQL Server 上执行重复 jobcode 查询。
+    执行重复 jobcode 查询，返回满足条件的分组列表。
+
+    返回：
+    - 列表，每个元素为字典：{"jobcode": "JC-999", "dup_count": 2}
+    """
+    return list(iter_duplicate_jobcodes(sqlite_path))
+
+
+def _dup_row(r):
+    try:
+        # 大多数驱动返回 (dup_count, jobcode)
+        dup_count = int(r[0])
+        jobcode = r[1]
+    except Exception:
+        # 某些驱动返回字典/Row 对象，做兼容处理
+        dup_count = int(getattr(r, 'dup_count', r[0]))
+        jobcode = getattr(r, 'jobcode', r[1])
+    return {"dup_count": dup_count, "jobcode": jobcode}
+
+
+def iter_duplicate_jobcodes_sqlserver(host, user, password, database, port=1433, batch_size=FETCH_BATCH):
+    """
+    在 SQL Server 上执行重复 jobcode 查询，以生成器方式逐行返回。
 
     查询语句与 SQLite 保持一致的语义：
     SELECT COUNT(jobcode) AS dup_count, jobcode
     FROM bd_jobbasfil GROUP BY jobcode HAVING COUNT(*)>1 ORDER BY jobcode DESC;
 
+    产出：
+    - 字典：{"jobcode": "JC-999", "dup_count": 2}
+    """
+    sql = DUP_JOBCODE_SQL
+    key = ("sqlserver", host, int(port), database, user)
+    factory = lambda: _connect_sqlserver(host, user, password, database, port, drivers=_drivers_for(key))
+    return _stream_pooled(key, factory, sql, None, _dup_row, batch_size=batch_size)
+
+
+def query_duplicate_jobcodes_sqlserver(host, user, password, database, port=1433):
+    """
+    在 SQL Server 上执行重复 jobcode 查询。
+
     返回：
     - 列表，每个元素为字典：{"jobcode": "JC-999", "dup_count": 2}
     """
-    conn = _connect_sqlserver(host, user, password, database, port)
+    return list(iter_duplicate_jobcodes_sqlserver(host, user, password, database, port))
+
+
+# 摘要模式下重复 jobcode 的过滤与分组（空 jobcode 直接在 SQL 里过滤）
+_DUP_FROM_SQLITE = (
+    "FROM bd_jobbasfil WHERE jobcode IS NOT NULL AND TRIM(jobcode)<>'' "
+    "GROUP BY jobcode HAVING COUNT(*)>1"
+)
+_DUP_FROM_SQLSERVER = (
+    "FROM bd_jobbasfil WHERE jobcode IS NOT NULL AND LTRIM(RTRIM(jobcode))<>'' "
+    "GROUP BY jobcode HAVING COUNT(*)>1"
+)
+
+
+def summary_duplicate_jobcodes(sqlite_path, preview=5):
+    """
+    摘要模式的重复 jobcode 查询：只返回总数和前 preview 条，不把全部分组传回来。
+
+    - 总数：SELECT COUNT(*) FROM (重复分组) t
+    - 预览：同样的分组 ORDER BY jobcode DESC LIMIT preview
+
+    返回：
+    - 字典 {"count": 总数, "preview": [{"jobcode": ..., "dup_count": ...}, ...], "max_mark": None}
+    """
+    conn = _connect_sqlite(sqlite_path)
     try:
-        sql = (
-            "SELECT COUNT(jobcode) AS dup_count, jobcode "
-            "FROM bd_jobbasfil GROUP BY jobcode HAVING COUNT(*)>1 ORDER BY jobcode DESC"
+        c = conn.cursor()
+        timed_execute(c, "SELECT COUNT(*) FROM (SELECT jobcode %s) t" % _DUP_FROM_SQLITE)
+        count = int(timed_fetchone(c)[0])
+        timed_execute(c,
+            "SELECT COUNT(jobcode) AS dup_count, jobcode %s ORDER BY jobcode DESC LIMIT %d"
+            % (_DUP_FROM_SQLITE, int(preview))
         )
-        # 统一使用游标执行
+        rows = [{"dup_count": int(r[0]), "jobcode": r[1]} for r in timed_fetchall(c)]
+        return {"count": count, "preview": rows, "max_mark": None}
+    finally:
+        conn.close()
+
+
+def summary_duplicate_jobcodes_sqlserver(host, user, password, database, port=1433, preview=5):
+    """
+    摘要模式的重复 jobcode 查询（SQL Server 用 TOP 取预览），返回格式同 summary_duplicate_jobcodes。
+    """
+    count_sql = "SELECT COUNT(*) FROM (SELECT jobcode %s) t" % _DUP_FROM_SQLSERVER
+    preview_sql = "SELECT TOP %d COUNT(jobcode) AS dup_count, jobcode %s ORDER BY jobcode DESC" % (
+        int(preview), _DUP_FROM_SQLSERVER
+    )
+
+    def run(conn):
         cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        result = []
-        for r in rows:
-            try:
-                # 大多数驱动返回 (dup_count, jobcode)
-                dup_count = int(r[0])
-                jobcode = r[1]
-            except Exception:
-                # 某些驱动返回字典/Row 对象，做兼容处理
-                dup_count = int(getattr(r, 'dup_count', r[0]))
-                jobcode = getattr(r, 'jobcode', r[1])
-            result.append({"dup_count": dup_count, "jobcode": jobcode})
-        return result
+        timed_execute(cur, count_sql)
+        count = int(timed_fetchone(cur)[0])
+        timed_execute(cur, preview_sql)
+        rows = [_dup_row(r) for r in timed_fetchall(cur)]
+        return {"count": count, "preview": rows, "max_mark": None}
+
+    return _run_on_sqlserver(host, user, password, database, port, run)
+
+
+def query_jobcodes_after(sqlite_path, last_id, id_column="id"):
+    """
+    读取 SQLite 中 id 大于 last_id 的新行（供本地 jobcode 计数索引增量更新）。
+
+    返回：
+    - 列表，每个元素为 (id, jobcode)，按 id 升序
+    """
+    id_column = _check_identifier(id_column)
+    conn = _connect_sqlite(sqlite_path)
+    try:
+        c = conn.cursor()
+        timed_execute(c,
+            "SELECT %s, jobcode FROM bd_jobbasfil WHERE %s > ? ORDER BY %s" % (id_column, id_column, id_column),
+            (int(last_id),),
+        )
+        return [(r[0], r[1]) for r in timed_fetchall(c)]
     finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+        conn.close()
+
+
+def query_jobcode_counts(sqlite_path, id_column="id"):
+    """
+    全量统计 SQLite 中每个 jobcode 的出现次数（供本地 jobcode 计数索引定期核对）。
+
+    先取当前最大 id，再只统计 id 不超过它的行，保证统计结果和高水位一致。
+
+    返回：
+    - (max_id, [(jobcode, count), ...])
+    """
+    id_column = _check_identifier(id_column)
+    conn = _connect_sqlite(sqlite_path)
+    try:
+        c = conn.cursor()
+        timed_execute(c, "SELECT MAX(%s) FROM bd_jobbasfil" % id_column)
+        max_id = timed_fetchone(c)[0] or 0
+        timed_execute(c,
+            "SELECT jobcode, COUNT(*) FROM bd_jobbasfil WHERE %s <= ? GROUP BY jobcode" % id_column,
+            (int(max_id),),
+        )
+        return max_id, [(r[0], int(r[1])) for r in timed_fetchall(c)]
+    finally:
+        conn.close()
+
+
+def query_jobcodes_after_sqlserver(host, user, password, database, port=1433, last_id=0, id_column="id"):
+    """
+    在 SQL Server 上读取 id 大于 last_id 的新行，语义同 query_jobcodes_after。
+
+    返回：
+    - 列表，每个元素为 (id, jobcode)，按 id 升序
+    """
+    id_column = _check_identifier(id_column)
+    # 不同 SQL Server 驱动的占位符不统一（%s / ?），last_id 是本程序自己记录的整数，直接拼接
+    sql = "SELECT %s, jobcode FROM bd_jobbasfil WHERE %s > %d ORDER BY %s" % (
+        id_column, id_column, int(last_id), id_column
+    )
+
+    def run(conn):
+        cur = conn.cursor()
+        timed_execute(cur, sql)
+        return [(r[0], r[1]) for r in timed_fetchall(cur)]
+
+    return _run_on_sqlserver(host, user, password, database, port, run)
+
+
+def query_jobcode_counts_sqlserver(host, user, password, database, port=1433, id_column="id"):
+    """
+    在 SQL Server 上全量统计每个 jobcode 的出现次数，语义同 query_jobcode_counts。
+
+    返回：
+    - (max_id, [(jobcode, count), ...])
+    """
+    id_column = _check_identifier(id_column)
+
+    def run(conn):
+        cur = conn.cursor()
+        timed_execute(cur, "SELECT MAX(%s) FROM bd_jobbasfil" % id_column)
+        max_id = timed_fetchone(cur)[0] or 0
+        timed_execute(cur,
+            "SELECT jobcode, COUNT(*) FROM bd_jobbasfil WHERE %s <= %d GROUP BY jobcode" % (id_column, int(max_id))
+        )
+        return max_id, [(r[0], int(r[1])) for r in timed_fetchall(cur)]
+
+    return _run_on_sqlserver(host, user, password, database, port, run)
 
 
 def query_nonempty_jobcodes(sqlite_path):
@@ -276,10 +864,10 @@ def query_nonempty_jobcodes(sqlite_path):
     conn = _connect_sqlite(sqlite_path)
     try:
         c = conn.cursor()
-        c.execute(
+        timed_execute(c,
             "SELECT DISTINCT jobcode FROM bd_jobbasfil WHERE jobcode IS NOT NULL AND TRIM(jobcode)<>''"
         )
-        rows = c.fetchall()
+        rows = timed_fetchall(c)
         return [{"jobcode": r[0]} for r in rows]
     finally:
         conn.close()
@@ -293,15 +881,15 @@ def query_nonempty_jobcodes_sqlserver(host, user, password, database, port=1433)
     - 为什么：只要查到任何 jobcode，就要推送
     - 返回：列表，如 [{"jobcode": "JC-001"}, ...]
     """
-    conn = _connect_sqlserver(host, user, password, database, port)
-    try:
-        sql = (
-            "SELECT DISTINCT jobcode FROM bd_jobbasfil "
-            "WHERE jobcode IS NOT NULL AND LTRIM(RTRIM(jobcode))<>''"
-        )
+    sql = (
+        "SELECT DISTINCT jobcode FROM bd_jobbasfil "
+        "WHERE jobcode IS NOT NULL AND LTRIM(RTRIM(jobcode))<>''"
+    )
+
+    def run(conn):
         cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
+        timed_execute(cur, sql)
+        rows = timed_fetchall(cur)
         result = []
         for r in rows:
             jobcode = getattr(r, 'jobcode', None)
@@ -309,16 +897,93 @@ def query_nonempty_jobcodes_sqlserver(host, user, password, database, port=1433)
                 jobcode = r[0]
             result.append({"jobcode": jobcode})
         return result
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+
+    return _run_on_sqlserver(host, user, password, database, port, run)
+
+
+def _check_identifier(name):
+    """
+    校验配置中的字段名只包含字母、数字、下划线，防止拼进 SQL 时被注入。
+    """
+    if not name or not _IDENTIFIER_RE.match(name):
+        raise Exception("非法的字段名：%s" % name)
+    return name
+
+
+# 高水位字段不是 id 时（如更新时间），用 (高水位字段, id) 组合成唯一的位置，
+# 否则与上次最后一行高水位相同的新行会被 “> 高水位” 漏掉
+MARK_TIEBREAK_COLUMN = "id"
+
+
+def _incremental_sql(columns, table, where, mark_column=None, last_mark=None, limit=None):
+    """
+    拼接增量查询 SQL（MySQL 语法，占位符为 %s）。
+
+    - 未指定 mark_column 时：SELECT columns FROM table WHERE where（与原查询完全一致）
+    - mark_column 为 id 时：额外查询该字段，只取 id > last_mark 的行，按 id 升序，最多 limit 行
+    - mark_column 为其他字段（可能重复，如更新时间）时：额外查询该字段和 id，
+      last_mark 为 [高水位, id]，只取 (mark_column, id) 排在它之后的行，按 mark_column, id 升序，最多 limit 行
+      （last_mark 是旧版本保存的单个值时按 mark_column > last_mark 查询；
+      高水位字段改成 id 后 last_mark 仍是 [值, id] 时取其中的 id）
+
+    返回：(sql, params, 结果列名列表)
+    """
+    columns = list(columns)
+    params = []
+    compound = False
+    if mark_column:
+        mark_column = _check_identifier(mark_column)
+        compound = mark_column != MARK_TIEBREAK_COLUMN
+        for c in [mark_column] + ([MARK_TIEBREAK_COLUMN] if compound else []):
+            if c not in columns:
+                columns.append(c)
+    sql = "SELECT %s FROM %s WHERE %s" % (", ".join(columns), table, where)
+    if mark_column:
+        if isinstance(last_mark, (list, tuple)) and not compound:
+            # 上次保存的是组合高水位 [值, id]，现在高水位字段改成了 id：第二个元素就是上次最后一行的 id
+            print("增量高水位 %s 是组合值，高水位字段现为 %s，改用其中的 %s：%s"
+                  % (last_mark, mark_column, MARK_TIEBREAK_COLUMN, last_mark[-1]))
+            last_mark = last_mark[-1]
+        if isinstance(last_mark, (list, tuple)):
+            sql += " AND (%s > %%s OR (%s = %%s AND %s > %%s))" % (mark_column, mark_column, MARK_TIEBREAK_COLUMN)
+            params.extend([last_mark[0], last_mark[0], last_mark[1]])
+        elif last_mark is not None:
+            sql += " AND %s > %%s" % mark_column
+            params.append(last_mark)
+        sql += " ORDER BY %s" % mark_column
+        if compound:
+            sql += ", %s" % MARK_TIEBREAK_COLUMN
+        if limit:
+            sql += " LIMIT %d" % int(limit)
+    return sql, params, columns
+
+
+def row_mark(row, mark_column):
+    """
+    返回一行数据的高水位：mark_column 为 id 时就是该字段的值，
+    否则为 (mark_column 的值, id)，可以直接比较大小。值为 None 时返回 None。
+    """
+    v = row.get(mark_column)
+    if v is None or mark_column == MARK_TIEBREAK_COLUMN:
+        return v
+    return (v, row.get(MARK_TIEBREAK_COLUMN))
+
+
+# 两个内置 MySQL 检查的查询定义：(字段列表, 表名, 条件)
+FAILED_PUSH_QUERY = (["field0001", "field0045"], "formmain_1559", "field0045='2'")
+FAILED_PRODUCT_PUSH_QUERY = (["field0042", "field0032"], "formmain_1445", "field0032='2'")
+
+
+def full_scan_sql(query):
+    """
+    返回内置查询定义（FAILED_PUSH_QUERY 等）的全量查询 SQL，用于与其他检查合并成一批执行。
+    """
+    return _incremental_sql(*query)[0]
 
 
-def query_failed_push_mysql(host, user, password, database, port=3306):
+def iter_failed_push_mysql(host, user, password, database, port=3306, mark_column=None, last_mark=None, limit=None, batch_size=FETCH_BATCH):
     """
-    查询 MySQL 中推送失败的项目（field0045='2'）。
+    查询 MySQL 中推送失败的项目（field0045='2'），以生成器方式逐行返回。
 
     查询语句：
     SELECT field0001, field0045 FROM formmain_1559 WHERE field0045='2'
@@ -329,60 +994,137 @@ def query_failed_push_mysql(host, user, password, database, port=3306):
     - password：密码
     - database：数据库名
     - port：端口（默认 3306）
+    - mark_column：增量模式的高水位字段（如 id），为空表示全量查询
+    - last_mark：上次处理到的高水位值，只查询比它大的行
+    - limit：增量模式下单次最多返回的行数
+    - batch_size：每批从服务端游标读取的行数
+
+    产出：
+    - 字典：{"field0001": "项目名称", "field0045": "2"}（增量模式下额外包含 mark_column 字段）
+    """
+    columns, table, where = FAILED_PUSH_QUERY
+    sql, params, columns = _incremental_sql(columns, table, where, mark_column, last_mark, limit)
+
+    def convert(r):
+        # r[0] = field0001, r[1] = field0045
+        if r[1] == '2':  # 确认 field0045 是 '2'
+            return dict(zip(columns, r))
+        return None
+
+    key = ("mysql", host, int(port), database, user)
+    factory = lambda: _connect_mysql(host, user, password, database, port, drivers=_drivers_for(key))
+    return _stream_pooled(key, factory, sql, params, convert, _mysql_stream_cursor, batch_size)
+
+
+def query_failed_push_mysql(host, user, password, database, port=3306, mark_column=None, last_mark=None, limit=None):
+    """
+    查询 MySQL 中推送失败的项目（field0045='2'），参数同 iter_failed_push_mysql。
 
     返回：
     - 列表，每个元素为字典：{"field0001": "项目名称", "field0045": "2"}
     """
-    conn = _connect_mysql(host, user, password, database, port)
-    try:
-        sql = "SELECT field0001, field0045 FROM formmain_1559 WHERE field0045='2'"
-        cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        result = []
-        for r in rows:
-            # r[0] = field0001, r[1] = field0045
-            if r[1] == '2':  # 确认 field0045 是 '2'
-                result.append({"field0001": r[0], "field0045": r[1]})
-        return result
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+    return list(iter_failed_push_mysql(host, user, password, database, port, mark_column, last_mark, limit))
 
 
-def query_failed_product_push_mysql(host, user, password, database, port=3306):
+def iter_failed_product_push_mysql(host, user, password, database, port=3306, mark_column=None, last_mark=None, limit=None, batch_size=FETCH_BATCH):
     """
-    查询 MySQL 中推送失败的产品（field0032='2'）。
+    查询 MySQL 中推送失败的产品（field0032='2'），以生成器方式逐行返回。
 
     查询语句：
     SELECT field0042, field0032 FROM formmain_1445 WHERE field0032='2'
 
-    参数：
-    - host：MySQL 主机地址
-    - user：用户名
-    - password：密码
-    - database：数据库名
-    - port：端口（默认 3306）
+    参数：同 iter_failed_push_mysql
+
+    产出：
+    - 字典：{"field0042": "产品名称", "field0032": "2"}（增量模式下额外包含 mark_column 字段）
+    """
+    columns, table, where = FAILED_PRODUCT_PUSH_QUERY
+    sql, params, columns = _incremental_sql(columns, table, where, mark_column, last_mark, limit)
+
+    def convert(r):
+        # r[0] = field0042, r[1] = field0032
+        if r[1] == '2':  # 确认 field0032 是 '2'
+            return dict(zip(columns, r))
+        return None
+
+    key = ("mysql", host, int(port), database, user)
+    factory = lambda: _connect_mysql(host, user, password, database, port, drivers=_drivers_for(key))
+    return _stream_pooled(key, factory, sql, params, convert, _mysql_stream_cursor, batch_size)
+
+
+def query_failed_product_push_mysql(host, user, password, database, port=3306, mark_column=None, last_mark=None, limit=None):
+    """
+    查询 MySQL 中推送失败的产品（field0032='2'），参数同 iter_failed_product_push_mysql。
 
     返回：
     - 列表，每个元素为字典：{"field0042": "产品名称", "field0032": "2"}
     """
-    conn = _connect_mysql(host, user, password, database, port)
-    try:
-        sql = "SELECT field0042, field0032 FROM formmain_1445 WHERE field0032='2'"
+    return list(iter_failed_product_push_mysql(host, user, password, database, port, mark_column, last_mark, limit))
+
+
+def _summary_mysql(host, user, password, database, port, columns, table, where, preview,
+                   mark_column=None, last_mark=None, limit=None):
+    """
+    摘要模式的 MySQL 查询：同一个连接上执行两条语句，只传回总数和前 preview 行。
+
+    - 全量：SELECT COUNT(*) ... + SELECT columns ... LIMIT preview
+    - 增量：总数和最大高水位在 LIMIT limit 的窗口内统计，预览取窗口内最前面的行
+
+    返回：
+    - 字典 {"count": 总数, "preview": [行字典, ...], "max_mark": 最大高水位或 None}
+      （高水位字段不是 id 时为 (值, id)，见 row_mark）
+    """
+    last_sql = None
+    if mark_column:
+        inner_sql, count_params, inner_columns = _incremental_sql([mark_column], table, where, mark_column, last_mark, limit)
+        count_sql = "SELECT COUNT(*), MAX(%s) FROM (%s) t" % (_check_identifier(mark_column), inner_sql)
+        if len(inner_columns) > 1:
+            # 组合高水位：取窗口内按 (mark_column, id) 排序的最后一行
+            last_sql = "SELECT %s, %s FROM (%s) t ORDER BY %s DESC, %s DESC LIMIT 1" % (
+                mark_column, MARK_TIEBREAK_COLUMN, inner_sql, mark_column, MARK_TIEBREAK_COLUMN)
+        window = min(int(preview), int(limit)) if limit else int(preview)
+        preview_sql, preview_params, out_columns = _incremental_sql(
+            columns, table, where, mark_column, last_mark, window
+        )
+    else:
+        count_sql = "SELECT COUNT(*), NULL FROM %s WHERE %s" % (table, where)
+        count_params = []
+        preview_sql, preview_params, out_columns = _incremental_sql(columns, table, where)
+        preview_sql += " LIMIT %d" % int(preview)
+
+    def run(conn):
         cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        result = []
-        for r in rows:
-            # r[0] = field0042, r[1] = field0032
-            if r[1] == '2':  # 确认 field0032 是 '2'
-                result.append({"field0042": r[0], "field0032": r[1]})
-        return result
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+        timed_execute(cur, count_sql, count_params or None)
+        count, max_mark = timed_fetchone(cur)
+        if last_sql and count:
+            timed_execute(cur, last_sql, count_params or None)
+            max_mark = tuple(timed_fetchone(cur))
+        timed_execute(cur, preview_sql, preview_params or None)
+        rows = [dict(zip(out_columns, r)) for r in timed_fetchall(cur)]
+        return {"count": int(count or 0), "preview": rows, "max_mark": max_mark}
+
+    return _run_on_mysql(host, user, password, database, port, run)
+
+
+def summary_failed_push_mysql(host, user, password, database, port=3306, preview=5,
+                              mark_column=None, last_mark=None, limit=None):
+    """
+    摘要模式的“推送失败项目”查询（field0045='2'），返回格式同 _summary_mysql。
+    """
+    columns, table, where = FAILED_PUSH_QUERY
+    return _summary_mysql(
+        host, user, password, database, port, columns, table, where,
+        preview, mark_column, last_mark, limit,
+    )
+
+
+def summary_failed_product_push_mysql(host, user, password, database, port=3306, preview=5,
+                                      mark_column=None, last_mark=None, limit=None):
+    """
+    摘要模式的“推送失败产品”查询（field0032='2'），返回格式同 _summary_mysql。
+    """
+    columns, table, where = FAILED_PRODUCT_PUSH_QUERY
+    return _summary_mysql(
+        host, user, password, database, port, columns, table, where,
+        preview, mark_column, last_mark, limit,
+    )
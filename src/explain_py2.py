@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+查询计划检查与索引建议（Python 2.7 兼容）
+
+用小白能懂的话：
+- 重复 jobcode 的 GROUP BY、推送失败的 WHERE field0045='2' / field0032='2'，表一大就全靠索引撑着。
+  有人删了索引，查询照样能跑，只是越来越慢，直到数据库负载图报警才发现。
+- 这个脚本读取 config.ini，对每个被监控的查询（内置查询和 [check:名称] 检查）让数据库给出执行计划：
+  - SQLite：EXPLAIN QUERY PLAN
+  - MySQL：EXPLAIN
+  - SQL Server：SET SHOWPLAN_ALL ON（只生成计划，不真正执行查询）
+- 发现全表扫描、额外排序（filesort / 临时 B 树 / Sort）时标出来，并按查询的 WHERE / GROUP BY / ORDER BY 字段给出建议的建索引语句。
+- 加 --apply 时直接在 SQLite 库上建好建议的索引（MySQL / SQL Server 只打印语句，请 DBA 评估后执行）。
+- 有问题时退出码为 1，可以放进 crontab 每天跑一次，索引被删时第一时间知道。
+
+用法：
+    python src/explain_py2.py --config config/config.ini
+    python src/explain_py2.py --config config/config.ini --verbose     # 同时打印完整执行计划
+    python src/explain_py2.py --config config/config.ini --apply       # SQLite：建好建议的索引
+    python src/explain_py2.py --config config/config.ini --json        # 以 JSON 输出报告
+"""
+
+import re
+import sys
+import json
+import argparse
+
+from db_client_py2 import (
+    DUP_JOBCODE_SQL,
+    FAILED_PRODUCT_PUSH_QUERY,
+    FAILED_PUSH_QUERY,
+    full_scan_sql,
+    paramstyle_of,
+    run_on_connection,
+)
+from checks_py2 import CheckExecutor
+from main_py2 import read_config
+
+_IDENT = r"[A-Za-z_][A-Za-z0-9_]*"
+_FROM_RE = re.compile(r"\bFROM\s+(?:\w+\.)*(%s)" % _IDENT, re.I)
+_CLAUSE_RE = re.compile(r"\b(WHERE|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT)\b", re.I)
+# WHERE 中可以用索引的条件：字段 = / IN / 比较 / IS [NOT] NULL / LIKE
+_PREDICATE_RE = re.compile(r"(?<![\w.(])(?:\w+\.)?(%s)\s*(?:=|<>|!=|<=|>=|<|>|\bIN\b|\bIS\b|\bLIKE\b|\bBETWEEN\b)" % _IDENT, re.I)
+_SQL_WORDS = set(["AND", "OR", "NOT", "NULL", "IS", "IN", "LIKE", "BETWEEN", "SELECT", "CASE", "WHEN", "THEN", "ELSE", "END"])
+# SQL Server 里对应“扫描整张表/整个聚集索引”的物理运算符
+_SQLSERVER_SCANS = ("Table Scan", "Clustered Index Scan")
+
+
+def monitored_queries(cfg):
+    """
+    列出被监控的查询（与 main_py2 实际执行的查询一致）。
+
+    返回：
+    - 列表，每项为 {"name": 名称, "source": 数据库配置节, "sql": SQL, "check": 检查定义或 None}
+    """
+    queries = []
+    driver = cfg["db"]["driver"]
+    if driver in ("sqlite", "sqlserver"):
+        queries.append({"name": "db.duplicate_jobcode", "source": "db", "sql": DUP_JOBCODE_SQL, "check": None})
+    elif driver == "mysql":
+        queries.append({"name": "db.failed_push", "source": "db", "sql": full_scan_sql(FAILED_PUSH_QUERY), "check": None})
+    if "db_mysql" in cfg and cfg["db_mysql"].get("enabled", True):
+        queries.append({"name": "db_mysql.failed_push", "source": "db_mysql",
+                        "sql": full_scan_sql(FAILED_PUSH_QUERY), "check": None})
+        queries.append({"name": "db_mysql.failed_product_push", "source": "db_mysql",
+                        "sql": full_scan_sql(FAILED_PRODUCT_PUSH_QUERY), "check": None})
+    for check in cfg.get("checks", []):
+        queries.append({"name": "check.%s" % check["name"], "source": check["source"], "sql": check["sql"], "check": check})
+    return queries
+
+
+def _clauses(sql):
+    """
+    把单表查询拆成 {"FROM": ..., "WHERE": ..., "GROUP BY": ..., "ORDER BY": ...} 几段文本。
+    """
+    parts = {}
+    matches = list(_CLAUSE_RE.finditer(sql))
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(sql)
+        name = re.sub(r"\s+", " ", m.group(1).upper())
+        parts.setdefault(name, sql[m.end():end])
+    return parts
+
+
+def _column_list(text):
+    columns = []
+    for part in (text or "").split(","):
+        m = re.match(r"\s*(?:\w+\.)?(%s)\s*(?:ASC|DESC)?\s*$" % _IDENT, part, re.I)
+        if m:
+            columns.append(m.group(1))
+    return columns
+
+
+def suggest_index(sql, driver):
+    """
+    按查询的 WHERE / GROUP BY / ORDER BY 字段给出建议的索引（只处理单表查询；无法判断时返回 None）。
+
+    - 索引字段顺序：WHERE 中的条件字段在前，GROUP BY（没有时用 ORDER BY）字段在后
+    - 带函数的条件（如 TRIM(jobcode)<>''）用不上普通索引，不计入
+
+    返回：
+    - {"table": 表名, "columns": [字段...], "filtered": 是否有 WHERE / GROUP BY 字段, "ddl": 建索引语句} 或 None
+    """
+    m = _FROM_RE.search(sql)
+    if not m or re.search(r"\bJOIN\b", sql, re.I):
+        return None
+    table = m.group(1)
+    parts = _clauses(sql)
+    columns = []
+    for col in _PREDICATE_RE.findall(parts.get("WHERE", "")):
+        if col.upper() not in _SQL_WORDS and col not in columns:
+            columns.append(col)
+    group_by = _column_list(parts.get("GROUP BY"))
+    filtered = bool(columns or group_by)
+    for col in group_by or _column_list(parts.get("ORDER BY")):
+        if col not in columns:
+            columns.append(col)
+    if not columns:
+        return None
+    name = ("idx_%s_%s" % (table, "_".join(columns)))[:64]
+    exists = " IF NOT EXISTS" if driver == "sqlite" else ""
+    ddl = "CREATE INDEX%s %s ON %s (%s)" % (exists, name, table, ", ".join(columns))
+    return {"table": table, "columns": columns, "filtered": filtered, "ddl": ddl}
+
+
+def _rows_as_dicts(cur):
+    columns = [d[0] for d in cur.description or []]
+    return [dict(zip(columns, r)) for r in cur.fetchall()]
+
+
+def _plan_sqlite(conn, sql, params):
+    cur = conn.cursor()
+    tables = set(r[0].lower() for r in cur.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall())
+    cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+    steps = []
+    for r in cur.fetchall():
+        detail = r[-1]
+        issue = None
+        table = None
+        m = re.match(r"SCAN (?:TABLE )?(\w+)", detail)
+        if m and m.group(1).lower() in tables and "INDEX" not in detail:
+            issue, table = "full_scan", m.group(1)
+        elif "USE TEMP B-TREE" in detail:
+            issue = "temp_sort"
+        steps.append({"detail": detail, "table": table, "issue": issue})
+    return steps
+
+
+def _plan_mysql(conn, sql, params):
+    cur = conn.cursor()
+    cur.execute("EXPLAIN " + sql, params or None)
+    steps = []
+    for r in _rows_as_dicts(cur):
+        extra = r.get("Extra") or ""
+        issue = None
+        if (r.get("type") or "").upper() == "ALL":
+            issue = "full_scan"
+        elif "filesort" in extra:
+            issue = "filesort"
+        elif "temporary" in extra:
+            issue = "temp_sort"
+        detail = "table=%s type=%s key=%s rows=%s extra=%s" % (
+            r.get("table"), r.get("type"), r.get("key"), r.get("rows"), extra)
+        steps.append({"detail": detail, "table": r.get("table"), "issue": issue})
+    return steps
+
+
+def _plan_sqlserver(conn, sql, params):
+    cur = conn.cursor()
+    cur.execute("SET SHOWPLAN_ALL ON")
+    try:
+        if params:
+            cur.execute(sql, params)
+        else:
+            cur.execute(sql)
+        rows = _rows_as_dicts(cur)
+    finally:
+        cur.execute("SET SHOWPLAN_ALL OFF")
+    steps = []
+    for r in rows:
+        op = r.get("PhysicalOp")
+        if not op:
+            continue
+        argument = r.get("Argument") or ""
+        m = re.search(r"OBJECT:\(\[[^\]]*\]\.\[[^\]]*\]\.\[([^\]]+)\]", argument)
+        table = m.group(1) if m else None
+        issue = None
+        if op in _SQLSERVER_SCANS:
+            issue = "full_scan"
+        elif op == "Sort":
+            issue = "sort"
+        steps.append({"detail": "%s %s" % (op, argument.strip()), "table": table, "issue": issue})
+    return steps
+
+
+_PLANNERS = {"sqlite": _plan_sqlite, "mysql": _plan_mysql, "sqlserver": _plan_sqlserver}
+
+
+def inspect_query(cfg, query, executor):
+    """
+    取得一个查询的执行计划并判断有没有问题。
+
+    返回：
+    - {"name", "source", "driver", "sql", "steps": 计划步骤列表, "issues": 问题列表,
+       "suggestion": suggest_index 的结果或 None, "error": 出错信息或 None}
+    """
+    db_cfg = cfg[query["source"]]
+    driver = db_cfg.get("driver") or "mysql"
+    report = {"name": query["name"], "source": query["source"], "driver": driver, "sql": query["sql"],
+              "steps": [], "issues": [], "suggestion": None, "error": None}
+
+    def run(conn):
+        if query["check"] is not None:
+            sql, params = executor.statement(query["check"], paramstyle_of(conn))
+        else:
+            sql, params = query["sql"], []
+        return _PLANNERS[driver](conn, sql, params)
+
+    try:
+        report["steps"] = run_on_connection(db_cfg, run)
+    except Exception as e:
+        report["error"] = str(e)
+        return report
+    suggestion = suggest_index(query["sql"], driver)
+    if not (suggestion and suggestion["filtered"]):
+        # 没有 WHERE / GROUP BY 的查询本来就要读整张表，全表扫描不算问题
+        for step in report["steps"]:
+            if step["issue"] == "full_scan":
+                step["issue"] = None
+    report["issues"] = ["%s%s" % (s["issue"], " (%s)" % s["table"] if s["table"] else "")
+                        for s in report["steps"] if s["issue"]]
+    if report["issues"]:
+        report["suggestion"] = suggestion
+    return report
+
+
+def apply_indexes(cfg, reports):
+    """
+    在 SQLite 库上执行建议的建索引语句，返回已执行的语句列表。
+    """
+    applied = []
+    for report in reports:
+        suggestion = report["suggestion"]
+        if report["driver"] != "sqlite" or not suggestion:
+            continue
+
+        def run(conn):
+            conn.execute(suggestion["ddl"])
+            conn.commit()
+
+        run_on_connection(cfg[report["source"]], run)
+        applied.append(suggestion["ddl"])
+    return applied
+
+
+def _print_report(reports, verbose):
+    for r in reports:
+        if r["error"]:
+            status = "无法取得执行计划"
+        elif r["issues"]:
+            status = "有问题"
+        else:
+            status = "正常"
+        print("[%s] %s（%s / %s）" % (status, r["name"], r["source"], r["driver"]))
+        if r["error"]:
+            print("  出错：%s" % r["error"])
+        for issue in r["issues"]:
+            print("  - %s" % issue)
+        if r["suggestion"]:
+            print("  建议：%s;" % r["suggestion"]["ddl"])
+        elif r["issues"]:
+            print("  建议：无法自动判断索引字段，请人工检查 SQL：%s" % r["sql"])
+        if verbose:
+            for step in r["steps"]:
+                print("    | %s" % step["detail"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect query plans of monitored queries and suggest indexes")
+    parser.add_argument("--config", default="config/config.ini", help="配置文件路径")
+    parser.add_argument("--apply", action="store_true", help="在 SQLite 库上创建建议的索引")
+    parser.add_argument("--verbose", action="store_true", help="打印完整执行计划")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出报告")
+    args = parser.parse_args()
+
+    cfg = read_config(args.config)
+    executor = CheckExecutor()
+    queries = monitored_queries(cfg)
+    reports = [inspect_query(cfg, q, executor) for q in queries]
+    applied = []
+    if args.apply:
+        applied = apply_indexes(cfg, reports)
+        if applied:
+            # 建好索引后重新检查，报告反映当前状态
+            reports = [inspect_query(cfg, q, executor) for q in queries]
+
+    if args.json:
+        print(json.dumps({"queries": reports, "applied": applied}, indent=2, sort_keys=True, separators=(",", ": ")))
+    else:
+        for ddl in applied:
+            print("已创建索引：%s" % ddl)
+        _print_report(reports, args.verbose)
+        bad = [r for r in reports if r["issues"] or r["error"]]
+        print("共检查 %d 个查询，%d 个有问题。" % (len(reports), len(bad)))
+    return 1 if any(r["issues"] or r["error"] for r in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
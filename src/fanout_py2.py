@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+并发执行多个查询（Python 2.7 兼容，只用标准库 threading）
+
+用小白能懂的话：
+- 以前三个查询排队执行，一个库慢，后面的全部跟着等，总耗时 = 三个查询之和。
+- 这里用一个有上限的线程池同时跑所有查询，每个查询有自己的截止时间。
+- 结果按提交顺序返回，所以拼出来的消息顺序和以前一样；总耗时约等于最慢的那个查询。
+- 超时的查询不会被强行杀掉（Python 线程做不到），只是不再等它，结果直接丢弃。
+"""
+
+import threading
+import time
+try:
+    import Queue as queue  # Python 2
+except Exception:
+    import queue  # Python 3 调试兼容
+
+
+class TaskResult(object):
+    """
+    单个任务的执行结果。
+
+    - name：任务名称
+    - ok：是否成功
+    - value：成功时的返回值
+    - error：失败时的异常对象
+    - timed_out：是否因超过截止时间而放弃等待
+    - elapsed：耗时（秒；超时则为截止前已等待的时间）
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.ok = False
+        self.value = None
+        self.error = None
+        self.timed_out = False
+        self.elapsed = 0.0
+        self._done = threading.Event()
+        # 保护“写入结果”和“标记超时”只有一个能生效，超时后的结果不会再被改成成功
+        self._lock = threading.Lock()
+
+    def _finish(self, ok, value, error, elapsed):
+        # 工作线程在截止前完成时才写入结果；已被标记超时就丢弃
+        with self._lock:
+            if self.timed_out:
+                return
+            self.ok = ok
+            self.value = value
+            self.error = error
+            self.elapsed = elapsed
+            self._done.set()
+
+    def _time_out(self, elapsed, limit):
+        # 截止时间已到还没完成：标记超时（已完成的不受影响）
+        with self._lock:
+            if self._done.is_set():
+                return
+            self.timed_out = True
+            self.elapsed = elapsed
+            self.error = Exception("查询超时（超过 %.1f 秒）" % limit)
+
+
+def run_all(tasks, max_workers=4, default_timeout=30, deadline=None):
+    """
+    并发执行任务，按提交顺序返回结果列表。
+
+    参数：
+    - tasks：列表，每个元素为 (name, func) 或 (name, func, timeout)；func 为无参函数
+    - max_workers：最多同时运行的线程数
+    - default_timeout：未单独指定时的截止时间（秒），从提交时开始计时
+    - deadline：整轮运行的截止时刻（time.time() 时间戳）；各任务的截止时间都不会晚于它，None 表示不限制
+
+    排队时截止时间就已经过了的任务不再执行，直接算作超时。
+
+    返回：
+    - TaskResult 列表，顺序与 tasks 一致
+    """
+    jobs = queue.Queue()
+    results = []
+    deadlines = []
+    submitted = time.time()
+    for t in tasks:
+        name, func = t[0], t[1]
+        timeout = t[2] if len(t) > 2 and t[2] else default_timeout
+        res = TaskResult(name)
+        results.append(res)
+        task_deadline = submitted + float(timeout)
+        if deadline is not None:
+            task_deadline = min(task_deadline, deadline)
+        deadlines.append(task_deadline)
+        jobs.put((res, func, task_deadline))
+
+    def worker():
+        while True:
+            try:
+                res, func, task_deadline = jobs.get_nowait()
+            except queue.Empty:
+                return
+            started = time.time()
+            if started >= task_deadline:
+                res._time_out(started - submitted, task_deadline - submitted)
+                continue
+            try:
+                value = func()
+            except Exception as e:
+                res._finish(False, None, e, time.time() - started)
+            else:
+                res._finish(True, value, None, time.time() - started)
+
+    for _ in range(max(1, min(int(max_workers), len(results)))):
+        th = threading.Thread(target=worker)
+        # 守护线程：卡死的查询不会阻止进程退出
+        th.daemon = True
+        th.start()
+
+    for res, task_deadline in zip(results, deadlines):
+        remaining = task_deadline - time.time()
+        if remaining > 0:
+            res._done.wait(remaining)
+        res._time_out(time.time() - submitted, task_deadline - submitted)
+    return results
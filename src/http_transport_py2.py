@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+共享的 HTTP(S) 长连接发送通道（Python 2.7 兼容，只用标准库 httplib）
+
+用小白能懂的话：
+- 以前每发一条消息、每取一次 token 都用 urllib2.urlopen 新建连接：
+  DNS 解析 + TCP 三次握手 + TLS 握手，每次都要走一遍，比发消息本身还慢。
+- 这里按主机（协议, 域名, 端口）保留已经建立好的连接（keep-alive），下次直接复用。
+- 闲置超过 idle_timeout 秒的连接会被关掉；复用前先检查连接是否已被服务端关闭，关闭了就换新连接。
+- 复用的连接在请求还没发出去时就失败（服务端已断开），自动换新连接再发一次；
+  请求已经发出后才失败（超时、读响应出错）不会重发，因为服务端可能已经收到并推送了这条消息。
+- 群机器人和应用消息客户端共用同一个通道，分段发送、多通道发送都只需要一次握手。
+"""
+
+import json
+import select
+import socket
+import sys
+import threading
+import time
+try:
+    import httplib  # Python 2
+    from urlparse import urlsplit
+except Exception:
+    import http.client as httplib  # Python 3 调试兼容
+    from urllib.parse import urlsplit
+
+# 复用旧连接、发送请求（conn.request）时出现这些异常，说明连接已被服务端关闭、请求没有发出去，可以换新连接重发。
+# socket.timeout 虽然是 socket.error 的子类，但不在此列：超时时无法确定服务端是否已经收到
+_UNSENT_ERRORS = (httplib.CannotSendRequest, socket.error)
+
+
+def _closed_by_peer(conn):
+    """
+    空闲连接是否已被服务端关闭：空闲的 keep-alive 连接上不应有可读数据，可读说明收到了 FIN（或异常数据）。
+    """
+    if conn.sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+        return bool(readable)
+    except (socket.error, ValueError):
+        return True
+
+
+class HttpError(Exception):
+    """
+    服务端返回非 2xx 状态码时抛出，status 属性为 HTTP 状态码。
+    """
+
+    def __init__(self, message, status=None):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class HttpTransport(object):
+    """
+    按主机复用连接的 HTTP(S) 客户端（线程安全：同一连接同一时间只给一个请求使用）。
+
+    - idle_timeout：连接闲置超过多少秒后不再复用（服务端通常 60 秒左右会断开空闲连接）
+    - max_idle_per_host：每个主机最多保留的空闲连接数
+    """
+
+    def __init__(self, idle_timeout=50, max_idle_per_host=4):
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = {}  # (scheme, host, port) -> [(conn, last_used), ...]
+        self._lock = threading.Lock()
+
+    def _new_conn(self, key, timeout):
+        scheme, host, port = key
+        if scheme == "https":
+            return httplib.HTTPSConnection(host, port, timeout=timeout)
+        return httplib.HTTPConnection(host, port, timeout=timeout)
+
+    def _acquire(self, key, timeout):
+        now = time.time()
+        while True:
+            with self._lock:
+                idle = self._idle.get(key) or []
+                item = idle.pop() if idle else None
+            if item is None:
+                return self._new_conn(key, timeout), False
+            conn, last_used = item
+            if now - last_used > self.idle_timeout or _closed_by_peer(conn):
+                conn.close()
+                continue
+            conn.timeout = timeout
+            if conn.sock is not None:
+                try:
+                    conn.sock.settimeout(timeout)
+                except socket.error:
+                    conn.close()
+                    continue
+            return conn, True
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None, timeout=8):
+        """
+        发送一个请求并返回 (status, 响应体字节串)。
+
+        复用的旧连接在发出请求时就失败（通常是服务端已关闭空闲连接），关闭它并用新连接重发一次；
+        超时或读取响应时出错不重发（请求可能已被服务端处理），直接抛出。
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = dict(headers or {})
+        headers.setdefault("Connection", "keep-alive")
+
+        conn, reused = self._acquire(key, timeout)
+        try:
+            try:
+                conn.request(method, path, body, headers)
+            except _UNSENT_ERRORS as e:
+                conn.close()
+                if not reused or isinstance(e, socket.timeout):
+                    raise
+                conn = self._new_conn(key, timeout)
+                conn.request(method, path, body, headers)
+            resp = conn.getresponse()
+            # 必须读完响应体，连接才能继续复用
+            data = resp.read()
+        except Exception:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+        return resp.status, data
+
+    def close_all(self):
+        """关闭所有空闲连接。"""
+        with self._lock:
+            items = []
+            for idle in self._idle.values():
+                items.extend(idle)
+            self._idle = {}
+        for conn, _ in items:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+# 进程内共享的发送通道：群机器人和应用消息共用
+_TRANSPORT = HttpTransport()
+
+
+def _decode(status, data):
+    if status < 200 or status >= 300:
+        raise HttpError("HTTP %d: %s" % (status, data[:200]), status)
+    if sys.version_info[0] >= 3:
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def get_json(url, timeout=8):
+    """
+    GET 请求并把响应解析为 JSON 字典。
+    """
+    status, data = _TRANSPORT.request("GET", url, timeout=timeout)
+    return _decode(status, data)
+
+
+def post_json(url, payload, timeout=8):
+    """
+    POST 一个 JSON 请求体并把响应解析为 JSON 字典。
+    """
+    data_bytes = json.dumps(payload)
+    if sys.version_info[0] >= 3:
+        data_bytes = data_bytes.encode("utf-8")
+    status, data = _TRANSPORT.request(
+        "POST", url, data_bytes, {"Content-Type": "application/json"}, timeout=timeout
+    )
+    return _decode(status, data)
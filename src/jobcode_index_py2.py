@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+本地 jobcode 计数索引（Python 2.7 兼容，存储用自带的 SQLite）
+
+用小白能懂的话：
+- 原来的重复 jobcode 查询每次都要对 bd_jobbasfil 整表 GROUP BY + 排序，表越大越慢。
+- 这里在本地 SQLite 里维护一份“jobcode → 出现次数”的计数表：
+  平时只读取 id 大于上次位置（高水位）的新行，把计数加上去；
+- 源表的删除/修改无法通过 id 发现，所以每隔 full_interval 秒做一次全量核对，把计数整体替换。
+- 每次刷新都会报告哪些 jobcode 新变成重复、哪些不再重复。
+"""
+
+import os
+import sqlite3
+import time
+
+
+def ensure_dir(path):
+    """
+    确保目录存在，不存在则创建。
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+
+class JobcodeIndex(object):
+    """
+    jobcode 计数索引。
+
+    - index_path：本地 SQLite 文件路径，例如 "state/jobcode_index.sqlite"
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        ensure_dir(os.path.dirname(index_path) or ".")
+        self._init_schema()
+
+    def _connect(self):
+        # 事务由我们自己用 BEGIN IMMEDIATE / COMMIT 控制，避免 cron 进程与常驻进程同时写
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.isolation_level = None
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS jobcode_counts (\n"
+                "  jobcode TEXT PRIMARY KEY,\n"
+                "  cnt INTEGER NOT NULL\n"
+                ")"
+            )
+            c.execute("CREATE INDEX IF NOT EXISTS idx_jobcode_counts_cnt ON jobcode_counts(cnt)")
+            c.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+        finally:
+            conn.close()
+
+    def _get_meta(self, c, key):
+        c.execute("SELECT v FROM meta WHERE k=?", (key,))
+        row = c.fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, c, key, value):
+        c.execute("INSERT OR REPLACE INTO meta(k, v) VALUES(?, ?)", (key, None if value is None else str(value)))
+
+    def _duplicate_set(self, c):
+        c.execute("SELECT jobcode FROM jobcode_counts WHERE cnt>1")
+        return set(r[0] for r in c.fetchall())
+
+    def duplicates(self):
+        """
+        返回当前重复的 jobcode，格式与 query_duplicate_jobcodes 一致：
+        [{"jobcode": "JC-999", "dup_count": 2}, ...]，按 jobcode 倒序。
+        """
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute("SELECT cnt, jobcode FROM jobcode_counts WHERE cnt>1 ORDER BY jobcode DESC")
+            return [{"dup_count": int(r[0]), "jobcode": r[1]} for r in c.fetchall()]
+        finally:
+            conn.close()
+
+    def refresh(self, source_id, fetch_after, fetch_counts, full_interval=3600, now=None):
+        """
+        刷新索引。
+
+        参数：
+        - source_id：源库标识（换了库会自动做全量重建）
+        - fetch_after：函数 fetch_after(last_id) → [(id, jobcode), ...]，读取高水位之后的新行
+        - fetch_counts：函数 fetch_counts() → (max_id, [(jobcode, count), ...])，全量统计
+        - full_interval：全量核对间隔（秒）；0 表示每次都全量
+        - now：当前时间戳（测试用）
+
+        返回：
+        - 字典 {"full": 是否做了全量核对, "scanned": 本次读取的源表行数,
+                "became": 新变成重复的 jobcode 列表, "cleared": 不再重复的 jobcode 列表}
+        """
+        now = time.time() if now is None else now
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            # 先不加写锁，只读出高水位判断要做全量还是增量，再去源库读数据；
+            # 远程查询可能很慢，期间不占着写锁，其他进程照样能读写索引
+            watermark = self._get_meta(c, "watermark")
+            last_full = float(self._get_meta(c, "last_full") or 0)
+            need_full = (
+                self._get_meta(c, "source_id") != source_id
+                or watermark is None
+                or now - last_full >= full_interval
+            )
+            if need_full:
+                max_id, counts = fetch_counts()
+            else:
+                rows = fetch_after(int(watermark))
+            c.execute("BEGIN IMMEDIATE")
+            before = self._duplicate_set(c)
+            if need_full:
+                c.execute("DELETE FROM jobcode_counts")
+                c.executemany(
+                    "INSERT INTO jobcode_counts(jobcode, cnt) VALUES(?, ?)",
+                    ((j, int(n)) for j, n in counts if _valid(j)),
+                )
+                scanned = sum(int(n) for _, n in counts)
+                self._set_meta(c, "source_id", source_id)
+                self._set_meta(c, "watermark", _row_id(max_id or 0))
+                self._set_meta(c, "last_full", now)
+            else:
+                # 读源库期间其他进程可能已经推进了高水位，已经计过的行不再重复累加
+                last_id = int(self._get_meta(c, "watermark") or watermark)
+                rows = [(_row_id(row_id), jobcode) for row_id, jobcode in rows]
+                rows = [(row_id, jobcode) for row_id, jobcode in rows if row_id > last_id]
+                deltas = {}
+                for row_id, jobcode in rows:
+                    last_id = max(last_id, row_id)
+                    if _valid(jobcode):
+                        deltas[jobcode] = deltas.get(jobcode, 0) + 1
+                for jobcode, n in deltas.items():
+                    c.execute("UPDATE jobcode_counts SET cnt=cnt+? WHERE jobcode=?", (n, jobcode))
+                    if c.rowcount == 0:
+                        c.execute("INSERT INTO jobcode_counts(jobcode, cnt) VALUES(?, ?)", (jobcode, n))
+                scanned = len(rows)
+                self._set_meta(c, "watermark", last_id)
+            after = self._duplicate_set(c)
+            c.execute("COMMIT")
+        except Exception:
+            try:
+                c.execute("ROLLBACK")
+            except Exception:
+                pass
+            raise
+        finally:
+            conn.close()
+        return {
+            "full": need_full,
+            "scanned": scanned,
+            "became": sorted(after - before),
+            "cleared": sorted(before - after),
+        }
+
+
+def _row_id(value):
+    # 高水位按整数比较：id_column 必须是整数自增主键，其他类型直接给出明确的报错
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise Exception("jobcode 索引的 id_column 必须是整数自增主键，读到的值不是整数：%r" % (value,))
+
+
+def _valid(jobcode):
+    # 空 jobcode 与原查询结果一样最终会被过滤掉，索引里直接不记
+    return jobcode is not None and bool(("%s" % jobcode).strip())
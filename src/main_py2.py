@@ -11,6 +11,10 @@
 import os
 import sys
 import json
+import hashlib
+import time
+import signal
+import threading
 import argparse
 
 try:
@@ -19,15 +23,64 @@ except Exception:
     from configparser import ConfigParser  # Python 3 调试兼容
 
 from db_client_py2 import (
+    configure_drivers,
+    configure_pool,
     init_demo_if_needed,
     init_demo_jobcodes,
-    query_duplicate_jobcodes,
-    query_duplicate_jobcodes_sqlserver,
-    query_failed_push_mysql,
-    query_failed_product_push_mysql,
+    iter_duplicate_jobcodes,
+    iter_duplicate_jobcodes_sqlserver,
+    iter_failed_push_mysql,
+    iter_failed_product_push_mysql,
+    summary_duplicate_jobcodes,
+    summary_duplicate_jobcodes_sqlserver,
+    summary_failed_push_mysql,
+    summary_failed_product_push_mysql,
+    full_scan_sql,
+    row_mark,
+    FAILED_PUSH_QUERY,
+    FAILED_PRODUCT_PUSH_QUERY,
+    query_jobcodes_after,
+    query_jobcodes_after_sqlserver,
+    query_jobcode_counts,
+    query_jobcode_counts_sqlserver,
+)
+from jobcode_index_py2 import JobcodeIndex
+from fanout_py2 import TaskResult, run_all
+from state_py2 import (
+    load_marks,
+    save_marks,
+    mark_value,
+    item_key,
+    row_fingerprint,
+    load_item_sets,
+    save_item_sets,
+)
+from scheduler_py2 import Scheduler
+from outbox_py2 import Outbox
+from breaker_py2 import configure_breaker
+from result_cache_py2 import ResultCache, cache_key
+from checks_py2 import CheckExecutor, read_checks
+from template_py2 import Digest, compile_template
+from metrics_py2 import METRICS, add, export as export_metrics, labels, observe, stage, thread_seconds
+from runlog_py2 import begin_run, configure_runlog, error_fields, is_slow, log_event, log_slow_query
+from sender_py2 import (
+    MARKDOWN_MAX_BYTES,
+    TEXT_MAX_BYTES,
+    RetryPolicy,
+    classify_error,
+    deliver_all,
+    split_chunks,
+    get_bucket,
+    send_chunks,
 )
 # 注意：为兼容 Python3 的干跑模式，我们在需要时再导入 wecom 客户端
 
+# 声明式检查的执行器：常驻模式下跨轮次复用（缓存转换后的 SQL、记录各检查上次执行时间）
+_CHECKS = CheckExecutor()
+
+# 增量模式下每个数据源单次最多读取的行数（--limit 的默认值），剩余的下次继续
+DEFAULT_LIMIT = 50
+
 
 def read_config(path):
     """
@@ -70,6 +123,10 @@ def read_config(path):
             "corpsecret": get_value("wecom", "corpsecret"),  # 优先从 secrets.ini 读取
             "agentid": cp.get("wecom", "agentid"),
             "touser": cp.get("wecom", "touser"),
+            # access_token 磁盘缓存（多个进程共用），留空表示每次都重新获取
+            "token_cache": cp.get("wecom", "token_cache").strip() if cp.has_option("wecom", "token_cache") else "state/access_token.json",
+            # 接口地址（可选）：默认企业微信官方地址，联调/压测时可指向本地模拟服务
+            "api_base": cp.get("wecom", "api_base").strip() if cp.has_option("wecom", "api_base") else "",
         },
         "db": {
             "driver": cp.get("db", "driver"),
@@ -80,6 +137,13 @@ def read_config(path):
             "database": cp.get("db", "database") if cp.has_option("db", "database") else "",
             "user": cp.get("db", "user") if cp.has_option("db", "user") else "",
             "password": get_value("db", "password"),  # 优先从 secrets.ini 读取
+            "timeout": float(cp.get("db", "timeout")) if cp.has_option("db", "timeout") else None,
+            # 至少隔多少秒才真正查询一次（需启用 [result_cache]；0 表示每轮都查）
+            "interval": float(cp.get("db", "interval")) if cp.has_option("db", "interval") else 0.0,
+            # 摘要模式：SQL 里 COUNT(*) + LIMIT/TOP，只传回总数和预览行
+            "summary": cp.get("db", "summary").lower() in ["true", "1", "yes"] if cp.has_option("db", "summary") else False,
+            # 驱动优先顺序（可选，用 | 分隔），例如 pytds|pymssql
+            "drivers": [x.strip() for x in cp.get("db", "drivers").split("|") if x.strip()] if cp.has_option("db", "drivers") else [],
         },
     }
     # MySQL 默认端口是 3306
@@ -89,26 +153,126 @@ def read_config(path):
     # 可选的 MySQL 配置（独立配置节）
     if cp.has_section("db_mysql"):
         cfg["db_mysql"] = {
+            "driver": "mysql",
             "enabled": cp.get("db_mysql", "enabled").lower() in ["true", "1", "yes"] if cp.has_option("db_mysql", "enabled") else True,
             "host": cp.get("db_mysql", "host") if cp.has_option("db_mysql", "host") else "",
             "port": int(cp.get("db_mysql", "port")) if cp.has_option("db_mysql", "port") else 3306,
             "database": cp.get("db_mysql", "database") if cp.has_option("db_mysql", "database") else "",
             "user": cp.get("db_mysql", "user") if cp.has_option("db_mysql", "user") else "",
             "password": get_value("db_mysql", "password"),  # 优先从 secrets.ini 读取
+            "timeout": float(cp.get("db_mysql", "timeout")) if cp.has_option("db_mysql", "timeout") else None,
+            "interval": float(cp.get("db_mysql", "interval")) if cp.has_option("db_mysql", "interval") else 0.0,
+            "summary": cp.get("db_mysql", "summary").lower() in ["true", "1", "yes"] if cp.has_option("db_mysql", "summary") else False,
+            "drivers": [x.strip() for x in cp.get("db_mysql", "drivers").split("|") if x.strip()] if cp.has_option("db_mysql", "drivers") else [],
         }
     
-    # 可选的消息模板配置
+    # 可选的消息模板配置：启动时就检查模板中的占位符，写错字段名立即报错
+    msg_cfg = {}
     if cp.has_section("message"):
-        msg_cfg = {}
-        # text 模板
-        for k in ["title_text", "item_text", "footer_text"]:
-            if cp.has_option("message", k):
-                msg_cfg[k] = cp.get("message", k)
-        # markdown 模板
-        for k in ["title_markdown", "item_markdown", "footer_markdown"]:
+        for k in ["title_text", "item_text", "footer_text", "title_markdown", "item_markdown", "footer_markdown"]:
             if cp.has_option("message", k):
                 msg_cfg[k] = cp.get("message", k)
-        cfg["message"] = msg_cfg
+                compile_template(msg_cfg[k]).validate(MESSAGE_TEMPLATE_FIELDS[k], u"[message] %s" % k)
+    # 单条消息的字节上限（可选）：达到上限后不再渲染后面的条目，计入“已省略”
+    if cp.has_option("message", "max_bytes") and int(cp.get("message", "max_bytes")) > 0:
+        msg_cfg["max_bytes"] = int(cp.get("message", "max_bytes"))
+    cfg["message"] = msg_cfg
+    # 声明式检查 [check:名称]（可选）：每个配置节描述一条 SQL 和展示方式
+    cfg["checks"] = read_checks(cp)
+    for check in cfg["checks"]:
+        if check["source"] not in cfg:
+            raise Exception("[check:%s] 使用的数据库配置节 [%s] 不存在" % (check["name"], check["source"]))
+    # 本地 jobcode 计数索引为可选：代替每次整表 GROUP BY
+    cfg["jobcode_index"] = {
+        "enabled": cp.get("jobcode_index", "enabled").lower() in ["true", "1", "yes"] if cp.has_option("jobcode_index", "enabled") else False,
+        "path": cp.get("jobcode_index", "path") if cp.has_option("jobcode_index", "path") else "state/jobcode_index.sqlite",
+        "id_column": cp.get("jobcode_index", "id_column") if cp.has_option("jobcode_index", "id_column") else "id",
+        "full_interval": float(cp.get("jobcode_index", "full_interval")) if cp.has_option("jobcode_index", "full_interval") else 3600.0,
+    }
+    # 查询结果缓存为可选：没到 interval 的数据源直接使用上次的结果，不再查询数据库
+    cfg["result_cache"] = {
+        "enabled": cp.get("result_cache", "enabled").lower() in ["true", "1", "yes"] if cp.has_option("result_cache", "enabled") else False,
+        "path": cp.get("result_cache", "path") if cp.has_option("result_cache", "path") else "state/result_cache.sqlite",
+        "keep_days": float(cp.get("result_cache", "keep_days")) if cp.has_option("result_cache", "keep_days") else 7.0,
+    }
+    # 差异推送配置为可选：只推送新增/恢复的条目
+    cfg["diff"] = {
+        "enabled": cp.get("diff", "enabled").lower() in ["true", "1", "yes"] if cp.has_option("diff", "enabled") else False,
+        "path": cp.get("diff", "path") if cp.has_option("diff", "path") else "state/items.json",
+    }
+    # 增量查询配置为可选：每个数据源一个高水位字段（自增 id 或更新时间字段）
+    cfg["incremental"] = {
+        "enabled": cp.get("incremental", "enabled").lower() in ["true", "1", "yes"] if cp.has_option("incremental", "enabled") else False,
+        "columns": {},
+    }
+    if cp.has_section("incremental"):
+        for name in ["db", "db_mysql.failed_push", "db_mysql.failed_product_push"]:
+            if cp.has_option("incremental", name) and cp.get("incremental", name).strip():
+                cfg["incremental"]["columns"][name] = cp.get("incremental", name).strip()
+    # 并发查询配置为可选：线程数上限与默认截止时间
+    cfg["query"] = {
+        "max_workers": int(cp.get("query", "max_workers")) if cp.has_option("query", "max_workers") else 4,
+        "timeout": float(cp.get("query", "timeout")) if cp.has_option("query", "timeout") else 30.0,
+        # 同一数据库的多个检查合并成一批执行（一个网络来回、同一个一致性快照）
+        "batch": cp.get("query", "batch").lower() in ["true", "1", "yes"] if cp.has_option("query", "batch") else True,
+        "sqlserver_snapshot": cp.get("query", "sqlserver_snapshot").lower() in ["true", "1", "yes"] if cp.has_option("query", "sqlserver_snapshot") else False,
+        # 整轮运行的截止时间（秒）：查询等待和发送重试都不超过它，0 表示不限制
+        "run_deadline": float(cp.get("query", "run_deadline")) if cp.has_option("query", "run_deadline") else 0.0,
+    }
+    # 熔断器配置为可选：数据库连续连接失败后暂时跳过，并在重连前先做 TCP 端口探测
+    cfg["breaker"] = {
+        "enabled": cp.get("breaker", "enabled").lower() in ["true", "1", "yes"] if cp.has_option("breaker", "enabled") else False,
+        "path": cp.get("breaker", "path") if cp.has_option("breaker", "path") else "state/breaker.json",
+        "failure_threshold": int(cp.get("breaker", "failure_threshold")) if cp.has_option("breaker", "failure_threshold") else 2,
+        "open_seconds": float(cp.get("breaker", "open_seconds")) if cp.has_option("breaker", "open_seconds") else 300.0,
+        "probe_timeout": float(cp.get("breaker", "probe_timeout")) if cp.has_option("breaker", "probe_timeout") else 1.0,
+    }
+    # 连接池配置为可选：MySQL / SQL Server 连接复用
+    cfg["db_pool"] = {
+        "enabled": cp.get("db_pool", "enabled").lower() in ["true", "1", "yes"] if cp.has_option("db_pool", "enabled") else True,
+        "max_idle_age": float(cp.get("db_pool", "max_idle_age")) if cp.has_option("db_pool", "max_idle_age") else 300.0,
+        "ping_interval": float(cp.get("db_pool", "ping_interval")) if cp.has_option("db_pool", "ping_interval") else 30.0,
+    }
+    # 发送配置为可选：单段字节上限与每个通道每分钟最多发送的条数
+    cfg["sender"] = {
+        "markdown_bytes": int(cp.get("sender", "markdown_bytes")) if cp.has_option("sender", "markdown_bytes") else MARKDOWN_MAX_BYTES,
+        "text_bytes": int(cp.get("sender", "text_bytes")) if cp.has_option("sender", "text_bytes") else TEXT_MAX_BYTES,
+        "robot_per_minute": int(cp.get("sender", "robot_per_minute")) if cp.has_option("sender", "robot_per_minute") else 20,
+        "app_per_minute": int(cp.get("sender", "app_per_minute")) if cp.has_option("sender", "app_per_minute") else 20,
+        "retry_attempts": int(cp.get("sender", "retry_attempts")) if cp.has_option("sender", "retry_attempts") else 4,
+        "retry_base_delay": float(cp.get("sender", "retry_base_delay")) if cp.has_option("sender", "retry_base_delay") else 1.0,
+        "retry_max_delay": float(cp.get("sender", "retry_max_delay")) if cp.has_option("sender", "retry_max_delay") else 30.0,
+        "rate_limit_pause": float(cp.get("sender", "rate_limit_pause")) if cp.has_option("sender", "rate_limit_pause") else 60.0,
+    }
+    # 发件箱配置为可选：启用后消息先写入本地 SQLite 发件箱，再分批发送
+    cfg["outbox"] = {
+        "enabled": cp.get("outbox", "enabled").lower() in ["true", "1", "yes"] if cp.has_option("outbox", "enabled") else False,
+        "path": cp.get("outbox", "path") if cp.has_option("outbox", "path") else "state/outbox.sqlite",
+        "batch_size": int(cp.get("outbox", "batch_size")) if cp.has_option("outbox", "batch_size") else 20,
+        "max_attempts": int(cp.get("outbox", "max_attempts")) if cp.has_option("outbox", "max_attempts") else 5,
+        "retry_delay": float(cp.get("outbox", "retry_delay")) if cp.has_option("outbox", "retry_delay") else 60.0,
+        "drain_interval": float(cp.get("outbox", "drain_interval")) if cp.has_option("outbox", "drain_interval") else 10.0,
+        "keep_days": float(cp.get("outbox", "keep_days")) if cp.has_option("outbox", "keep_days") else 7.0,
+    }
+    # 统计导出配置为可选：每轮结束后把各阶段耗时与计数写到 Prometheus textfile 和/或 JSON 文件（留空表示不导出）
+    cfg["metrics"] = {
+        "prometheus_file": cp.get("metrics", "prometheus_file").strip() if cp.has_option("metrics", "prometheus_file") else "",
+        "json_file": cp.get("metrics", "json_file").strip() if cp.has_option("metrics", "json_file") else "",
+        "prefix": cp.get("metrics", "prefix").strip() if cp.has_option("metrics", "prefix") else "weixin_alert",
+    }
+    # 结构化运行日志为可选：JSON Lines 事件日志与慢查询日志，按大小轮转（path 留空表示不写）
+    cfg["runlog"] = {
+        "path": cp.get("runlog", "path").strip() if cp.has_option("runlog", "path") else "",
+        "slow_query_path": cp.get("runlog", "slow_query_path").strip() if cp.has_option("runlog", "slow_query_path") else "",
+        "slow_query_seconds": float(cp.get("runlog", "slow_query_seconds")) if cp.has_option("runlog", "slow_query_seconds") else 5.0,
+        "max_bytes": int(cp.get("runlog", "max_bytes")) if cp.has_option("runlog", "max_bytes") else 10 * 1024 * 1024,
+        "backup_count": int(cp.get("runlog", "backup_count")) if cp.has_option("runlog", "backup_count") else 5,
+    }
+    # 常驻模式配置为可选（--daemon 时使用）
+    cfg["daemon"] = {
+        "interval": float(cp.get("daemon", "interval")) if cp.has_option("daemon", "interval") else 60.0,
+        "jitter": float(cp.get("daemon", "jitter")) if cp.has_option("daemon", "jitter") else 0.0,
+    }
     # 机器人配置为可选
     if cp.has_section("robot") and cp.has_option("robot", "webhook"):
         mentioned = []
@@ -125,67 +289,265 @@ def read_config(path):
             "mentioned_list": mentioned,
             "format": fmt,
         }
+    # 多通道配置为可选：[robot:名称] 群机器人、[app:名称] 应用，按 [routes] 把各数据源发送到不同通道
+    cfg["channels"] = {}
+    for section in cp.sections():
+        kind, _, name = section.partition(":")
+        if kind not in ("robot", "app") or not name:
+            continue
+        if name.strip() in ("markdown", "text"):
+            raise Exception("通道名不能是 markdown 或 text（与内置通道重名）：[%s]" % section)
+        if kind == "robot":
+            webhook = get_value(section, "webhook").strip()
+            if not webhook:
+                raise Exception("[%s] 缺少 webhook 配置" % section)
+            cfg["channels"][section] = {
+                "kind": "robot",
+                "webhook": webhook,
+                "mentioned_list": [x.strip() for x in get_value(section, "mentioned_list").split("|") if x.strip()],
+                "format": (get_value(section, "format").strip() or "markdown").lower(),
+            }
+        else:
+            # 未填写的项沿用 [wecom]（接口地址与 token 缓存文件始终使用 [wecom] 的配置）
+            cfg["channels"][section] = {
+                "kind": "app",
+                "corpid": get_value(section, "corpid").strip() or cfg["wecom"]["corpid"],
+                "corpsecret": get_value(section, "corpsecret").strip() or cfg["wecom"]["corpsecret"],
+                "agentid": get_value(section, "agentid").strip() or cfg["wecom"]["agentid"],
+                "touser": get_value(section, "touser").strip() or cfg["wecom"]["touser"],
+            }
+    # 路由：数据源名（db、db_mysql.failed_push、check.名称 ...）= 通道列表（用 | 分隔），default 为未配置的数据源的通道
+    cfg["routes"] = {}
+    if cp.has_section("routes"):
+        for option in cp.options("routes"):
+            cfg["routes"][option.lower()] = [x.strip() for x in cp.get("routes", option).split("|") if x.strip()]
+    for names in list(cfg["routes"].values()) + [check["channels"] for check in cfg["checks"]]:
+        for name in names:
+            _resolve_channel(cfg, name)
     return cfg
 
 
-def compose_message(rows, max_preview, msg_cfg=None):
+def _count_and_preview(rows, max_preview, total=None):
     """
-    组织要发送的文本消息：
-    - 标题：本次查询发现多少条新数据
-    - 摘要：列出前 max_preview 条的 id、标题、时间
-    返回：字符串
+    从查询结果中取出总条数和前 max_preview 条预览。
+
+    - rows 可以是列表，也可以是生成器；生成器只遍历一次，除预览行外不在内存中保留任何行
+    - total 不为 None 时，表示 rows 已经是预览行，总条数由调用方给出
+
+    返回：(count, preview)
     """
-    count = len(rows)
-    if count == 0:
+    if total is not None:
+        preview = []
+        for r in rows:
+            if len(preview) >= max_preview:
+                break
+            preview.append(r)
+        return total, preview
+    count = 0
+    preview = []
+    for r in rows:
+        if count < max_preview:
+            preview.append(r)
+        count += 1
+    return count, preview
+
+
+def summarize_rows(rows, max_preview, filter_blank=None, mark_column=None, diff_key=None, previous=None):
+    """
+    流式汇总一个数据源的查询结果：只保留总数、预览行和最大高水位。
+
+    参数：
+    - rows：查询结果（通常是生成器）
+    - max_preview：保留的预览条数
+    - filter_blank：需要去掉空值的字段名（None 表示不过滤）
+    - mark_column：增量模式的高水位字段（None 表示不统计）
+    - diff_key：差异推送模式下作为条目键的字段名（None 表示不做差异）
+    - previous：上次发送时的条目集合 {条目键: 内容指纹}
+
+    返回：字典 {"count": 总条数, "preview": 预览行列表, "max_mark": 最大高水位或 None}；
+    差异模式下额外包含 "items"（本次全部条目的键和指纹）、"added"（新增或内容变化的条数）、
+    "added_preview"（前 max_preview 条新增行）
+    """
+    count = 0
+    preview = []
+    max_mark = None
+    items = {}
+    added = 0
+    added_preview = []
+    previous = previous or {}
+    for r in rows:
+        if filter_blank and not (r.get(filter_blank) or "").strip():
+            continue
+        if count < max_preview:
+            preview.append(r)
+        count += 1
+        if mark_column:
+            v = row_mark(r, mark_column)
+            if v is not None and (max_mark is None or v > max_mark):
+                max_mark = v
+        if diff_key:
+            key = item_key(r.get(diff_key))
+            fp = row_fingerprint(r)
+            if key in items:
+                # 同一个键出现多次时只算一次
+                continue
+            items[key] = fp
+            if previous.get(key) != fp:
+                added += 1
+                if len(added_preview) < max_preview:
+                    added_preview.append(r)
+    result = {"count": count, "preview": preview, "max_mark": max_mark}
+    if diff_key:
+        result.update({"items": items, "added": added, "added_preview": added_preview})
+    return result
+
+
+def _diff_display(r, field):
+    # 与原消息一致：空值显示为 null
+    value = r.get(field)
+    if value is None or not item_key(value).strip():
+        return u"null"
+    return item_key(value)
+
+
+def compose_diff_text(title, added_rows, added_count, recovered, max_preview, field):
+    """
+    组装差异推送的文本消息：只列出新增（或内容变化）和已恢复的条目。
+
+    参数：
+    - title：数据源说明，例如 u"推送失败项目"
+    - added_rows：新增条目的预览行
+    - added_count：新增条目总数
+    - recovered：已恢复（本次不再出现）的条目键列表
+    - max_preview：每部分最多展示的条数
+    - field：展示用字段名
+
+    返回：
+    - 字符串；没有任何变化时返回 None
+    """
+    if not added_count and not recovered:
         return None
     lines = []
-    title_tpl = (msg_cfg or {}).get("title_text") or u"数据库告警：检测到 {count} 条新数据"
-    item_tpl = (msg_cfg or {}).get("item_text") or u"id={id}，{title}（{created_at}）"
-    footer_tpl = (msg_cfg or {}).get("footer_text") or u"更多...（已省略 {omitted} 条）"
-    lines.append(title_tpl.format(count=count))
+    lines.append(u"%s：新增 %d 条，恢复 %d 条" % (title, added_count, len(recovered)))
     lines.append(u"——")
-    preview = rows[:max_preview]
-    for r in preview:
-        # 显示每条的关键信息
-        lines.append(item_tpl.format(id=r["id"], title=r["title"], created_at=r["created_at"]))
-    if count > len(preview):
-        lines.append(footer_tpl.format(omitted=(count - len(preview))))
+    if added_count:
+        lines.append(u"新增：")
+        for r in added_rows[:max_preview]:
+            lines.append(_diff_display(r, field))
+        if added_count > len(added_rows[:max_preview]):
+            lines.append(u"更多...（已省略 %d 条）" % (added_count - len(added_rows[:max_preview])))
+    if recovered:
+        lines.append(u"已恢复：")
+        for key in recovered[:max_preview]:
+            lines.append(key or u"null")
+        if len(recovered) > max_preview:
+            lines.append(u"更多...（已省略 %d 条）" % (len(recovered) - max_preview))
+    return u"\n".join(lines)
+
+
+def compose_diff_markdown(title, added_rows, added_count, recovered, max_preview, field):
+    """
+    组装差异推送的 Markdown 消息，参数同 compose_diff_text。
+    """
+    if not added_count and not recovered:
+        return None
+    lines = []
+    lines.append(u"## %s：新增 %d 条，恢复 %d 条" % (title, added_count, len(recovered)))
+    if added_count:
+        lines.append(u"")
+        lines.append(u"**新增**")
+        for r in added_rows[:max_preview]:
+            lines.append(u"- %s" % _diff_display(r, field))
+        if added_count > len(added_rows[:max_preview]):
+            lines.append(u"> 更多...（已省略 %d 条）" % (added_count - len(added_rows[:max_preview])))
+    if recovered:
+        lines.append(u"")
+        lines.append(u"**已恢复**")
+        for key in recovered[:max_preview]:
+            lines.append(u"- %s" % (key or u"null"))
+        if len(recovered) > max_preview:
+            lines.append(u"> 更多...（已省略 %d 条）" % (len(recovered) - max_preview))
     return u"\n".join(lines)
 
 
-def compose_markdown_message(rows, max_preview, msg_cfg=None):
+_FOOTER_TEXT = u"更多...（已省略 {omitted} 条）"
+_FOOTER_MARKDOWN = u"> 更多...（已省略 {omitted} 条）"
+
+
+def _text_digest(title, item, footer=_FOOTER_TEXT, prepare=None):
+    # 文本消息：标题下一行 "——"，省略提示紧跟在条目后面
+    return Digest(title, item, footer, separator=u"——", prepare=prepare)
+
+
+def _markdown_digest(title, item, footer=_FOOTER_MARKDOWN, prepare=None):
+    # Markdown 消息：标题和省略提示前各空一行
+    return Digest(title, item, footer, separator=u"", footer_separator=u"", prepare=prepare)
+
+
+def _null_if_blank(field):
+    # 空值显示为 null（与差异推送一致）
+    return lambda r: {field: _diff_display(r, field)}
+
+
+# 消息模板只编译一次，每轮直接复用
+_JOBCODE_TEXT = _text_digest(u"数据库告警：检测到 {count} 个有值的 jobcode", u"jobcode={jobcode}")
+_JOBCODE_MARKDOWN = _markdown_digest(u"## 数据库告警：检测到 {count} 个有值的 jobcode", u"- jobcode={jobcode}")
+_FAILED_PUSH_TEXT = _text_digest(u"以下项目推送不成功", u"{field0001}")
+_FAILED_PUSH_MARKDOWN = _markdown_digest(u"## 以下项目推送不成功", u"- {field0001}")
+_FAILED_PRODUCT_TEXT = _text_digest(u"以下产品推送不成功", u"{field0042}", prepare=_null_if_blank("field0042"))
+_FAILED_PRODUCT_MARKDOWN = _markdown_digest(u"## 以下产品推送不成功", u"- {field0042}", prepare=_null_if_blank("field0042"))
+
+# [message] 各模板可用的占位符（对应 alerts 表的字段）
+MESSAGE_TEMPLATE_FIELDS = {
+    "title_text": ["count"],
+    "item_text": ["id", "title", "created_at"],
+    "footer_text": ["omitted"],
+    "title_markdown": ["count"],
+    "item_markdown": ["id", "title", "created_at"],
+    "footer_markdown": ["omitted"],
+}
+
+
+def _render_digest(digest, rows, max_preview, total=None, max_bytes=None):
+    count, preview = _count_and_preview(rows, max_preview, total)
+    if count == 0:
+        return None
+    return digest.render(count, preview, max_bytes)
+
+
+def compose_message(rows, max_preview, msg_cfg=None, total=None, max_bytes=None):
+    """
+    组织要发送的文本消息：
+    - 标题：本次查询发现多少条新数据
+    - 摘要：列出前 max_preview 条的 id、标题、时间
+    返回：字符串
+    """
+    msg_cfg = msg_cfg or {}
+    digest = _text_digest(
+        msg_cfg.get("title_text") or u"数据库告警：检测到 {count} 条新数据",
+        msg_cfg.get("item_text") or u"id={id}，{title}（{created_at}）",
+        msg_cfg.get("footer_text") or _FOOTER_TEXT,
+    )
+    return _render_digest(digest, rows, max_preview, total, max_bytes)
+
+
+def compose_markdown_message(rows, max_preview, msg_cfg=None, total=None, max_bytes=None):
     """
     组织要发送的 Markdown 消息：
     - 标题：用二级标题展示总数
     - 列表：前 max_preview 条的 id、标题、时间
     返回：字符串（Markdown）
     """
-    count = len(rows)
-    if count == 0:
-        return None
-    lines = []
-    title_tpl = (msg_cfg or {}).get("title_markdown") or u"## 数据库告警：检测到 {count} 条新数据"
-    item_tpl = (msg_cfg or {}).get("item_markdown") or u"- id={id} ｜ {title} ｜ {created_at}"
-    footer_tpl = (msg_cfg or {}).get("footer_markdown") or u"> 更多...（已省略 {omitted} 条）"
-    lines.append(title_tpl.format(count=count))
-    lines.append("")
-    preview = rows[:max_preview]
-    for r in preview:
-        try:
-            lines.append(item_tpl.format(**r))
-        except Exception:
-            # 回退到常见字段
-            lines.append(item_tpl)
-            lines.append(item_tpl.format(**r))
-        except Exception:
-            lines.append(item_tpl)
-    if count > len(preview):
-        lines.append("")
-        lines.append(footer_tpl.format(omitted=(count - len(preview))))
-    return u"\n".join(lines)
+    msg_cfg = msg_cfg or {}
+    digest = _markdown_digest(
+        msg_cfg.get("title_markdown") or u"## 数据库告警：检测到 {count} 条新数据",
+        msg_cfg.get("item_markdown") or u"- id={id} ｜ {title} ｜ {created_at}",
+        msg_cfg.get("footer_markdown") or _FOOTER_MARKDOWN,
+    )
+    return _render_digest(digest, rows, max_preview, total, max_bytes)
 
 
-def compose_jobcode_text(rows, max_preview):
+def compose_jobcode_text(rows, max_preview, total=None, max_bytes=None):
     """
     小白版说明：组装“文本消息”，只展示 jobcode。
 
@@ -193,20 +555,10 @@ def compose_jobcode_text(rows, max_preview):
     - 为什么：你希望只要有数据就推送 jobcode 内容
     - 返回：字符串；无数据时返回 None
     """
-    count = len(rows)
-    if count == 0:
-        return None
-    lines = []
-    lines.append(u"数据库告警：检测到 %d 个有值的 jobcode" % count)
-    lines.append(u"——")
-    for r in rows[:max_preview]:
-        lines.append(u"jobcode=%s" % (r.get("jobcode") or u""))
-    if count > max_preview:
-        lines.append(u"更多...（已省略 %d 条）" % (count - max_preview))
-    return u"\n".join(lines)
+    return _render_digest(_JOBCODE_TEXT, rows, max_preview, total, max_bytes)
 
 
-def compose_jobcode_markdown(rows, max_preview):
+def compose_jobcode_markdown(rows, max_preview, total=None, max_bytes=None):
     """
     小白版说明：组装“Markdown 消息”，只展示 jobcode（群机器人更好看）。
 
@@ -214,305 +566,1149 @@ def compose_jobcode_markdown(rows, max_preview):
     - 为什么：你希望只要有数据就推送 jobcode 内容
     - 返回：字符串（Markdown）；无数据时返回 None
     """
-    count = len(rows)
-    if count == 0:
-        return None
-    lines = []
-    lines.append(u"## 数据库告警：检测到 %d 个有值的 jobcode" % count)
-    lines.append("")
-    for r in rows[:max_preview]:
-        lines.append(u"- jobcode=%s" % (r.get("jobcode") or u""))
-    if count > max_preview:
-        lines.append("")
-        lines.append(u"> 更多...（已省略 %d 条）" % (count - max_preview))
-    return u"\n".join(lines)
+    return _render_digest(_JOBCODE_MARKDOWN, rows, max_preview, total, max_bytes)
 
 
-def compose_failed_push_text(rows, max_preview):
+def compose_failed_push_text(rows, max_preview, total=None, max_bytes=None):
     """
     组装"推送失败项目"的文本消息。
 
     参数：
-    - rows：查询结果列表，每个元素包含 field0001
+    - rows：查询结果（列表或生成器），每个元素包含 field0001
     - max_preview：最多展示的条数
+    - total：rows 只是预览行时，由调用方给出的总条数
+    - max_bytes：整条消息的字节上限（None 表示不限制），超出部分计入“已省略”
 
     返回：
     - 字符串消息；无数据时返回 None
     """
-    count = len(rows)
-    if count == 0:
-        return None
-    lines = []
-    lines.append(u"以下项目推送不成功")
-    lines.append(u"——")
-    for r in rows[:max_preview]:
-        field0001 = r.get("field0001") or u""
-        lines.append(u"%s" % field0001)
-    if count > max_preview:
-        lines.append(u"更多...（已省略 %d 条）" % (count - max_preview))
-    return u"\n".join(lines)
+    return _render_digest(_FAILED_PUSH_TEXT, rows, max_preview, total, max_bytes)
 
 
-def compose_failed_push_markdown(rows, max_preview):
+def compose_failed_push_markdown(rows, max_preview, total=None, max_bytes=None):
     """
-    组装"推送失败项目"的 Markdown 消息。
-
-    参数：
-    - rows：查询结果列表，每个元素包含 field0001
-    - max_preview：最多展示的条数
+    组装"推送失败项目"的 Markdown 消息，参数同 compose_failed_push_text。
 
     返回：
     - Markdown 字符串；无数据时返回 None
     """
-    count = len(rows)
-    if count == 0:
-        return None
-    lines = []
-    lines.append(u"## 以下项目推送不成功")
-    lines.append(u"")
-    for r in rows[:max_preview]:
-        field0001 = r.get("field0001") or u""
-        lines.append(u"- %s" % field0001)
-    if count > max_preview:
-        lines.append(u"")
-        lines.append(u"> 更多...（已省略 %d 条）" % (count - max_preview))
-    return u"\n".join(lines)
+    return _render_digest(_FAILED_PUSH_MARKDOWN, rows, max_preview, total, max_bytes)
 
 
-def compose_failed_product_push_text(rows, max_preview):
+def compose_failed_product_push_text(rows, max_preview, total=None, max_bytes=None):
     """
-    组装"推送失败产品"的文本消息。
+    组装"推送失败产品"的文本消息（field0042 为空时显示 null）。
 
     参数：
-    - rows：查询结果列表，每个元素包含 field0042
+    - rows：查询结果（列表或生成器），每个元素包含 field0042
     - max_preview：最多展示的条数
+    - total：rows 只是预览行时，由调用方给出的总条数
+    - max_bytes：整条消息的字节上限（None 表示不限制），超出部分计入“已省略”
 
     返回：
     - 字符串消息；无数据时返回 None
     """
-    count = len(rows)
-    if count == 0:
-        return None
-    lines = []
-    lines.append(u"以下产品推送不成功")
-    lines.append(u"——")
-    for r in rows[:max_preview]:
-        field0042 = r.get("field0042")
-        if not field0042 or not field0042.strip():
-            field0042 = u"null"
-        lines.append(u"%s" % field0042)
-    if count > max_preview:
-        lines.append(u"更多...（已省略 %d 条）" % (count - max_preview))
-    return u"\n".join(lines)
+    return _render_digest(_FAILED_PRODUCT_TEXT, rows, max_preview, total, max_bytes)
 
 
-def compose_failed_product_push_markdown(rows, max_preview):
+def compose_failed_product_push_markdown(rows, max_preview, total=None, max_bytes=None):
     """
-    组装"推送失败产品"的 Markdown 消息。
-
-    参数：
-    - rows：查询结果列表，每个元素包含 field0042
-    - max_preview：最多展示的条数
+    组装"推送失败产品"的 Markdown 消息，参数同 compose_failed_product_push_text。
 
     返回：
     - Markdown 字符串；无数据时返回 None
     """
-    count = len(rows)
+    return _render_digest(_FAILED_PRODUCT_MARKDOWN, rows, max_preview, total, max_bytes)
+
+
+def _join_columns(columns, prefix):
+    # 没有配置条目模板时，按 display 字段（或全部字段）用 " ｜ " 连接
+    def prepare(r):
+        cols = columns or sorted(r.keys())
+        return {"item": prefix + u" ｜ ".join(u"%s" % (r.get(c) if r.get(c) is not None else u"") for c in cols)}
+    return prepare
+
+
+def compose_check(check, rows, max_preview, total=None, markdown=False, max_bytes=None):
+    """
+    按 [check:名称] 中的模板组装消息。
+
+    - 标题模板可用 {title} {count}；条目模板可用查询结果中的任意字段名，例如 {field0001}
+    - 没有配置条目模板时，按 display 字段（或全部字段）用 " ｜ " 连接
+    - 某行缺少模板中的字段时该字段显示为空
+
+    返回：
+    - 字符串消息；无数据时返回 None
+    """
+    count, preview = _count_and_preview(rows, max_preview, total)
     if count == 0:
         return None
-    lines = []
-    lines.append(u"## 以下产品推送不成功")
-    lines.append(u"")
-    for r in rows[:max_preview]:
-        field0042 = r.get("field0042")
-        if not field0042 or not field0042.strip():
-            field0042 = u"null"
-        lines.append(u"- %s" % field0042)
-    if count > max_preview:
-        lines.append(u"")
-        lines.append(u"> 更多...（已省略 %d 条）" % (count - max_preview))
-    return u"\n".join(lines)
+    if markdown:
+        title_tpl = check.get("title_markdown") or u"## {title}"
+        item_tpl = check.get("item_markdown") or (u"- " + check["item_text"] if check.get("item_text") else None)
+        make = _markdown_digest
+    else:
+        title_tpl = check.get("title_text") or u"{title}"
+        item_tpl = check.get("item_text")
+        make = _text_digest
+    if item_tpl:
+        digest = make(title_tpl, item_tpl)
+    else:
+        digest = make(title_tpl, u"{item}", prepare=_join_columns(check["display"], u"- " if markdown else u""))
+    return digest.render(count, preview, max_bytes, extra={"title": check["title"]})
 
 
-def main():
+def _check_composers(check):
+    """为一个检查生成与内置数据源相同签名的 (文本, Markdown) 组装函数。"""
+    return (
+        lambda rows, max_preview, total=None, max_bytes=None: compose_check(
+            check, rows, max_preview, total, max_bytes=max_bytes),
+        lambda rows, max_preview, total=None, max_bytes=None: compose_check(
+            check, rows, max_preview, total, markdown=True, max_bytes=max_bytes),
+    )
+
+
+def _console_text(text):
     """
-    主流程：读配置→（可选）初始化示例库→查询→（干跑或真实）发送→更新去重状态。
-    支持同时查询多个数据库（db 和 db_mysql）。
+    Python 2 下 unicode 文本编码为 UTF-8 便于终端/日志显示；Python 3 直接使用 str。
     """
-    parser = argparse.ArgumentParser(description="Query DB and notify WeCom (Python 2.7)")
-    parser.add_argument("--config", default="config/config.ini", help="配置文件路径")
-    parser.add_argument("--state", default="state/last_seen.json", help="去重状态文件路径")
-    parser.add_argument("--limit", type=int, default=50, help="单次最多处理的记录数")
-    parser.add_argument("--preview", type=int, default=5, help="消息中展示的预览条数")
-    parser.add_argument("--dry-run", action="store_true", help="干跑模式：不真正发企业微信，只打印")
-    parser.add_argument("--init-demo", action="store_true", help="初始化示例 SQLite 表并插入一条数据")
-    args = parser.parse_args()
+    if sys.version_info[0] == 2:
+        try:
+            return text.encode("utf-8")
+        except Exception:
+            return text
+    return text
 
-    cfg = read_config(args.config)
 
-    if args.init_demo and cfg["db"]["driver"] == "sqlite":
-        init_demo_if_needed(cfg["db"]["sqlite_path"])
-        init_demo_jobcodes(cfg["db"]["sqlite_path"])
+def query_duplicates_indexed(db, idx_cfg):
+    """
+    通过本地 jobcode 计数索引得到重复 jobcode（代替整表 GROUP BY）。
 
-    # 收集所有查询结果和消息
-    all_messages = []
-    
-    # 查询主数据库（db 配置节）
-    print("正在查询主数据库 [db] driver=%s ..." % cfg["db"]["driver"])
-    if cfg["db"]["driver"] == "sqlite":
-        rows = query_duplicate_jobcodes(cfg["db"]["sqlite_path"])
-    elif cfg["db"]["driver"] == "sqlserver":
-        rows = query_duplicate_jobcodes_sqlserver(
-            cfg["db"]["host"], cfg["db"]["user"], cfg["db"]["password"], cfg["db"]["database"], cfg["db"].get("port", 1433)
+    - 平时只读取源表 id 高水位之后的新行
+    - 每隔 full_interval 秒全量核对一次，纠正删除/修改造成的偏差
+    - 打印新变成重复 / 不再重复的 jobcode
+
+    返回：与 query_duplicate_jobcodes 相同格式的列表
+    """
+    col = idx_cfg.get("id_column") or "id"
+    if db["driver"] == "sqlite":
+        path = db["sqlite_path"]
+        source_id = "sqlite:%s" % os.path.abspath(path)
+        fetch_after = lambda last_id: query_jobcodes_after(path, last_id, col)
+        fetch_counts = lambda: query_jobcode_counts(path, col)
+    else:
+        args = (db["host"], db["user"], db["password"], db["database"], db.get("port", 1433))
+        source_id = "sqlserver:%s:%s/%s" % (db["host"], db.get("port", 1433), db["database"])
+        fetch_after = lambda last_id: query_jobcodes_after_sqlserver(*args, last_id=last_id, id_column=col)
+        fetch_counts = lambda: query_jobcode_counts_sqlserver(*args, id_column=col)
+    index = JobcodeIndex(idx_cfg["path"])
+    info = index.refresh(source_id, fetch_after, fetch_counts, idx_cfg.get("full_interval", 3600))
+    print("jobcode 索引%s：读取 %d 行，新增重复 %d 个，不再重复 %d 个" % (
+        "全量核对" if info["full"] else "增量更新", info["scanned"], len(info["became"]), len(info["cleared"])
+    ))
+    if info["became"]:
+        print(_console_text(u"新变成重复的 jobcode：%s" % u", ".join(info["became"])))
+    if info["cleared"]:
+        print(_console_text(u"不再重复的 jobcode：%s" % u", ".join(info["cleared"])))
+    return index.duplicates()
+
+
+def _builtin_check(name, query):
+    """
+    把内置的 MySQL 查询包装成检查定义，便于和 [db_mysql] 上的其他检查合并成一批执行。
+    """
+    return {"name": name, "source": "db_mysql", "sql": full_scan_sql(query), "params": {}, "interval": 0}
+
+
+def build_sources(cfg, marks=None, limit=None):
+    """
+    根据配置列出本次要查询的数据源（顺序即消息中的展示顺序）。
+
+    参数：
+    - cfg：read_config 返回的配置
+    - marks：增量模式下各数据源上次处理到的高水位，如 {"db_mysql.failed_push": 1024}
+    - limit：增量模式下单个数据源单次最多读取的行数
+
+    每个数据源是一个字典：
+    - name / label：名称与日志里显示的说明
+    - query：无参函数，返回行的可迭代对象（通常是流式读取的生成器）
+    - filter_blank：需要在结果中去掉空值的字段名（None 表示不过滤）
+    - compose_text / compose_markdown：组装消息的函数
+    - timeout：该查询的截止时间（秒），None 表示使用 [query] timeout
+    - required：查询失败时是否让整次运行报错（主数据库 [db] 为 True）
+    - mark_column：增量模式的高水位字段（None 表示全量查询）
+    - summary：摘要模式查询函数 summary(preview) → {"count", "preview", "max_mark"}；None 表示流式读取全部行
+    - diff_key / diff_title：差异推送模式下的条目键字段和消息标题（diff_key 为 None 表示不做差异）
+    - check：检查定义；不为 None 时由 _check_group_task 与同库的其他检查合并执行，不调用 query
+    - interval：至少隔多少秒才真正查询一次（启用 [result_cache] 时，没到时间就使用缓存的结果）
+    """
+    sources = []
+    marks = marks or {}
+    inc = cfg.get("incremental", {})
+    # 差异推送需要每次拿到完整的条目集合，因此开启后不走增量模式和摘要模式
+    diff_on = cfg.get("diff", {}).get("enabled", False)
+    columns = inc.get("columns", {}) if inc.get("enabled") and not diff_on else {}
+    # 增量模式只适用于逐行的数据源；重复 jobcode 是全表分组统计，始终全量
+    db_mark = columns.get("db") if cfg["db"]["driver"] == "mysql" else None
+    fp_mark = columns.get("db_mysql.failed_push")
+    fpp_mark = columns.get("db_mysql.failed_product_push")
+    db = cfg["db"]
+    driver = db["driver"]
+    idx_cfg = cfg.get("jobcode_index", {})
+    summary = None
+    if driver in ("sqlite", "sqlserver") and idx_cfg.get("enabled"):
+        query = lambda: query_duplicates_indexed(db, idx_cfg)
+    elif driver == "sqlite":
+        query = lambda: iter_duplicate_jobcodes(db["sqlite_path"])
+        summary = lambda preview: summary_duplicate_jobcodes(db["sqlite_path"], preview)
+    elif driver == "sqlserver":
+        query = lambda: iter_duplicate_jobcodes_sqlserver(
+            db["host"], db["user"], db["password"], db["database"], db.get("port", 1433)
+        )
+        summary = lambda preview: summary_duplicate_jobcodes_sqlserver(
+            db["host"], db["user"], db["password"], db["database"], db.get("port", 1433), preview
         )
-    elif cfg["db"]["driver"] == "mysql":
-        rows = query_failed_push_mysql(
-            cfg["db"]["host"], cfg["db"]["user"], cfg["db"]["password"], cfg["db"]["database"], cfg["db"].get("port", 3306)
+    elif driver == "mysql":
+        query = lambda: iter_failed_push_mysql(
+            db["host"], db["user"], db["password"], db["database"], db.get("port", 3306),
+            db_mark, marks.get("db"), limit,
+        )
+        summary = lambda preview: summary_failed_push_mysql(
+            db["host"], db["user"], db["password"], db["database"], db.get("port", 3306), preview,
+            db_mark, marks.get("db"), limit,
         )
     else:
-        raise Exception("不支持的数据库驱动：%s" % cfg["db"]["driver"])
-
-    # 根据数据库类型过滤数据
-    if cfg["db"]["driver"] == "mysql":
+        raise Exception("不支持的数据库驱动：%s" % driver)
+    sources.append({
+        "name": "db",
+        "label": "主数据库 [db]",
+        "query": query,
         # MySQL 查询已经在 SQL 中过滤了 field0045='2'，这里不需要额外过滤
-        pass
-    else:
-        # SQLite 和 SQL Server 查询 jobcode，过滤空值
-        rows = [r for r in rows if (r.get("jobcode") or "").strip()]
-    
-    print("主数据库 [db] 查询结果：%d 条记录" % len(rows))
-    
-    # 生成主数据库消息
-    if rows:
-        use_robot = False
-        use_markdown = False
-        msg = None
-        if "robot" in cfg and cfg["robot"].get("webhook"):
-            use_robot = True
-            fmt = cfg["robot"].get("format") or "markdown"
-            if fmt.lower() == "markdown":
-                use_markdown = True
-                if cfg["db"]["driver"] == "mysql":
-                    msg = compose_failed_push_markdown(rows, args.preview)
-                else:
-                    msg = compose_jobcode_markdown(rows, args.preview)
-        
-        if msg is None:
-            if cfg["db"]["driver"] == "mysql":
-                msg = compose_failed_push_text(rows, args.preview)
-            else:
-                msg = compose_jobcode_text(rows, args.preview)
-        
-        if msg:
-            all_messages.append(msg)
-    
+        "filter_blank": None if driver == "mysql" else "jobcode",
+        "compose_text": compose_failed_push_text if driver == "mysql" else compose_jobcode_text,
+        "compose_markdown": compose_failed_push_markdown if driver == "mysql" else compose_jobcode_markdown,
+        "timeout": db.get("timeout"),
+        "required": True,
+        "mark_column": db_mark,
+        "summary": summary if db.get("summary") and not diff_on else None,
+        "diff_key": ("field0001" if driver == "mysql" else "jobcode") if diff_on else None,
+        "diff_title": u"推送失败项目" if driver == "mysql" else u"重复 jobcode",
+        "interval": db.get("interval", 0),
+    })
+
     # 查询 MySQL 数据库（db_mysql 配置节，如果启用）
     if "db_mysql" in cfg and cfg["db_mysql"].get("enabled", True):
-        print("正在查询 MySQL 数据库 [db_mysql] - 推送失败项目...")
-        try:
-            mysql_rows = query_failed_push_mysql(
-                cfg["db_mysql"]["host"], 
-                cfg["db_mysql"]["user"], 
-                cfg["db_mysql"]["password"], 
-                cfg["db_mysql"]["database"], 
-                cfg["db_mysql"].get("port", 3306)
-            )
-            
-            print("MySQL 数据库 [db_mysql] 推送失败项目查询结果：%d 条记录" % len(mysql_rows))
-            
-            if mysql_rows:
-                use_robot = False
-                use_markdown = False
-                mysql_msg = None
-                if "robot" in cfg and cfg["robot"].get("webhook"):
-                    use_robot = True
-                    fmt = cfg["robot"].get("format") or "markdown"
-                    if fmt.lower() == "markdown":
-                        use_markdown = True
-                        mysql_msg = compose_failed_push_markdown(mysql_rows, args.preview)
-                
-                if mysql_msg is None:
-                    mysql_msg = compose_failed_push_text(mysql_rows, args.preview)
-                
-                if mysql_msg:
-                    all_messages.append(mysql_msg)
-        except Exception as e:
-            print("MySQL 推送失败项目查询失败：%s" % str(e))
-        
-        # 查询推送失败产品
-        print("正在查询 MySQL 数据库 [db_mysql] - 推送失败产品...")
+        m = cfg["db_mysql"]
+        # 全量、非摘要模式下，两个内置检查与同库的 [check:名称] 一起合并成一批执行（一个网络来回）
+        batch_builtin = cfg.get("query", {}).get("batch", True)
+        sources.append({
+            "name": "db_mysql.failed_push",
+            "label": "MySQL 数据库 [db_mysql] 推送失败项目",
+            "query": lambda: iter_failed_push_mysql(
+                m["host"], m["user"], m["password"], m["database"], m.get("port", 3306),
+                fp_mark, marks.get("db_mysql.failed_push"), limit,
+            ),
+            "filter_blank": None,
+            "compose_text": compose_failed_push_text,
+            "compose_markdown": compose_failed_push_markdown,
+            "timeout": m.get("timeout"),
+            "required": False,
+            "mark_column": fp_mark,
+            "summary": (lambda preview: summary_failed_push_mysql(
+                m["host"], m["user"], m["password"], m["database"], m.get("port", 3306), preview,
+                fp_mark, marks.get("db_mysql.failed_push"), limit,
+            )) if m.get("summary") and not diff_on else None,
+            "diff_key": "field0001" if diff_on else None,
+            "diff_title": u"推送失败项目",
+            "check": _builtin_check("db_mysql.failed_push", FAILED_PUSH_QUERY)
+            if batch_builtin and not fp_mark and not m.get("summary") else None,
+            "interval": m.get("interval", 0),
+        })
+        sources.append({
+            "name": "db_mysql.failed_product_push",
+            "label": "MySQL 数据库 [db_mysql] 推送失败产品",
+            "query": lambda: iter_failed_product_push_mysql(
+                m["host"], m["user"], m["password"], m["database"], m.get("port", 3306),
+                fpp_mark, marks.get("db_mysql.failed_product_push"), limit,
+            ),
+            "filter_blank": None,
+            "compose_text": compose_failed_product_push_text,
+            "compose_markdown": compose_failed_product_push_markdown,
+            "timeout": m.get("timeout"),
+            "required": False,
+            "mark_column": fpp_mark,
+            "summary": (lambda preview: summary_failed_product_push_mysql(
+                m["host"], m["user"], m["password"], m["database"], m.get("port", 3306), preview,
+                fpp_mark, marks.get("db_mysql.failed_product_push"), limit,
+            )) if m.get("summary") and not diff_on else None,
+            "diff_key": "field0042" if diff_on else None,
+            "diff_title": u"推送失败产品",
+            "check": _builtin_check("db_mysql.failed_product_push", FAILED_PRODUCT_PUSH_QUERY)
+            if batch_builtin and not fpp_mark and not m.get("summary") else None,
+            "interval": m.get("interval", 0),
+        })
+
+    # 声明式检查：由 _check_group_task 按数据库分组执行。
+    # 启用结果缓存时全部加入（没到时间的由缓存提供结果）；否则只加入本进程内到了执行时间的检查
+    checks = cfg.get("checks", [])
+    if not cfg.get("result_cache", {}).get("enabled"):
+        checks = _CHECKS.due(checks)
+    for check in checks:
+        compose_text, compose_markdown = _check_composers(check)
+        sources.append({
+            "name": "check.%s" % check["name"],
+            "label": "检查 [check:%s]" % check["name"],
+            "query": None,
+            "check": check,
+            "filter_blank": check["key"] if check["filter_blank"] else None,
+            "compose_text": compose_text,
+            "compose_markdown": compose_markdown,
+            "timeout": check["timeout"],
+            "required": False,
+            "mark_column": None,
+            "summary": None,
+            "diff_key": check["key"] if diff_on else None,
+            "diff_title": check["title"],
+            "interval": check["interval"],
+        })
+    return sources
+
+
+def _timed_filter(fn):
+    """
+    执行流式汇总 fn()，把其中不属于连接/执行/取数据的耗时（过滤空值、统计、差异比对）计入 filter 阶段。
+    """
+    before = thread_seconds()
+    start = time.time()
+    result = fn()
+    observe("filter", max(0.0, time.time() - start - (thread_seconds() - before)))
+    return result
+
+
+def _summary_task(src, max_preview, previous=None):
+    """
+    生成并发任务：摘要模式直接在 SQL 里算总数和预览；否则执行数据源查询并流式汇总
+    （SQLite/SQL Server 的 jobcode 在这里过滤空值；差异模式下同时与上次的条目集合比对）。
+    """
+    def task():
+        with labels(source=src["name"]):
+            if src.get("summary"):
+                return src["summary"](max_preview)
+            return _timed_filter(lambda: summarize_rows(
+                src["query"](), max_preview, src["filter_blank"], src.get("mark_column"), src.get("diff_key"), previous
+            ))
+
+    return task
+
+
+def _check_group_task(cfg, source, srcs, max_preview, previous_sets):
+    """
+    生成并发任务：在 source 对应的同一个数据库连接上执行这一组检查（能合并时一批执行），逐个流式汇总。
+
+    返回的任务结果为 {数据源名: 汇总字典或异常对象}。
+    """
+    by_check = dict((src["check"]["name"], src) for src in srcs)
+
+    def consume(check, rows):
+        src = by_check[check["name"]]
+        return _timed_filter(lambda: summarize_rows(
+            rows, max_preview, src["filter_blank"], None, src.get("diff_key"), previous_sets.get(src["name"])
+        ))
+
+    def task():
+        with labels(source=source):
+            results = _CHECKS.run_group(cfg[source], [src["check"] for src in srcs], consume)
+        return dict((by_check[name]["name"], value) for name, value in results.items())
+
+    return task
+
+
+def _run_sources(cfg, sources, max_preview, previous_sets, deadline=None):
+    """
+    并发执行所有数据源：内置数据源各一个任务，声明式检查按数据库每组一个任务。
+    deadline 为整轮运行的截止时刻，到点仍未返回的查询按超时处理。
+
+    返回：
+    - TaskResult 列表，与 sources 一一对应、顺序一致
+    """
+    query_cfg = cfg.get("query", {})
+    tasks = []
+    groups = []
+    for src in sources:
+        if src.get("check"):
+            source = src["check"]["source"]
+            group = [g for g in groups if g[0] == source]
+            if group:
+                group[0][1].append(src)
+            else:
+                groups.append((source, [src]))
+        else:
+            # 每个数据源在自己的线程里边读边汇总，只把总数、预览行和高水位交回主线程
+            tasks.append((src["name"], _summary_task(src, max_preview, previous_sets.get(src["name"])), src["timeout"]))
+    for source, srcs in groups:
+        timeouts = [src["timeout"] for src in srcs if src["timeout"]]
+        tasks.append((
+            "checks:%s" % source,
+            _check_group_task(cfg, source, srcs, max_preview, previous_sets),
+            max(timeouts) if timeouts else None,
+        ))
+    results = run_all(
+        tasks,
+        max_workers=query_cfg.get("max_workers", 4),
+        default_timeout=query_cfg.get("timeout", 30),
+        deadline=deadline,
+    )
+    by_name = dict((res.name, res) for res in results)
+
+    expanded = []
+    ran = []
+    for src in sources:
+        if not src.get("check"):
+            expanded.append(by_name[src["name"]])
+            continue
+        group_res = by_name["checks:%s" % src["check"]["source"]]
+        res = TaskResult(src["name"])
+        res.elapsed = group_res.elapsed
+        res.timed_out = group_res.timed_out
+        value = group_res.value.get(src["name"]) if group_res.ok else group_res.error
+        if isinstance(value, Exception):
+            res.error = value
+        else:
+            res.ok = True
+            res.value = value
+            ran.append(src["check"]["name"])
+        expanded.append(res)
+    _CHECKS.mark_run(ran)
+    return expanded
+
+
+def _source_cache_key(cfg, src, max_preview):
+    """
+    数据源的缓存键：数据库、SQL、参数以及影响汇总结果的设置（预览条数、过滤、差异字段）任一变化都会换一个键。
+    """
+    db_name = src["check"]["source"] if src.get("check") else src["name"].split(".")[0]
+    db = cfg.get(db_name, {})
+    return cache_key({
+        "source": src["name"],
+        "db": [db.get("driver"), db.get("host"), db.get("port"), db.get("database"), db.get("sqlite_path")],
+        "sql": src["check"]["sql"] if src.get("check") else None,
+        "params": src["check"]["params"] if src.get("check") else None,
+        "summary": src.get("summary") is not None,
+        "jobcode_index": cfg.get("jobcode_index", {}).get("enabled", False) if src["name"] == "db" else False,
+        "preview": max_preview,
+        "filter_blank": src.get("filter_blank"),
+        "diff_key": src.get("diff_key"),
+    })
+
+
+def _cacheable(src):
+    # 增量模式的数据源每次都要从高水位往后读，不能用旧结果代替
+    return bool(src.get("interval")) and not src.get("mark_column")
+
+
+def _cached_results(cfg, cache, sources, max_preview, previous_sets):
+    """
+    找出还没到 interval、可以直接使用缓存结果的数据源。
+
+    返回：
+    - 字典 {数据源名: (汇总字典, 已缓存的秒数)}
+    """
+    cached = {}
+    if cache is None:
+        return cached
+    for src in sources:
+        if not _cacheable(src):
+            continue
+        hit = cache.get(_source_cache_key(cfg, src, max_preview), src["interval"])
+        if hit is None:
+            continue
+        summary, age = hit
+        if src.get("diff_key"):
+            # 缓存里的“新增”是相对于当时的条目集合；之后可能已经发送过，按现在的集合重新比对
+            previous = previous_sets.get(src["name"]) or {}
+            items = summary["items"]
+            summary["added"] = sum(1 for k, fp in items.items() if previous.get(k) != fp)
+            summary["added_preview"] = [
+                r for r in summary["added_preview"]
+                if previous.get(item_key(r.get(src["diff_key"]))) != items.get(item_key(r.get(src["diff_key"])))
+            ]
+        cached[src["name"]] = (summary, age)
+    return cached
+
+
+def _store_results(cfg, cache, sources, results, max_preview):
+    """
+    把本轮真正查询到的结果写入缓存（缓存出错只打印提示，不影响本轮）。
+    """
+    if cache is None:
+        return
+    for src, res in zip(sources, results):
+        if not (res.ok and _cacheable(src)):
+            continue
         try:
-            product_rows = query_failed_product_push_mysql(
-                cfg["db_mysql"]["host"], 
-                cfg["db_mysql"]["user"], 
-                cfg["db_mysql"]["password"], 
-                cfg["db_mysql"]["database"], 
-                cfg["db_mysql"].get("port", 3306)
-            )
-            
-            print("MySQL 数据库 [db_mysql] 推送失败产品查询结果：%d 条记录" % len(product_rows))
-            
-            if product_rows:
-                use_robot = False
-                use_markdown = False
-                product_msg = None
-                if "robot" in cfg and cfg["robot"].get("webhook"):
-                    use_robot = True
-                    fmt = cfg["robot"].get("format") or "markdown"
-                    if fmt.lower() == "markdown":
-                        use_markdown = True
-                        product_msg = compose_failed_product_push_markdown(product_rows, args.preview)
-                
-                if product_msg is None:
-                    product_msg = compose_failed_product_push_text(product_rows, args.preview)
-                
-                if product_msg:
-                    all_messages.append(product_msg)
+            cache.put(_source_cache_key(cfg, src, max_preview), src["name"], res.value)
         except Exception as e:
-            print("MySQL 推送失败产品查询失败：%s" % str(e))
+            print("%s 查询结果写入缓存失败：%s" % (src["label"], str(e)))
+
+
+def _retry_policy(cfg, deadline=None):
+    sender_cfg = cfg.get("sender", {})
+    return RetryPolicy(
+        sender_cfg.get("retry_attempts", 4),
+        sender_cfg.get("retry_base_delay", 1.0),
+        sender_cfg.get("retry_max_delay", 30.0),
+        sender_cfg.get("rate_limit_pause", 60.0),
+        deadline=deadline,
+    )
+
+
+def _channel_name(cfg):
+    """
+    当前配置对应的发送通道名："robot:markdown"、"robot:text" 或 "app:text"。
+    """
+    if "robot" in cfg and cfg["robot"].get("webhook"):
+        fmt = (cfg["robot"].get("format") or "markdown").lower()
+        return "robot:markdown" if fmt == "markdown" else "robot:text"
+    return "app:text"
+
+
+def _resolve_channel(cfg, name):
+    """
+    把 [routes] 或检查的 channels 中写的通道名转换为发送通道名：
+    - "robot"：[robot] 配置节的群机器人（"robot:markdown" 或 "robot:text"）
+    - "app"：[wecom] 配置节的应用（"app:text"）
+    - "robot:名称" / "app:名称"：对应的 [robot:名称] / [app:名称] 配置节
+    """
+    if name == "robot":
+        if not ("robot" in cfg and cfg["robot"].get("webhook")):
+            raise Exception("路由中使用了通道 robot，但 [robot] 没有配置 webhook")
+        return "robot:markdown" if (cfg["robot"].get("format") or "markdown").lower() == "markdown" else "robot:text"
+    if name == "app":
+        return "app:text"
+    if name in cfg.get("channels", {}):
+        return name
+    raise Exception("路由中使用了未配置的通道：%s（需要 [%s] 配置节）" % (name, name))
+
+
+def _routes_for(cfg, src):
+    """
+    数据源 src 要发送到的通道列表：依次取 [routes] 中该数据源的配置、检查的 channels、[routes] default，
+    都没有配置时发送到默认通道（_channel_name）。
+    """
+    routes = cfg.get("routes", {})
+    names = routes.get(src["name"].lower()) or (src.get("check") or {}).get("channels") or routes.get("default")
+    if not names:
+        return [_channel_name(cfg)]
+    channels = []
+    for name in names:
+        channel = _resolve_channel(cfg, name)
+        if channel not in channels:
+            channels.append(channel)
+    return channels
+
+
+def _channel_markdown(cfg, channel):
+    """通道是否发送 Markdown 消息（群机器人按 format 配置，应用只支持文本）。"""
+    named = cfg.get("channels", {}).get(channel)
+    if named is not None:
+        return named["kind"] == "robot" and named["format"] == "markdown"
+    return channel == "robot:markdown"
+
+
+def _channel_sender(cfg, channel):
+    """
+    按通道名创建发送函数和该通道的令牌桶。
+    内置通道（"robot:markdown"、"robot:text"、"app:text"）按 [robot] / [wecom] 配置，
+    与 [robot:名称] / [app:名称] 通道走同一套创建逻辑（见 _named_channel_sender）。
+
+    返回：(send_fn, bucket)；send_fn(content) 失败时抛异常
+    """
+    named = cfg.get("channels", {}).get(channel)
+    if named is not None:
+        return _named_channel_sender(cfg, named)
+    kind, fmt = channel.split(":", 1)
+    if kind == "robot":
+        if not ("robot" in cfg and cfg["robot"].get("webhook")):
+            raise Exception("通道 %s 需要 [robot] webhook，但当前配置中没有" % channel)
+        return _named_channel_sender(cfg, {
+            "kind": "robot",
+            "webhook": cfg["robot"]["webhook"],
+            "mentioned_list": cfg["robot"].get("mentioned_list"),
+            "format": fmt,
+        })
+    wecom = cfg["wecom"]
+    return _named_channel_sender(cfg, {
+        "kind": "app",
+        "corpid": wecom["corpid"],
+        "corpsecret": wecom["corpsecret"],
+        "agentid": wecom["agentid"],
+        "touser": wecom["touser"],
+    })
+
+
+def _named_channel_sender(cfg, ch):
+    """
+    为 [robot:名称] / [app:名称] 通道创建发送函数和令牌桶。
+    令牌桶按 webhook（或应用）区分：不同通道各自限速，指向同一个机器人的通道共用一个令牌桶。
+    """
+    sender_cfg = cfg.get("sender", {})
+    if ch["kind"] == "robot":
+        webhook = ch["webhook"]
+        if ch["format"] == "markdown":
+            from wecom_robot_py2 import send_markdown as robot_send_md
+            send_fn = lambda content: robot_send_md(webhook, content)
+        else:
+            from wecom_robot_py2 import send_text as robot_send_text
+            send_fn = lambda content: robot_send_text(webhook, content, ch["mentioned_list"])
+        return send_fn, get_bucket(webhook, sender_cfg.get("robot_per_minute", 20))
+    from wecom_client_py2 import configure_api_base, send_app_text
+    wecom = cfg["wecom"]
+    configure_api_base(wecom.get("api_base"))
+    send_fn = lambda content: send_app_text(
+        ch["corpid"], ch["corpsecret"], ch["agentid"],
+        ch["touser"], content, cache_path=wecom.get("token_cache"),
+    )
+    bucket = get_bucket("app:%s:%s" % (ch["corpid"], ch["agentid"]), sender_cfg.get("app_per_minute", 20))
+    return send_fn, bucket
+
+
+def _send_logged(channel, chunks, send_fn, bucket, retry):
+    """
+    在 channel 上发送 chunks（同 send_chunks），并在事件日志中记一行 send 事件。
+    """
+    start = time.time()
+    error = None
+    sent = 0
+    try:
+        with labels(channel=channel):
+            sent = send_chunks(chunks, send_fn, bucket, retry)
+        return sent
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        fields = error_fields(error)
+        log_event(
+            "send",
+            channel=channel,
+            chunks=len(chunks),
+            chunks_sent=sent,
+            bytes=sum(len(c.encode("utf-8")) for c in chunks),
+            duration_seconds=round(time.time() - start, 6),
+            ok=error is None,
+            error_kind=classify_error(error) if error is not None else None,
+            **fields
+        )
+
+
+def _log_query(src, res):
+    """
+    在事件日志中记一行 query 事件；耗时超过慢查询阈值时再在慢查询日志中记下 SQL、参数和耗时分解。
+    """
+    if src.get("check"):
+        match = {"check": src["check"]["name"]}
     else:
+        match = {"source": src["name"]}
+    breakdown = METRICS.breakdown(**match)
+    summary = res.value if res.ok else None
+    fields = error_fields(None if res.ok else res.error)
+    log_event(
+        "query",
+        source=src["name"],
+        ok=res.ok,
+        timed_out=res.timed_out,
+        duration_seconds=round(res.elapsed or 0.0, 6),
+        rows=summary["count"] if summary else None,
+        cached_age_seconds=round(res.cached_age, 3) if hasattr(res, "cached_age") else None,
+        stages=breakdown,
+        **fields
+    )
+    if not is_slow(res.elapsed or 0.0):
+        return
+    statements = METRICS.statements(**match)
+    if not statements and src.get("check"):
+        # 合并成一批执行的检查：SQL 记在这一组的数据库名下
+        statements = METRICS.statements(source=src["check"]["source"], check=None)
+    log_slow_query(
+        source=src["name"],
+        ok=res.ok,
+        duration_seconds=round(res.elapsed or 0.0, 6),
+        rows=summary["count"] if summary else None,
+        stages=breakdown,
+        statements=statements,
+        declared_sql=src["check"]["sql"] if src.get("check") else None,
+        declared_params=src["check"]["params"] if src.get("check") else None,
+        **fields
+    )
+
+
+def _outbox_run_key(new_marks, new_sets):
+    """
+    本轮消息的批次标识。
+
+    增量/差异模式下由本轮推进后的状态决定：进程在入队之后、保存高水位之前崩溃时，
+    下一轮会查到同样的数据、得到同样的幂等键，不会重复入队。
+    其他模式每轮都是一次新的汇报，用当前时间区分。
+    """
+    if new_marks or new_sets:
+        state = json.dumps({"marks": new_marks, "sets": new_sets}, sort_keys=True)
+        return hashlib.sha1(state.encode("utf-8")).hexdigest()
+    return "%.6f" % time.time()
+
+
+def _outbox_key(channel, run_key, index, total, content):
+    raw = u"%s\n%s\n%d/%d\n%s" % (channel, run_key, index + 1, total, content)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def drain_outbox(cfg, deadline=None):
+    """
+    把发件箱中到期的消息分批发送出去。失败的消息留在发件箱里稍后重试，
+    累计失败 max_attempts 次（或遇到 key 错误等永久错误）转入死信。
+    deadline 为整轮运行的截止时刻：过了它不再发送，等待重试或限速会超过它时本次也不再等，留给下一次发送。
+
+    返回：drain 的统计字典 {"sent", "failed", "dead"}
+    """
+    outbox_cfg = cfg["outbox"]
+    outbox = Outbox(outbox_cfg["path"])
+    retry = _retry_policy(cfg, deadline)
+    senders = {}
+
+    def send_entry(entry):
+        if entry.channel not in senders:
+            senders[entry.channel] = _channel_sender(cfg, entry.channel)
+        send_fn, bucket = senders[entry.channel]
+        _send_logged(entry.channel, [entry.content], send_fn, bucket, retry)
+
+    result = outbox.drain(
+        send_entry,
+        batch_size=outbox_cfg.get("batch_size", 20),
+        max_attempts=outbox_cfg.get("max_attempts", 5),
+        retry_delay=outbox_cfg.get("retry_delay", 60),
+        is_permanent=lambda e: classify_error(e) == "permanent",
+        is_deferred=lambda e: classify_error(e) == "deadline",
+        deadline=deadline,
+    )
+    outbox.purge(outbox_cfg.get("keep_days", 7) * 86400)
+    if result["sent"] or result["failed"] or result["dead"]:
+        print("发件箱：发送成功 %d 段，待重试 %d 段，转入死信 %d 段。" % (result["sent"], result["failed"], result["dead"]))
+    stats = outbox.stats()
+    if stats["dead"]:
+        print("注意：发件箱中有 %d 条死信消息，请检查 %s" % (stats["dead"], outbox_cfg["path"]))
+    return result
+
+
+def _delivery(cfg, channel, chunks, retry):
+    """
+    生成在 channel 上发送 chunks 的无参函数（供 deliver_all 在各自的线程中调用），返回发送成功的段数。
+    """
+    send_fn, bucket = _channel_sender(cfg, channel)
+    return lambda: _send_logged(channel, chunks, send_fn, bucket, retry)
+
+
+def _effective_limit(cfg, limit):
+    """
+    --limit 只对增量查询生效（全量查询和摘要查询要统计准确总数，不能截断）：
+    未开启增量模式（或开启了差异推送，增量模式被关闭）却指定了 --limit 时报错，
+    增量模式下未指定时使用 DEFAULT_LIMIT。
+    """
+    inc = cfg.get("incremental", {})
+    active = inc.get("enabled") and inc.get("columns") and not cfg.get("diff", {}).get("enabled")
+    if limit is None:
+        return DEFAULT_LIMIT if active else None
+    if not active:
+        raise Exception("--limit 只在增量模式下生效（[incremental] enabled=true 且配置了高水位字段、未开启 [diff]），"
+                        "全量查询和摘要查询不会截断结果")
+    return limit
+
+
+def run_once(cfg, args):
+    """
+    执行一次完整检查：查询→组装消息→（干跑或真实）发送。
+    支持同时查询多个数据库（db 和 db_mysql）。
+
+    cron 模式下每个进程只调用一次；常驻模式（--daemon）下由调度器反复调用。
+    返回：进程退出码（0 表示正常）
+    """
+    # 整轮运行的截止时刻：cron 每分钟启动一次时，避免一轮拖进下一分钟
+    run_deadline = cfg.get("query", {}).get("run_deadline")
+    deadline = time.time() + run_deadline if run_deadline else None
+    pool_cfg = cfg.get("db_pool", {})
+    configure_pool(
+        max_idle_age=pool_cfg.get("max_idle_age"),
+        ping_interval=pool_cfg.get("ping_interval"),
+        enabled=pool_cfg.get("enabled"),
+    )
+    configure_breaker(**cfg.get("breaker", {}))
+    # 各数据源的驱动优先顺序（驱动在第一次连接时才导入）
+    for name in ["db", "db_mysql"]:
+        if name in cfg:
+            configure_drivers(cfg[name])
+
+    # 增量模式：读取各数据源的高水位，只查询新增的行
+    incremental = cfg.get("incremental", {}).get("enabled", False)
+    marks = load_marks(args.state) if incremental else {}
+    sources = build_sources(cfg, marks, _effective_limit(cfg, args.limit))
+    # 差异模式：读取上次发送时各数据源的条目集合
+    diff_cfg = cfg.get("diff", {})
+    previous_sets = load_item_sets(diff_cfg["path"]) if diff_cfg.get("enabled") else {}
+    for src in sources:
+        print("正在查询 %s ..." % src["label"])
+    if not ("db_mysql" in cfg and cfg["db_mysql"].get("enabled", True)):
         print("MySQL 数据库 [db_mysql] 未启用或未配置")
-    
+
+    # 所有数据源并发查询，结果按固定顺序合并
+    query_cfg = cfg.get("query", {})
+    _CHECKS.configure(batch=query_cfg.get("batch", True), sqlserver_snapshot=query_cfg.get("sqlserver_snapshot", False))
+    # 结果缓存：没到 interval 的数据源使用上次的结果，其余的真正查询
+    cache_cfg = cfg.get("result_cache", {})
+    cache = ResultCache(cache_cfg["path"]) if cache_cfg.get("enabled") else None
+    cached = _cached_results(cfg, cache, sources, args.preview, previous_sets)
+    queried = [src for src in sources if src["name"] not in cached]
+    by_name = dict((src["name"], res) for src, res in zip(queried, _run_sources(cfg, queried, args.preview, previous_sets, deadline)))
+    _store_results(cfg, cache, queried, [by_name[src["name"]] for src in queried], args.preview)
+    if cache is not None:
+        cache.purge(cache_cfg.get("keep_days", 7) * 86400)
+    results = []
+    for src in sources:
+        if src["name"] in by_name:
+            results.append(by_name[src["name"]])
+            continue
+        res = TaskResult(src["name"])
+        res.ok = True
+        res.value, res.cached_age = cached[src["name"]]
+        results.append(res)
+
+    # 收集所有查询结果和消息；new_marks 记录本次读到的最大高水位，发送成功后才保存
+    # 每个数据源按路由发往一个或多个通道：by_channel 为各通道的消息列表（按数据源顺序），
+    # source_channels 记录每个数据源发往哪些通道（这些通道都发送成功后才推进它的高水位）
+    channels = []
+    by_channel = {}
+    source_channels = {}
+    new_marks = {}
+    new_sets = {}
+    for src, res in zip(sources, results):
+        _log_query(src, res)
+        if not res.ok:
+            if src["required"]:
+                # 主数据库失败仍按原逻辑让本次运行报错退出
+                raise res.error
+            print("%s 查询失败：%s" % (src["label"], str(res.error)))
+            add("query_errors", source=src["name"])
+            continue
+        summary = res.value
+        add("rows", summary["count"], source=src["name"])
+        if src["name"] in cached:
+            add("cache_hits", source=src["name"])
+            print("%s 查询结果：%d 条记录（使用 %.0f 秒前的缓存结果）" % (src["label"], summary["count"], res.cached_age))
+        else:
+            print("%s 查询结果：%d 条记录（耗时 %.2f 秒）" % (src["label"], summary["count"], res.elapsed))
+        if src.get("diff_key"):
+            # 差异模式：只推送新增（或内容变化）与已恢复的条目，没有变化就不推送
+            previous = previous_sets.get(src["name"]) or {}
+            recovered = sorted(k for k in previous if k not in summary["items"])
+            print("%s 差异：新增 %d 条，恢复 %d 条" % (src["label"], summary["added"], len(recovered)))
+            new_sets[src["name"]] = summary["items"]
+            render = lambda markdown: (compose_diff_markdown if markdown else compose_diff_text)(
+                src["diff_title"], summary["added_preview"], summary["added"], recovered, args.preview, src["diff_key"]
+            )
+        else:
+            if not summary["count"]:
+                continue
+            if summary["max_mark"] is not None:
+                new_marks[src["name"]] = mark_value(summary["max_mark"])
+            render = lambda markdown: (src["compose_markdown"] if markdown else src["compose_text"])(
+                summary["preview"], args.preview, total=summary["count"], max_bytes=cfg["message"].get("max_bytes")
+            )
+        # 同一种格式（Markdown / 文本）只组装一次，发往多个通道时共用
+        rendered = {}
+        for channel in _routes_for(cfg, src):
+            markdown = _channel_markdown(cfg, channel)
+            if markdown not in rendered:
+                with stage("compose", source=src["name"]):
+                    rendered[markdown] = render(markdown)
+            if not rendered[markdown]:
+                continue
+            if channel not in by_channel:
+                channels.append(channel)
+                by_channel[channel] = []
+            by_channel[channel].append(rendered[markdown])
+            source_channels.setdefault(src["name"], []).append(channel)
+
     # 如果没有任何消息，结束
-    if not all_messages:
+    if not channels:
         print("所有数据库查询均无新数据，结束。")
         return 0
-    
-    print("共生成 %d 条消息，准备发送..." % len(all_messages))
-    
-    # 合并所有消息
-    final_msg = u"\n\n".join(all_messages)
 
-    if args.dry_run:
-        # Python 2 下 msg 是 unicode，这里编码为 UTF-8 便于终端显示；Python 3 直接使用 str
-        if sys.version_info[0] == 2:
-            try:
-                preview_text = final_msg.encode("utf-8")
-            except Exception:
-                preview_text = final_msg
+    total = sum(len(by_channel[channel]) for channel in channels)
+    if len(channels) > 1:
+        print("共生成 %d 条消息（%d 个通道），准备发送..." % (total, len(channels)))
+    else:
+        print("共生成 %d 条消息，准备发送..." % total)
+
+    # 按企业微信的字节上限，在条目边界把每个通道的消息切成若干段（只有一段时与直接合并完全一致）
+    sender_cfg = cfg.get("sender", {})
+    chunks_by = {}
+    limits = {}
+    for channel in channels:
+        if _channel_markdown(cfg, channel):
+            limits[channel] = sender_cfg.get("markdown_bytes", MARKDOWN_MAX_BYTES)
         else:
-            preview_text = final_msg
-        print("干跑模式：将要发送的消息如下\n" + preview_text)
+            limits[channel] = sender_cfg.get("text_bytes", TEXT_MAX_BYTES)
+        with stage("compose", channel=channel):
+            chunks_by[channel] = split_chunks(by_channel[channel], limits[channel])
+
+    if args.dry_run:
+        for channel in channels:
+            chunks = chunks_by[channel]
+            # 只有一个通道时输出与以前完全一致；多个通道时标出通道名
+            prefix = "通道 %s " % channel if len(channels) > 1 else ""
+            preview_text = _console_text(u"\n\n--------\n\n".join(chunks))
+            if len(chunks) > 1:
+                print("干跑模式：%s消息超过 %d 字节，将分 %d 段发送" % (prefix, limits[channel], len(chunks)))
+            print("干跑模式：%s将要发送的消息如下\n" % prefix + preview_text)
+        if new_marks:
+            print("干跑模式不更新增量高水位：%s" % json.dumps(new_marks, sort_keys=True))
+        if new_sets:
+            print("干跑模式不更新差异推送的条目集合。")
+    elif cfg.get("outbox", {}).get("enabled"):
+        # 发件箱模式：消息落盘后即视为已交付，先推进高水位，再由发送方（本进程或常驻进程的发送线程）投递
+        outbox = Outbox(cfg["outbox"]["path"])
+        run_key = _outbox_run_key(new_marks, new_sets)
+        items = []
+        for channel in channels:
+            chunks = chunks_by[channel]
+            items.extend(
+                (_outbox_key(channel, run_key, i, len(chunks), c), channel, c)
+                for i, c in enumerate(chunks)
+            )
+        added = outbox.enqueue(items)
+        print("已写入发件箱 %d 段（%d 段已在发件箱中，忽略）。" % (added, len(items) - added))
+        if new_marks:
+            save_marks(args.state, new_marks)
+            print("已更新增量高水位：%s" % json.dumps(new_marks, sort_keys=True))
+        if new_sets:
+            save_item_sets(diff_cfg["path"], new_sets)
+        if not getattr(args, "daemon", False):
+            drain_outbox(cfg, deadline)
     else:
-        # 优先使用群机器人（如果配置了 webhook），否则使用应用接口
-        if use_robot:
-            if use_markdown:
-                from wecom_robot_py2 import send_markdown as robot_send_md
-                ok = robot_send_md(cfg["robot"]["webhook"], final_msg)
+        # 各通道同时发送（每个通道一个线程、各自的令牌桶限速），一个通道慢或失败不影响其他通道
+        retry = _retry_policy(cfg, deadline)
+        outcomes = deliver_all([
+            (channel, _delivery(cfg, channel, chunks_by[channel], retry)) for channel in channels
+        ])
+        failed = [channel for channel in channels if outcomes[channel][1] is not None]
+        for channel in channels:
+            sent, error = outcomes[channel]
+            prefix = "通道 %s：" % channel if len(channels) > 1 else ""
+            if error is not None:
+                print("%s发送失败：%s" % (prefix, error))
+            elif channel.startswith("robot:"):
+                print("%s企业微信群机器人消息已发送成功（%d 段）。" % (prefix, sent))
             else:
-                from wecom_robot_py2 import send_text as robot_send_text
-                ok = robot_send_text(cfg["robot"]["webhook"], final_msg, cfg["robot"].get("mentioned_list"))
-            if ok:
-                print("企业微信群机器人消息已发送成功。")
-        else:
-            from wecom_client_py2 import get_access_token, send_text
-            token = get_access_token(cfg["wecom"]["corpid"], cfg["wecom"]["corpsecret"])
-            ok = send_text(token, cfg["wecom"]["agentid"], cfg["wecom"]["touser"], final_msg)
-            if ok:
-                print("企业微信应用消息已发送成功。")
+                print("%s企业微信应用消息已发送成功（%d 段）。" % (prefix, sent))
+        # 发送成功后才推进高水位：某个通道失败时，发往它的数据源下次运行重新处理，其他数据源照常推进
+        done = [name for name in set(new_marks) | set(new_sets)
+                if not [c for c in source_channels.get(name, []) if c in failed]]
+        marks_done = dict((k, v) for k, v in new_marks.items() if k in done)
+        if marks_done:
+            save_marks(args.state, marks_done)
+            print("已更新增量高水位：%s" % json.dumps(marks_done, sort_keys=True))
+        save_item_sets(diff_cfg.get("path"), dict((k, v) for k, v in new_sets.items() if k in done))
+        if failed:
+            raise outcomes[failed[0]][1]
 
     return 0
 
 
+def _read_config_timed(path):
+    """
+    读取配置并把耗时计入 config_load 阶段。
+    """
+    with stage("config_load"):
+        return read_config(path)
+
+
+def _export_metrics(cfg, success):
+    """
+    按 [metrics] 配置导出本轮统计；导出失败只打印提示，不影响检查本身。
+    """
+    try:
+        export_metrics(cfg.get("metrics"), success)
+    except Exception as e:
+        print("导出运行统计失败：%s" % str(e))
+
+
+def _run_instrumented(cfg, fn, mode):
+    """
+    执行一轮 fn()（检查或只发送发件箱），结束后（无论成功与否）导出本轮统计，并在事件日志中记一行 run 事件。
+
+    - mode：运行方式（"cron"、"daemon" 或 "drain"），写入 run 事件
+    """
+    runlog = cfg.get("runlog", {})
+    configure_runlog(
+        runlog.get("path", ""), runlog.get("slow_query_path", ""), runlog.get("slow_query_seconds", 5.0),
+        runlog.get("max_bytes", 10 * 1024 * 1024), runlog.get("backup_count", 5),
+    )
+    begin_run()
+    start = time.time()
+    success = False
+    error = None
+    try:
+        result = fn()
+        success = not result
+        return result
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _export_metrics(cfg, success)
+        try:
+            log_event(
+                "run",
+                mode=mode,
+                success=success,
+                duration_seconds=round(time.time() - start, 6),
+                rows=METRICS.total("rows"),
+                query_errors=METRICS.total("query_errors"),
+                chunks_sent=METRICS.total("chunks_sent"),
+                bytes_sent=METRICS.total("bytes_sent"),
+                retries=METRICS.total("retries"),
+                stages=METRICS.breakdown(),
+                **error_fields(error)
+            )
+        except Exception as e:
+            print("写运行日志失败：%s" % str(e))
+
+
+def _config_mtime(path):
+    """
+    返回配置文件（含同目录 secrets.ini）的最新修改时间，用于常驻模式下判断是否需要重新读取。
+    """
+    mtimes = []
+    for p in [path, os.path.join(os.path.dirname(path), "secrets.ini")]:
+        try:
+            mtimes.append(os.stat(p).st_mtime)
+        except OSError:
+            pass
+    return max(mtimes) if mtimes else 0
+
+
+def run_daemon(args, cfg):
+    """
+    常驻进程模式：只启动一次，按间隔 + 抖动反复执行 run_once。
+
+    - 驱动只在进程启动时导入一次
+    - 配置只在文件变化时重新读取（修改 config.ini 后无需重启）
+    - 收到 SIGTERM/SIGINT 时等当前一轮结束后退出
+    """
+    daemon_cfg = cfg.get("daemon", {})
+    interval = args.interval if args.interval is not None else daemon_cfg.get("interval", 60)
+    jitter = args.jitter if args.jitter is not None else daemon_cfg.get("jitter", 0)
+    holder = {"cfg": cfg, "mtime": _config_mtime(args.config), "drainer": None, "drain_thread": None}
+
+    def drain_tick():
+        # 重新加载配置后关闭了发件箱：不再投递（已入队的消息留在发件箱里，重新启用后继续发送）
+        if not holder["cfg"].get("outbox", {}).get("enabled"):
+            return
+        try:
+            drain_outbox(holder["cfg"])
+        except Exception as e:
+            print("发件箱发送出错：%s" % str(e))
+
+    def ensure_drainer():
+        # 发件箱模式下由单独的发送线程投递消息：webhook 慢或故障时不会拖住下一轮查询。
+        # 启动时没有启用发件箱、之后重新加载配置才启用时，在那时再启动发送线程（run_once 在常驻模式下不会自己投递）
+        if holder["drainer"] is not None or not holder["cfg"].get("outbox", {}).get("enabled"):
+            return
+        drainer = Scheduler()
+        drainer.add_job("drain_outbox", drain_tick, holder["cfg"]["outbox"].get("drain_interval", 10))
+        drain_thread = threading.Thread(target=drainer.run_forever)
+        drain_thread.daemon = True
+        drain_thread.start()
+        holder["drainer"] = drainer
+        holder["drain_thread"] = drain_thread
+
+    def tick():
+        # 每轮单独统计：导出的文件只反映最近一轮
+        METRICS.reset()
+        mtime = _config_mtime(args.config)
+        if mtime != holder["mtime"]:
+            try:
+                holder["cfg"] = _read_config_timed(args.config)
+                holder["mtime"] = mtime
+                print("检测到配置文件变化，已重新加载：%s" % args.config)
+            except Exception as e:
+                # 配置写了一半或格式错误时继续使用旧配置
+                print("重新加载配置失败，继续使用旧配置：%s" % str(e))
+            ensure_drainer()
+        print("[%s] 开始检查" % time.strftime("%Y-%m-%d %H:%M:%S"))
+        _run_instrumented(holder["cfg"], lambda: run_once(holder["cfg"], args), "daemon")
+
+    scheduler = Scheduler()
+    scheduler.add_job("run_once", tick, interval, jitter)
+    ensure_drainer()
+
+    def handle_signal(signum, frame):
+        print("收到信号 %d，本轮结束后退出..." % signum)
+        scheduler.stop()
+        if holder["drainer"] is not None:
+            holder["drainer"].stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    print("常驻模式启动：间隔 %s 秒，抖动 0~%s 秒" % (interval, jitter))
+    scheduler.run_forever()
+    if holder["drain_thread"] is not None:
+        holder["drain_thread"].join(30)
+    print("常驻模式已退出。")
+    return 0
+
+
+def main():
+    """
+    主流程：读配置→（可选）初始化示例库→执行一次检查，或进入常驻模式循环检查。
+    """
+    parser = argparse.ArgumentParser(description="Query DB and notify WeCom (Python 2.7)")
+    parser.add_argument("--config", default="config/config.ini", help="配置文件路径")
+    parser.add_argument("--state", default="state/last_seen.json", help="去重状态文件路径")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="增量模式下每个数据源单次最多读取的记录数（默认 %d；只能在增量模式下使用）" % DEFAULT_LIMIT)
+    parser.add_argument("--preview", type=int, default=5, help="消息中展示的预览条数")
+    parser.add_argument("--dry-run", action="store_true", help="干跑模式：不真正发企业微信，只打印")
+    parser.add_argument("--init-demo", action="store_true", help="初始化示例 SQLite 表并插入一条数据")
+    parser.add_argument("--daemon", action="store_true", help="常驻进程模式：不退出，按间隔循环检查（替代 crontab 每分钟启动）")
+    parser.add_argument("--interval", type=float, default=None, help="常驻模式检查间隔（秒），默认取 [daemon] interval 或 60")
+    parser.add_argument("--jitter", type=float, default=None, help="常驻模式每次间隔叠加的最大随机抖动（秒），默认取 [daemon] jitter 或 0")
+    parser.add_argument("--drain", action="store_true", help="只发送发件箱（[outbox]）中积压的消息，不执行查询")
+    args = parser.parse_args()
+
+    cfg = _read_config_timed(args.config)
+
+    if args.drain:
+        if not cfg["outbox"]["enabled"]:
+            print("未启用发件箱（[outbox] enabled=true），无需 --drain。")
+            return 0
+        def drain():
+            drain_outbox(cfg)
+            return 0
+
+        return _run_instrumented(cfg, drain, "drain")
+
+    if args.init_demo and cfg["db"]["driver"] == "sqlite":
+        init_demo_if_needed(cfg["db"]["sqlite_path"])
+        init_demo_jobcodes(cfg["db"]["sqlite_path"])
+
+    try:
+        _effective_limit(cfg, args.limit)
+    except Exception as e:
+        parser.error(str(e))
+
+    if args.daemon:
+        return run_daemon(args, cfg)
+    return _run_instrumented(cfg, lambda: run_once(cfg, args), "cron")
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+运行耗时与计数统计（Python 2.7 兼容）
+
+用小白能懂的话：
+- 以前只能从 print 的“查询结果：N 条记录”里看个大概，不知道一分钟花在了哪里。
+- 现在每一轮运行都按阶段计时：读配置、导入驱动、连接、执行 SQL、取数据、过滤汇总、组装消息、发送；
+  每个阶段再按数据源（source）或发送通道（channel）分开记录。
+- 同时记录计数：查询行数、发送字节数、重试次数、错误次数等。
+- 一轮结束后可以导出两种文件（见 [metrics] 配置节）：
+  - Prometheus textfile 格式（给 node_exporter 的 textfile collector 采集，可以设置告警）；
+  - JSON 摘要（方便人看或被其他脚本读取）。
+
+用法：
+    with stage("execute"):            # 计时一个阶段，标签自动带上当前线程的 source/channel
+        cur.execute(sql)
+    with labels(source="db"):          # 在当前线程内为之后记录的数据设置默认标签
+        ...
+    add("rows", 10)                    # 计数
+"""
+
+import json
+import os
+import threading
+import time
+
+_local = threading.local()
+# 每组标签最多保留多少条执行过的 SQL（供慢查询日志使用）
+MAX_STATEMENTS = 20
+
+
+def _current_labels():
+    return getattr(_local, "labels", None) or {}
+
+
+class labels(object):
+    """
+    在当前线程内设置默认标签（可以嵌套，内层覆盖外层同名标签）。
+    """
+
+    def __init__(self, **values):
+        self.values = values
+        self._saved = None
+
+    def __enter__(self):
+        self._saved = _current_labels()
+        merged = dict(self._saved)
+        merged.update(self.values)
+        _local.labels = merged
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.labels = self._saved
+        return False
+
+
+def thread_seconds():
+    """
+    当前线程到目前为止记录过的阶段耗时总和（秒）。
+    用于从一段总耗时中扣掉其中已单独计时的部分，例如“过滤汇总”扣掉其中的“取数据”。
+    """
+    return getattr(_local, "seconds", 0.0)
+
+
+class _Stage(object):
+    def __init__(self, registry, name, values):
+        self.registry = registry
+        self.name = name
+        self.values = values
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.time() - self.start, **self.values)
+        return False
+
+
+class Metrics(object):
+    """
+    一轮运行的阶段耗时与计数（线程安全）。
+
+    - 阶段：每个 (阶段名, 标签) 记录次数、总秒数、单次最长秒数
+    - 计数：每个 (计数名, 标签) 记录累计值
+    - SQL：按标签记录执行过的语句、参数和耗时（慢查询日志用）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """开始新的一轮：清空所有数据。"""
+        with self._lock:
+            self.started = time.time()
+            self._stages = {}
+            self._counters = {}
+            self._statements = {}
+
+    @staticmethod
+    def _key(name, values):
+        merged = dict(_current_labels())
+        merged.update(values)
+        return name, tuple(sorted((k, "%s" % v) for k, v in merged.items() if v is not None))
+
+    def stage(self, name, **values):
+        """返回一个计时上下文：with metrics.stage("execute"): ..."""
+        return _Stage(self, name, values)
+
+    def observe(self, name, seconds, **values):
+        """记录一次阶段耗时（秒）。"""
+        key = self._key(name, values)
+        _local.seconds = thread_seconds() + seconds
+        with self._lock:
+            entry = self._stages.get(key)
+            if entry is None:
+                self._stages[key] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def add(self, name, value=1, **values):
+        """累加一个计数。"""
+        key = self._key(name, values)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def record_statement(self, sql, params, seconds):
+        """记录一条执行过的 SQL（按当前线程的标签归类）。"""
+        key = tuple(sorted((k, "%s" % v) for k, v in _current_labels().items() if v is not None))
+        with self._lock:
+            items = self._statements.setdefault(key, [])
+            if len(items) < MAX_STATEMENTS:
+                items.append({"sql": sql, "params": params, "seconds": round(seconds, 6)})
+
+    def statements(self, **match):
+        """返回标签包含 match 的所有已记录 SQL。"""
+        with self._lock:
+            return [s for key, items in sorted(self._statements.items()) if _matches(key, match) for s in items]
+
+    def breakdown(self, **match):
+        """
+        返回标签包含 match 的阶段耗时合计 {阶段名: 秒}，例如 breakdown(source="db")。
+        """
+        result = {}
+        with self._lock:
+            for (name, key), v in self._stages.items():
+                if _matches(key, match):
+                    result[name] = round(result.get(name, 0.0) + v[1], 6)
+        return result
+
+    def total(self, name, **match):
+        """返回标签包含 match 的计数 name 的合计。"""
+        with self._lock:
+            return sum(v for (n, key), v in self._counters.items() if n == name and _matches(key, match))
+
+    def snapshot(self, success=None):
+        """
+        返回本轮数据的字典（即 JSON 摘要的内容）。
+
+        - success：本轮是否成功（None 表示未知）
+        """
+        now = time.time()
+        with self._lock:
+            stages = [
+                {"stage": name, "labels": dict(key), "count": v[0], "seconds": round(v[1], 6), "max_seconds": round(v[2], 6)}
+                for (name, key), v in sorted(self._stages.items())
+            ]
+            counters = [
+                {"name": name, "labels": dict(key), "value": v}
+                for (name, key), v in sorted(self._counters.items())
+            ]
+            started = self.started
+        return {
+            "started": started,
+            "duration_seconds": round(now - started, 6),
+            "success": success,
+            "stages": stages,
+            "counters": counters,
+        }
+
+
+def _matches(key, match):
+    # match 中值为 None 的标签表示“不带这个标签”
+    values = dict(key)
+    return all(values.get(k) is None if v is None else values.get(k) == "%s" % v for k, v in match.items())
+
+
+def _escape(value):
+    return ("%s" % value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels_text(values):
+    if not values:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, _escape(v)) for k, v in sorted(values.items()))
+
+
+def prometheus_text(snapshot, prefix="weixin_alert"):
+    """
+    把 snapshot() 的结果转换为 Prometheus textfile collector 格式。
+
+    每轮运行覆盖写一次文件，所以全部用 gauge 表示“最近一轮”的值。
+    """
+    lines = []
+
+    def metric(name, help_text, samples):
+        if not samples:
+            return
+        lines.append("# HELP %s_%s %s" % (prefix, name, help_text))
+        lines.append("# TYPE %s_%s gauge" % (prefix, name))
+        for values, value in samples:
+            lines.append("%s_%s%s %s" % (prefix, name, _labels_text(values), repr(float(value))))
+
+    stage_samples = [(dict(s["labels"], stage=s["stage"]), s) for s in snapshot["stages"]]
+    metric("stage_seconds", "Total seconds spent in each stage during the last run.",
+           [(v, s["seconds"]) for v, s in stage_samples])
+    metric("stage_calls", "Number of times each stage ran during the last run.",
+           [(v, s["count"]) for v, s in stage_samples])
+    metric("stage_max_seconds", "Longest single call of each stage during the last run.",
+           [(v, s["max_seconds"]) for v, s in stage_samples])
+    names = []
+    for c in snapshot["counters"]:
+        if c["name"] not in names:
+            names.append(c["name"])
+    for name in names:
+        metric(name, "Counter %s for the last run." % name,
+               [(c["labels"], c["value"]) for c in snapshot["counters"] if c["name"] == name])
+    metric("run_duration_seconds", "Wall-clock duration of the last run.", [({}, snapshot["duration_seconds"])])
+    metric("last_run_timestamp_seconds", "Unix time the last run started.", [({}, snapshot["started"])])
+    if snapshot.get("success") is not None:
+        metric("run_success", "1 if the last run finished without error.", [({}, 1 if snapshot["success"] else 0)])
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path, text):
+    # 先写临时文件再改名：采集器不会读到写了一半的文件
+    dir_path = os.path.dirname(path) or "."
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.rename(tmp_path, path)
+
+
+def export(metrics_cfg, success=None, registry=None):
+    """
+    按 [metrics] 配置把本轮数据写到 Prometheus textfile 和/或 JSON 文件。
+
+    参数：
+    - metrics_cfg：{"prometheus_file": 路径或空, "json_file": 路径或空, "prefix": 指标名前缀}
+    - success：本轮是否成功
+
+    返回：
+    - snapshot() 的结果
+    """
+    registry = registry or METRICS
+    snap = registry.snapshot(success)
+    metrics_cfg = metrics_cfg or {}
+    if metrics_cfg.get("prometheus_file"):
+        _write_atomic(metrics_cfg["prometheus_file"], prometheus_text(snap, metrics_cfg.get("prefix") or "weixin_alert"))
+    if metrics_cfg.get("json_file"):
+        _write_atomic(metrics_cfg["json_file"], json.dumps(snap, indent=2, sort_keys=True, separators=(",", ": ")) + "\n")
+    return snap
+
+
+# 进程内共享的统计：cron 模式一次运行一份；常驻模式每轮开始时 reset()
+METRICS = Metrics()
+
+
+def stage(name, **values):
+    """在全局统计中计时一个阶段。"""
+    return METRICS.stage(name, **values)
+
+
+def observe(name, seconds, **values):
+    """在全局统计中记录一次阶段耗时。"""
+    METRICS.observe(name, seconds, **values)
+
+
+def add(name, value=1, **values):
+    """在全局统计中累加一个计数。"""
+    METRICS.add(name, value, **values)
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+本地发件箱（Python 2.7 兼容，存储用自带的 SQLite）
+
+用小白能懂的话：
+- 以前“查数据库”和“发企业微信”在同一次调用里完成：webhook 出故障时这一轮的告警直接丢失，
+  webhook 很慢时下一轮查询也要跟着等。
+- 现在拼好的消息先写进本地 SQLite 发件箱（落盘后进程重启也不会丢），再由发送方分批取出发送：
+  - 每条消息带一个幂等键（idempotency key），同一个键只会入队一次，重复入队直接忽略；
+  - 取出时加一个“租约”，租约期内其他进程不会重复取同一条；发送成功才标记为已发送。
+    一批消息限速发送可能超过租约时间，所以每条发送前先续租；续租时发现租约已被别的进程接手就跳过，不会重复发送。
+    如果发送后、标记前进程崩溃，租约过期后会再发一次（至少一次送达）；
+  - 发送失败的消息过一段时间再试，累计失败 max_attempts 次后转入“死信”状态，不再重试，等人工处理。
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+STATUS_PENDING = "pending"
+STATUS_SENT = "sent"
+STATUS_DEAD = "dead"
+
+
+def ensure_dir(path):
+    """
+    确保目录存在，不存在则创建。
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+
+def _error_text(error):
+    # Python 2 下异常消息可能是 UTF-8 字节串，sqlite3 只接受 unicode 文本
+    text = "%s" % error
+    if not isinstance(text, type(u"")):
+        text = text.decode("utf-8", "replace")
+    return text
+
+
+class OutboxEntry(object):
+    """
+    发件箱中的一条消息。
+
+    - id：自增编号（决定发送顺序）
+    - key：幂等键
+    - channel：发送通道，例如 "robot:markdown"、"app:text"
+    - content：消息内容
+    - attempts：已失败的次数
+    - lease_until：本进程持有的租约到期时间（取出时设置，续租时更新）
+    """
+
+    def __init__(self, id, key, channel, content, attempts, lease_until=None):
+        self.id = id
+        self.key = key
+        self.channel = channel
+        self.content = content
+        self.attempts = attempts
+        self.lease_until = lease_until
+
+
+class Outbox(object):
+    """
+    SQLite 发件箱。
+
+    - path：本地 SQLite 文件路径，例如 "state/outbox.sqlite"
+    - lease：取出后的租约秒数，超过租约仍未确认的消息会被重新取出
+    """
+
+    def __init__(self, path, lease=300):
+        self.path = path
+        self.lease = lease
+        ensure_dir(os.path.dirname(path) or ".")
+        self._init_schema()
+
+    def _connect(self):
+        # 事务由我们自己用 BEGIN IMMEDIATE / COMMIT 控制，避免 cron 进程与常驻进程同时取同一批消息
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.isolation_level = None
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS outbox (\n"
+                "  id INTEGER PRIMARY KEY AUTOINCREMENT,\n"
+                "  key TEXT NOT NULL UNIQUE,\n"
+                "  channel TEXT NOT NULL,\n"
+                "  content TEXT NOT NULL,\n"
+                "  status TEXT NOT NULL,\n"
+                "  attempts INTEGER NOT NULL DEFAULT 0,\n"
+                "  next_attempt REAL NOT NULL,\n"
+                "  lease_until REAL,\n"
+                "  last_error TEXT,\n"
+                "  created REAL NOT NULL,\n"
+                "  sent_at REAL\n"
+                ")"
+            )
+            c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt)")
+        finally:
+            conn.close()
+
+    def _write(self, func):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(c)
+                c.execute("COMMIT")
+            except Exception:
+                try:
+                    c.execute("ROLLBACK")
+                except Exception:
+                    pass
+                raise
+            return result
+        finally:
+            conn.close()
+
+    def enqueue(self, items, now=None):
+        """
+        把消息写入发件箱（同一事务内全部写入或全部不写）。
+
+        参数：
+        - items：列表，每个元素为 (key, channel, content)
+        - now：当前时间戳（测试用）
+
+        返回：
+        - 实际新增的条数（幂等键已存在的消息会被忽略）
+        """
+        now = time.time() if now is None else now
+
+        def do(c):
+            added = 0
+            for key, channel, content in items:
+                c.execute(
+                    "INSERT OR IGNORE INTO outbox(key, channel, content, status, attempts, next_attempt, created) "
+                    "VALUES(?, ?, ?, ?, 0, ?, ?)",
+                    (key, channel, content, STATUS_PENDING, now, now),
+                )
+                added += c.rowcount
+            return added
+
+        return self._write(do)
+
+    def claim(self, limit, exclude_channels=None, now=None):
+        """
+        取出最多 limit 条到期的待发消息，并加上租约。
+
+        参数：
+        - limit：最多取出的条数
+        - exclude_channels：不取这些通道的消息（可选）
+
+        同一通道里只要还有更早的待发消息（还没到重试时间，或正被另一个进程租用），
+        后面的消息就不会被取出，保证跨多次 drain / 多个进程时分段消息也按顺序到达。
+
+        返回：
+        - OutboxEntry 列表，按入队顺序
+        """
+        now = time.time() if now is None else now
+        exclude = sorted(exclude_channels or [])
+
+        def do(c):
+            sql = (
+                "SELECT id, key, channel, content, attempts FROM outbox "
+                "WHERE status=? AND next_attempt<=? AND (lease_until IS NULL OR lease_until<=?) "
+                "AND NOT EXISTS (SELECT 1 FROM outbox o2 WHERE o2.channel=outbox.channel "
+                "AND o2.status=? AND o2.id<outbox.id AND (o2.next_attempt>? OR o2.lease_until>?))"
+            )
+            params = [STATUS_PENDING, now, now, STATUS_PENDING, now, now]
+            if exclude:
+                sql += " AND channel NOT IN (%s)" % ", ".join(["?"] * len(exclude))
+                params.extend(exclude)
+            c.execute(sql + " ORDER BY id LIMIT ?", params + [int(limit)])
+            entries = [OutboxEntry(*r) for r in c.fetchall()]
+            for e in entries:
+                e.lease_until = now + self.lease
+                c.execute("UPDATE outbox SET lease_until=? WHERE id=?", (e.lease_until, e.id))
+            return entries
+
+        return self._write(do)
+
+    def mark_sent(self, entry_id, now=None):
+        """标记为已发送。"""
+        now = time.time() if now is None else now
+        self._write(lambda c: c.execute(
+            "UPDATE outbox SET status=?, sent_at=?, lease_until=NULL, last_error=NULL WHERE id=?",
+            (STATUS_SENT, now, entry_id),
+        ))
+
+    def renew(self, entry, now=None):
+        """
+        发送前续租：只有租约仍是本进程取出时设置的那个（没有过期后被别的进程重新取出）才续租。
+
+        返回：
+        - True 表示续租成功，可以发送；False 表示这条消息已经不归本进程管，不要发送
+        """
+        now = time.time() if now is None else now
+        lease_until = now + self.lease
+
+        def do(c):
+            c.execute(
+                "UPDATE outbox SET lease_until=? WHERE id=? AND status=? AND lease_until=?",
+                (lease_until, entry.id, STATUS_PENDING, entry.lease_until),
+            )
+            return c.rowcount == 1
+
+        if not self._write(do):
+            return False
+        entry.lease_until = lease_until
+        return True
+
+    def release(self, entry):
+        """放弃租约（本次没有尝试发送），下次可以立即重新取出；租约已被别的进程接手时不动。"""
+        self._write(lambda c: c.execute(
+            "UPDATE outbox SET lease_until=NULL WHERE id=? AND lease_until=?", (entry.id, entry.lease_until),
+        ))
+
+    def mark_failed(self, entry_id, error, max_attempts=5, retry_delay=60, now=None):
+        """
+        记录一次发送失败。累计失败达到 max_attempts 次转入死信，否则 retry_delay × 2^(次数-1) 秒后再试。
+
+        返回：
+        - True 表示已转入死信
+        """
+        now = time.time() if now is None else now
+
+        def do(c):
+            c.execute("SELECT attempts FROM outbox WHERE id=?", (entry_id,))
+            row = c.fetchone()
+            attempts = (int(row[0]) if row else 0) + 1
+            dead = attempts >= max_attempts
+            c.execute(
+                "UPDATE outbox SET attempts=?, status=?, next_attempt=?, lease_until=NULL, last_error=? WHERE id=?",
+                (
+                    attempts,
+                    STATUS_DEAD if dead else STATUS_PENDING,
+                    now + retry_delay * (2 ** (attempts - 1)),
+                    _error_text(error)[:500],
+                    entry_id,
+                ),
+            )
+            return dead
+
+        return self._write(do)
+
+    def purge(self, older_than, now=None):
+        """
+        删除 older_than 秒之前已发送的消息（死信保留，等人工处理）。返回删除的条数。
+        """
+        now = time.time() if now is None else now
+
+        def do(c):
+            c.execute("DELETE FROM outbox WHERE status=? AND sent_at<?", (STATUS_SENT, now - older_than))
+            return c.rowcount
+
+        return self._write(do)
+
+    def stats(self):
+        """
+        返回各状态的消息条数，例如 {"pending": 2, "sent": 10, "dead": 0}。
+        """
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+            result = {STATUS_PENDING: 0, STATUS_SENT: 0, STATUS_DEAD: 0}
+            for status, n in c.fetchall():
+                result[status] = int(n)
+            return result
+        finally:
+            conn.close()
+
+    def drain(self, send_entry, batch_size=20, max_attempts=5, retry_delay=60, is_permanent=None,
+              is_deferred=None, deadline=None):
+        """
+        分批取出到期消息并发送，直到没有到期消息为止。
+        某个通道有消息发送失败后，本次不再发送该通道后面的消息，保证分段消息按顺序到达；
+        不同通道的消息同时发送（每个通道一个线程）。
+
+        参数：
+        - send_entry：函数 send_entry(entry)，发送失败时抛异常
+        - batch_size：每批取出的条数
+        - max_attempts / retry_delay：见 mark_failed
+        - is_permanent：函数 is_permanent(exc)，返回 True 表示重试也没用（如 key 错误），直接转入死信
+        - is_deferred：函数 is_deferred(exc)，返回 True 表示这条消息根本没有发出去（如限速等待会超过截止时间），
+          只放弃租约、不计失败次数
+        - deadline：截止时刻（time.time() 时间戳）；过了之后不再取出和发送新的消息，None 表示不限制
+
+        返回：
+        - 字典 {"sent": 成功条数, "failed": 失败待重试条数, "dead": 本次转入死信条数}
+        """
+        result = {"sent": 0, "failed": 0, "dead": 0}
+        blocked = set()
+        lock = threading.Lock()
+        while True:
+            if deadline is not None and time.time() >= deadline:
+                return result
+            entries = self.claim(batch_size, blocked)
+            if not entries:
+                return result
+            # 同一通道的消息按顺序依次发送；不同通道互不影响，各开一个线程同时发送
+            groups = []
+            for entry in entries:
+                group = [g for g in groups if g[0] == entry.channel]
+                if group:
+                    group[0][1].append(entry)
+                else:
+                    groups.append((entry.channel, [entry]))
+            args = (send_entry, blocked, result, lock, max_attempts, retry_delay, is_permanent, is_deferred, deadline)
+            if len(groups) == 1:
+                self._drain_channel(groups[0][1], *args)
+                continue
+            threads = [threading.Thread(target=self._drain_channel, args=(group,) + args) for _, group in groups]
+            for th in threads:
+                th.daemon = True
+                th.start()
+            for th in threads:
+                th.join()
+
+    def _drain_channel(self, entries, send_entry, blocked, result, lock, max_attempts, retry_delay, is_permanent,
+                       is_deferred, deadline):
+        # 依次发送同一通道的消息；失败后该通道后面的消息本次不再发送；过了截止时间的都留到下一次
+        for entry in entries:
+            if entry.channel in blocked or (deadline is not None and time.time() >= deadline):
+                self.release(entry)
+                continue
+            if not self.renew(entry):
+                # 租约已过期并被别的进程重新取出：由它接着按顺序发送，本进程不再发送这个通道后面的消息
+                with lock:
+                    blocked.add(entry.channel)
+                print("发件箱消息 #%d 的租约已被其他进程接手，跳过" % entry.id)
+                continue
+            try:
+                send_entry(entry)
+            except Exception as e:
+                with lock:
+                    blocked.add(entry.channel)
+                if is_deferred and is_deferred(e):
+                    self.release(entry)
+                    print("发件箱消息 #%d 本次未发送，留到下一次：%s" % (entry.id, e))
+                    continue
+                limit = 1 if (is_permanent and is_permanent(e)) else max_attempts
+                if self.mark_failed(entry.id, e, limit, retry_delay):
+                    with lock:
+                        result["dead"] += 1
+                    print("发件箱消息 #%d 已失败 %d 次，转入死信：%s" % (entry.id, entry.attempts + 1, e))
+                else:
+                    with lock:
+                        result["failed"] += 1
+                    print("发件箱消息 #%d 发送失败，稍后重试：%s" % (entry.id, e))
+                continue
+            self.mark_sent(entry.id)
+            with lock:
+                result["sent"] += 1
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+查询结果缓存（Python 2.7 兼容，存储用自带的 SQLite）
+
+用小白能懂的话：
+- 每个数据源 / 检查可以设置自己的 interval（秒）：贵的查询（例如 SQL Server 上的重复 jobcode 全表分组）
+  每 10 分钟查一次就够了，便宜的（MySQL 上按状态过滤）可以每分钟都查。
+- 没到时间的查询不去数据库查，而是直接用上次的结果（只保存总数、预览行和条目指纹，不保存全部行），
+  这样合并发送的消息里仍然包含所有数据源，但 ERP 数据库的压力小很多。
+- 结果存在本地 SQLite 文件里（默认 state/result_cache.sqlite），cron 每次启动都是新进程也能用上；
+  缓存键由数据源名、SQL、参数和预览条数算出，改了检查的 SQL 或参数后自动失效。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+
+def ensure_dir(path):
+    """
+    确保目录存在，不存在则创建。
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+
+def cache_key(parts):
+    """
+    由任意可 JSON 序列化的内容（数据源名、SQL、参数等）算出缓存键。
+    """
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8") if not isinstance(raw, bytes) else raw).hexdigest()
+
+
+class ResultCache(object):
+    """
+    SQLite 结果缓存。
+
+    - path：本地 SQLite 文件路径，例如 "state/result_cache.sqlite"
+    """
+
+    def __init__(self, path):
+        self.path = path
+        ensure_dir(os.path.dirname(path) or ".")
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results (\n"
+                "  key TEXT PRIMARY KEY,\n"
+                "  source TEXT NOT NULL,\n"
+                "  stored_at REAL NOT NULL,\n"
+                "  value TEXT NOT NULL\n"
+                ")"
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key, max_age, now=None):
+        """
+        取出不超过 max_age 秒的缓存结果。
+
+        返回：
+        - (结果, 已缓存的秒数)；没有缓存或已过期时返回 None
+        """
+        now = time.time() if now is None else now
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT stored_at, value FROM results WHERE key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        age = now - row[0]
+        if age < 0 or age >= max_age:
+            return None
+        return json.loads(row[1]), age
+
+    def put(self, key, source, value, now=None):
+        """
+        保存一个结果（value 需可 JSON 序列化；日期、Decimal 等按字符串保存）。
+        """
+        now = time.time() if now is None else now
+        text = json.dumps(value, sort_keys=True, default=str)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO results(key, source, stored_at, value) VALUES(?, ?, ?, ?)",
+                (key, source, now, text),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def purge(self, older_than, now=None):
+        """
+        删除超过 older_than 秒的缓存（检查改了 SQL 或被删除后留下的旧结果）。返回删除的条数。
+        """
+        now = time.time() if now is None else now
+        conn = self._connect()
+        try:
+            cur = conn.execute("DELETE FROM results WHERE stored_at < ?", (now - older_than,))
+            conn.commit()
+            return cur.rowcount
+        finally:
+            conn.close()
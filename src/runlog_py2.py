@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+结构化运行日志（JSON Lines，Python 2.7 兼容）
+
+用小白能懂的话：
+- cron 把 print 的中文输出追加到 logs/run.log，人看很方便，但要统计“最近几周哪个查询越来越慢”就只能写正则去抠。
+- 这里另写一份“一行一个 JSON”的事件日志，每一行都是一个完整的事件，可以直接用 jq、pandas 等工具分析：
+  - run：每轮一行（运行编号、耗时、是否成功、错误类型、总行数、发送字节数、各阶段耗时）
+  - query：每个数据源每轮一行（耗时、行数、是否超时、错误类型、连接/执行/取数据/过滤耗时）
+  - send：每次发送一行（通道、段数、字节数、耗时、错误类型）
+- 慢查询日志：某个数据源（检查）的查询耗时超过 slow_query_seconds 时，另外记下执行的 SQL、参数和耗时分解。
+- 两个日志文件都按大小自动轮转（超过 max_bytes 后改名为 .1、.2 ...，最多保留 backup_count 个）。
+- 同一轮的所有事件带同一个 run_id，方便把一轮的查询、发送和汇总串起来。
+
+配置见 [runlog] 配置节，path 留空表示不写事件日志。
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import logging.handlers
+
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+
+def _get_logger(path, max_bytes, backup_count):
+    """
+    取得写 path 的 logger（同一个文件只创建一个轮转 handler，常驻模式下跨轮次复用）。
+    """
+    path = os.path.abspath(path)
+    with _loggers_lock:
+        logger = _loggers.get(path)
+        if logger is None:
+            dir_path = os.path.dirname(path)
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+            handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("weixin_alert.runlog.%d" % len(_loggers))
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _loggers[path] = logger
+        return logger
+
+
+class EventLog(object):
+    """
+    一个 JSON Lines 日志文件；path 为空时什么都不写。
+
+    - max_bytes：单个文件的字节上限，超过后轮转
+    - backup_count：保留的历史文件个数
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self._logger = _get_logger(path, int(max_bytes), int(backup_count)) if path else None
+
+    @property
+    def enabled(self):
+        return self._logger is not None
+
+    def write(self, event, **fields):
+        """
+        写一行事件：{"ts": 时间戳, "time": 本地时间, "event": 事件名, "run_id": 当前运行编号, ...fields}
+        """
+        if self._logger is None:
+            return
+        now = time.time()
+        record = {
+            "ts": round(now, 3),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)),
+            "event": event,
+            "run_id": _run["id"],
+        }
+        record.update(fields)
+        # ensure_ascii 保持默认：中文写成 \uXXXX，Python 2 下字节串与 unicode 混在一起也不会出错
+        self._logger.info(json.dumps(record, sort_keys=True, default=str))
+
+
+_events = EventLog("")
+_slow = EventLog("")
+_slow_seconds = [5.0]
+_run = {"id": None}
+
+
+def configure_runlog(path="", slow_query_path="", slow_query_seconds=5.0, max_bytes=10 * 1024 * 1024, backup_count=5):
+    """
+    设置事件日志与慢查询日志（通常由 main_py2 按 [runlog] 配置节调用）。
+    """
+    global _events, _slow
+    _events = EventLog(path, max_bytes, backup_count)
+    _slow = EventLog(slow_query_path, max_bytes, backup_count)
+    _slow_seconds[0] = float(slow_query_seconds)
+
+
+def begin_run():
+    """
+    开始新的一轮：生成新的 run_id（之后写的事件都带上它），并返回它。
+    """
+    _run["id"] = uuid.uuid4().hex[:16]
+    return _run["id"]
+
+
+def log_event(event, **fields):
+    """写一行事件日志（未配置 path 时什么都不做）。"""
+    _events.write(event, **fields)
+
+
+def is_slow(seconds):
+    """查询耗时是否达到慢查询阈值（未配置慢查询日志时始终为 False）。"""
+    return _slow.enabled and seconds >= _slow_seconds[0]
+
+
+def log_slow_query(**fields):
+    """写一行慢查询日志。"""
+    _slow.write("slow_query", threshold_seconds=_slow_seconds[0], **fields)
+
+
+def error_fields(exc):
+    """
+    把异常转换为日志字段：{"error_class": 异常类名, "error": 异常信息}。
+    """
+    if exc is None:
+        return {"error_class": None, "error": None}
+    try:
+        message = str(exc)
+    except Exception:
+        message = repr(exc)
+    if not isinstance(message, type(u"")):
+        # Python 2：异常信息是字节串，驱动返回的可能不是 UTF-8
+        message = message.decode("utf-8", "replace")
+    return {"error_class": type(exc).__name__, "error": message}
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+进程内定时调度器（Python 2.7 兼容）
+
+用小白能懂的话：
+- 以前每分钟由 crontab 启动一次新进程，每次都要重新启动解释器、导入驱动、读配置、连数据库。
+- 常驻模式下只启动一个进程，由这里的调度器按“间隔 + 随机抖动”反复执行任务。
+- 抖动（jitter）让多台机器/多个任务不会在同一秒一起打数据库。
+"""
+
+import random
+import sys
+import threading
+import time
+import traceback
+
+
+class Scheduler(object):
+    """
+    简单的固定间隔调度器。
+
+    - add_job 注册任务：name 名称，func 无参函数，interval 间隔秒数，jitter 最大随机抖动秒数
+    - run_forever 循环执行到期任务，直到调用 stop()
+    - 任务抛异常只打印，不会让整个进程退出
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._jobs = []
+        self._stop = threading.Event()
+
+    def add_job(self, name, func, interval, jitter=0, run_now=True):
+        """
+        注册一个定时任务。
+
+        参数：
+        - name：任务名称（用于日志）
+        - func：无参可调用对象
+        - interval：执行间隔（秒，必须大于 0）
+        - jitter：每次在间隔上叠加 0~jitter 秒的随机延迟
+        - run_now：True 表示启动后立即执行第一次
+        """
+        if interval <= 0:
+            raise Exception("任务 %s 的间隔必须大于 0：%s" % (name, interval))
+        now = self._clock()
+        # base 是不带抖动的计划时间，每次固定加 interval；抖动只加在实际执行时间上，不会累积
+        base = now if run_now else now + float(interval)
+        job = {
+            "name": name,
+            "func": func,
+            "interval": float(interval),
+            "jitter": max(0.0, float(jitter or 0)),
+            "base": base,
+            "next_run": base if run_now else base + self._jitter(jitter),
+            "runs": 0,
+        }
+        self._jobs.append(job)
+        return job
+
+    def _jitter(self, jitter):
+        if not jitter:
+            return 0.0
+        return random.uniform(0, float(jitter))
+
+    def stop(self):
+        """请求调度循环在当前任务结束后退出。"""
+        self._stop.set()
+
+    def stopped(self):
+        return self._stop.is_set()
+
+    def run_pending(self):
+        """
+        执行所有已到期的任务，返回距离下一个任务到期的秒数。
+        """
+        for job in self._jobs:
+            if self._stop.is_set():
+                break
+            if self._clock() < job["next_run"]:
+                continue
+            try:
+                job["func"]()
+            except Exception:
+                print("任务 %s 执行失败：" % job["name"])
+                traceback.print_exc()
+            job["runs"] += 1
+            # 按不带抖动的计划时间推进，避免漂移；如果任务本身超时了，就从当前时间重新计时
+            job["base"] += job["interval"]
+            now = self._clock()
+            if job["base"] <= now:
+                job["base"] = now + job["interval"]
+            job["next_run"] = job["base"] + self._jitter(job["jitter"])
+            sys.stdout.flush()
+        if not self._jobs:
+            return 1.0
+        return max(0.0, min(j["next_run"] for j in self._jobs) - self._clock())
+
+    def run_forever(self):
+        """
+        循环执行任务直到 stop()。等待期间可被 stop() 立即唤醒。
+        """
+        while not self._stop.is_set():
+            wait = self.run_pending()
+            if wait > 0:
+                self._stop.wait(wait)
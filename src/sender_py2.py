@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+消息分段与限速发送（Python 2.7 兼容）
+
+用小白能懂的话：
+- 企业微信对单条消息有字节上限：Markdown 4096 字节，文本 2048 字节（按 UTF-8 计算，一个汉字 3 字节）。
+  超过上限的消息会被拒收，所以这里按“条目”（行）把长消息切成多段，每段都不超过上限，并标上 (1/3) 这样的序号。
+- 群机器人每分钟最多接收 20 条消息。这里用“令牌桶”控制发送节奏：
+  桶里最多有 capacity 个令牌，每秒补充 rate 个；每发一段消耗一个令牌，没有令牌就等。
+  通道的桶容量为 1（不允许突发）：每 60/per_minute 秒放行一段，任意 60 秒内都不会超过 per_minute 段。
+- 令牌桶按通道（webhook 地址 / 应用）区分，并且在常驻进程里跨轮次保留。
+- 发送失败时区分“临时错误”和“永久错误”：
+  超时、网络错误、HTTP 5xx、errcode -1（系统繁忙）、45009（频率超限）属于临时错误，等一会儿重试；
+  webhook key 错误、接收人无效等属于永久错误，重试也没用，直接报错。
+- 重试间隔按 1、2、4、8... 秒翻倍（有上限），并加随机抖动，避免多个进程同一时刻一起重试。
+- 收到 45009 说明这个通道已被限流：整个通道暂停一段时间（所有等待发送的段都一起等），而不是不停地重试加重限流。
+- 消息要发往多个通道（多个群机器人 / 应用）时，各通道同时发送，一个通道在限速等待或重试时不会拖住其他通道。
+"""
+
+import random
+import socket
+import threading
+import time
+try:
+    import httplib  # Python 2
+except Exception:
+    import http.client as httplib  # Python 3 调试兼容
+
+from metrics_py2 import add, observe, stage
+
+# 企业微信单条消息内容的字节上限
+MARKDOWN_MAX_BYTES = 4096
+TEXT_MAX_BYTES = 2048
+# 分段序号行预留的字节数，例如 "(12/34)\n"
+_NUMBER_RESERVE = 16
+# 企业微信的临时错误码：-1 系统繁忙，45009 接口调用超过限制
+ERRCODE_BUSY = -1
+ERRCODE_RATE_LIMIT = 45009
+
+
+def _utf8_len(text):
+    return len(text.encode("utf-8"))
+
+
+def _split_long_line(line, budget):
+    """
+    单行就超过上限时，按字符边界硬切成多段（不会把一个汉字切成两半）。
+    """
+    parts = []
+    current = []
+    size = 0
+    for ch in line:
+        n = _utf8_len(ch)
+        if size + n > budget and current:
+            parts.append(u"".join(current))
+            current = []
+            size = 0
+        current.append(ch)
+        size += n
+    if current:
+        parts.append(u"".join(current))
+    return parts
+
+
+def split_chunks(messages, max_bytes, separator=u"\n\n"):
+    """
+    把多条消息按行（条目）切分为若干段，每段 UTF-8 字节数不超过 max_bytes。
+
+    参数：
+    - messages：消息列表（每条是多行文本）
+    - max_bytes：单段字节上限
+    - separator：消息之间的分隔符
+
+    返回：
+    - 分段列表；多于一段时每段第一行加上 "(序号/总数)"，只有一段时内容与直接拼接完全一致
+    """
+    budget = max_bytes - _NUMBER_RESERVE
+    chunks = []
+    current = []
+    size = 0
+    for mi, msg in enumerate(messages):
+        lines = msg.split(u"\n")
+        for li, line in enumerate(lines):
+            # 消息之间用 separator 连接，同一条消息内部用换行连接
+            joiner = separator if (li == 0 and mi > 0) else u"\n"
+            pieces = _split_long_line(line, budget) if _utf8_len(line) > budget else [line]
+            for piece in pieces:
+                n = _utf8_len(piece)
+                extra = (_utf8_len(joiner) if current else 0) + n
+                if current and size + extra > budget:
+                    chunks.append(u"".join(current))
+                    current = []
+                    size = 0
+                    extra = n
+                if current:
+                    current.append(joiner)
+                current.append(piece)
+                size += extra
+    if current:
+        chunks.append(u"".join(current))
+    if len(chunks) > 1:
+        total = len(chunks)
+        chunks = [u"(%d/%d)\n%s" % (i + 1, total, c) for i, c in enumerate(chunks)]
+    return chunks
+
+
+class DeadlineExceeded(Exception):
+    """
+    限速等待会超过整轮运行的截止时刻时抛出：这一段没有发送，留给下一次。
+    """
+
+
+class TokenBucket(object):
+    """
+    令牌桶限速器（线程安全）。
+
+    - rate：每秒补充的令牌数，例如每分钟 20 条 → 20 / 60.0
+    - capacity：桶容量（允许的最大突发条数）
+    """
+
+    def __init__(self, rate, capacity, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = clock()
+        self._paused_until = 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, deadline=None):
+        """
+        取一个令牌；没有令牌或通道被暂停时阻塞等待。返回等待的秒数。
+
+        参数：
+        - deadline：整轮运行的截止时刻（time.time() 时间戳）；需要等到它之后才有令牌时
+          不再等待，直接抛出 DeadlineExceeded（不消耗令牌）。None 表示不限制
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill()
+                    # 允许极小的浮点误差，避免等待时间小到时钟无法前进而空转
+                    if self._tokens >= 1 - 1e-9:
+                        self._tokens = max(0.0, self._tokens - 1)
+                        return waited
+                    wait = (1 - self._tokens) / self.rate
+                if deadline is not None and now + wait > deadline:
+                    raise DeadlineExceeded("限速需要再等待 %.1f 秒，会超过本轮截止时间" % wait)
+            self._sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """
+        暂停整个通道 seconds 秒（收到 45009 频率超限时调用），并清空已积攒的令牌，
+        恢复后按正常速率重新放行，不会一下子把积压的段全部发出去。
+        """
+        with self._lock:
+            now = self._clock()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0.0
+            self._last = self._paused_until
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(channel, per_minute):
+    """
+    取得某个通道的令牌桶（同一进程内按通道共享；常驻模式下跨轮次保留）。
+
+    参数：
+    - channel：通道标识，例如 webhook 地址或 "app:corpid:agentid"
+    - per_minute：每分钟最多发送的条数
+    """
+    rate = per_minute / 60.0
+    with _buckets_lock:
+        bucket = _buckets.get(channel)
+        if bucket is None or bucket.rate != rate:
+            # 容量为 1：桶满时也只能立即发一段。若容量为 per_minute，开头的突发加上一分钟内补充的令牌
+            # 会在第一个 60 秒放行将近 2 × per_minute 段，超过企业微信的限制
+            bucket = TokenBucket(rate, 1)
+            _buckets[channel] = bucket
+        return bucket
+
+
+class RetryPolicy(object):
+    """
+    发送失败时的重试策略。
+
+    - max_attempts：每段最多尝试的次数（含第一次）
+    - base_delay：第一次重试前的等待秒数，之后每次翻倍
+    - max_delay：单次等待的上限（秒）
+    - rate_limit_pause：收到 45009 时整个通道暂停的秒数
+    - deadline：整轮运行的截止时刻（time.time() 时间戳）；等待重试会超过它时不再重试，None 表示不限制
+    """
+
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=30.0, rate_limit_pause=60.0,
+                 sleep=time.sleep, rand=random.random, deadline=None):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.rate_limit_pause = float(rate_limit_pause)
+        self._sleep = sleep
+        self._rand = rand
+        self.deadline = deadline
+
+    def backoff(self, attempt):
+        """
+        第 attempt 次失败后的等待秒数：min(上限, base × 2^(attempt-1))，再在 [一半, 全部] 之间随机抖动。
+        """
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return delay / 2.0 + self._rand() * delay / 2.0
+
+    def past_deadline(self, wait):
+        """再等待 wait 秒后是否会超过整轮运行的截止时刻。"""
+        return self.deadline is not None and time.time() + wait > self.deadline
+
+
+def classify_error(exc):
+    """
+    判断发送异常的类型。
+
+    返回：
+    - "rate_limit"：频率超限（errcode 45009 或 HTTP 429），应暂停整个通道后重试
+    - "transient"：临时错误（超时、网络错误、HTTP 5xx、errcode -1），可以退避重试
+    - "permanent"：永久错误（key 错误、接收人无效等），不重试
+    - "deadline"：限速等待会超过本轮截止时间，这一段没有发出去（DeadlineExceeded）
+    """
+    if isinstance(exc, DeadlineExceeded):
+        return "deadline"
+    errcode = getattr(exc, "errcode", None)
+    status = getattr(exc, "status", None)
+    if errcode == ERRCODE_RATE_LIMIT or status == 429:
+        return "rate_limit"
+    if errcode == ERRCODE_BUSY:
+        return "transient"
+    if errcode is not None:
+        return "permanent"
+    if status is not None:
+        return "transient" if status >= 500 else "permanent"
+    if isinstance(exc, (socket.timeout, socket.error, httplib.HTTPException)):
+        return "transient"
+    return "permanent"
+
+
+def send_chunks(chunks, send_fn, bucket, retry=None):
+    """
+    依次限速发送每一段；临时错误按 retry 策略退避重试。
+
+    参数：
+    - chunks：split_chunks 返回的分段列表
+    - send_fn：发送函数 send_fn(content)，失败时抛异常
+    - bucket：该通道的 TokenBucket
+    - retry：RetryPolicy；为 None 时使用默认策略
+
+    返回：
+    - 发送成功的段数（永久错误或重试用尽时直接抛出最后一次的异常；
+      等待令牌会超过 retry.deadline 时抛出 DeadlineExceeded）
+
+    说明：
+    - 每次尝试计入 send 阶段耗时，限速等待计入 rate_limit_wait 阶段；
+      同时计数 chunks_sent、bytes_sent、retries、send_errors（按错误类型）
+    """
+    retry = retry or RetryPolicy()
+    sent = 0
+    for chunk in chunks:
+        attempt = 0
+        while True:
+            attempt += 1
+            # 每次尝试（包括重试）都要拿令牌，重试也计入通道的发送频率；等令牌会超过截止时间时抛出 DeadlineExceeded
+            waited = bucket.acquire(retry.deadline)
+            if waited > 0:
+                observe("rate_limit_wait", waited)
+                print("触发限速，等待 %.1f 秒后继续发送..." % waited)
+            try:
+                with stage("send"):
+                    send_fn(chunk)
+                add("chunks_sent")
+                add("bytes_sent", _utf8_len(chunk))
+                break
+            except Exception as e:
+                kind = classify_error(e)
+                add("send_errors", kind=kind)
+                if kind == "permanent" or attempt >= retry.max_attempts:
+                    raise
+                if kind == "rate_limit":
+                    if retry.past_deadline(retry.rate_limit_pause):
+                        print("通道被限流（%s），等待会超过本轮截止时间，不再重试" % e)
+                        raise
+                    add("retries")
+                    # 暂停整个通道；下一次 acquire 会一直等到暂停结束
+                    bucket.pause(retry.rate_limit_pause)
+                    print("通道被限流（%s），暂停 %.0f 秒后重试（第 %d 次）..." % (e, retry.rate_limit_pause, attempt))
+                else:
+                    delay = retry.backoff(attempt)
+                    if retry.past_deadline(delay):
+                        print("发送失败（%s），等待重试会超过本轮截止时间，不再重试" % e)
+                        raise
+                    add("retries")
+                    print("发送失败（%s），%.1f 秒后重试（第 %d 次）..." % (e, delay, attempt))
+                    retry._sleep(delay)
+        sent += 1
+    return sent
+
+
+def deliver_all(jobs):
+    """
+    多个通道同时发送：每个通道一个线程（各自限速、各自重试），等待全部结束。
+
+    参数：
+    - jobs：列表，每个元素为 (通道名, 无参发送函数)
+
+    返回：
+    - 字典 {通道名: (发送函数的返回值, 异常)}；成功时异常为 None，失败时返回值为 None
+    """
+    outcomes = {}
+
+    def run(channel, func):
+        try:
+            outcomes[channel] = (func(), None)
+        except Exception as e:
+            outcomes[channel] = (None, e)
+
+    if len(jobs) == 1:
+        # 只有一个通道时直接在当前线程发送
+        run(*jobs[0])
+        return outcomes
+    threads = [threading.Thread(target=run, args=job) for job in jobs]
+    for th in threads:
+        th.daemon = True
+        th.start()
+    for th in threads:
+        th.join()
+    return outcomes
@@ -9,6 +9,13 @@
 
 import os
 import json
+import decimal
+import hashlib
+
+try:
+    _INTEGER_TYPES = (int, long)  # Python 2
+except NameError:
+    _INTEGER_TYPES = (int,)  # Python 3 调试兼容
 
 
 def ensure_dir(path):
@@ -40,6 +47,32 @@ def load_last_id(state_path):
         return 0
 
 
+def _load_state(state_path):
+    """
+    读取整个状态文件，文件不存在或格式异常时返回空字典。
+    """
+    try:
+        if not os.path.isfile(state_path):
+            return {}
+        with open(state_path, "r") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def _write_state(state_path, data):
+    """
+    写入整个状态文件：先写临时文件再改名，避免写到一半进程被杀导致文件损坏。
+    """
+    dir_path = os.path.dirname(state_path) or "."
+    ensure_dir(dir_path)
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.rename(tmp_path, state_path)
+
+
 def save_last_id(state_path, last_id):
     """
     把最新的最大主键 id 写入 JSON 文件，便于下次从这个位置继续。
@@ -48,8 +81,96 @@ def save_last_id(state_path, last_id):
     - state_path：状态文件路径
     - last_id：整数 id
     """
-    dir_path = os.path.dirname(state_path) or "."
-    ensure_dir(dir_path)
-    with open(state_path, "w") as f:
-        json.dump({"last_id": int(last_id)}, f)
+    data = _load_state(state_path)
+    data["last_id"] = int(last_id)
+    _write_state(state_path, data)
+
+
+def load_marks(state_path):
+    """
+    读取每个数据源各自的高水位（增量查询用）。
+
+    参数：
+    - state_path：状态文件路径，例如 "state/last_seen.json"。
+
+    返回：
+    - 字典，如 {"db_mysql.failed_push": 1024}；没有记录时返回空字典。
+    """
+    marks = _load_state(state_path).get("marks")
+    return marks if isinstance(marks, dict) else {}
+
 
+def save_marks(state_path, marks):
+    """
+    更新若干数据源的高水位（只覆盖传入的数据源，其他数据源保持不变）。
+
+    参数：
+    - state_path：状态文件路径
+    - marks：字典，如 {"db_mysql.failed_push": 1088}；值为整数 id，
+      或 [时间字符串, id]（高水位字段不是 id 时）
+    """
+    if not marks:
+        return
+    data = _load_state(state_path)
+    merged = data.get("marks") if isinstance(data.get("marks"), dict) else {}
+    merged.update(marks)
+    data["marks"] = merged
+    _write_state(state_path, data)
+
+
+def mark_value(value):
+    """
+    把数据库返回的高水位值转换为可写入 JSON 的值：
+    整数（含整数值的 Decimal）保持整数，时间等其他类型转成字符串；
+    组合高水位 (值, id) 转成列表 [值, id]。
+    """
+    if isinstance(value, (list, tuple)):
+        return [mark_value(v) for v in value]
+    if isinstance(value, _INTEGER_TYPES):
+        return int(value)
+    if isinstance(value, decimal.Decimal) and value == value.to_integral_value():
+        return int(value)
+    return str(value)
+
+
+def item_key(value):
+    """
+    把数据库返回的字段值转换为 unicode 文本，作为“条目集合”的键（兼容 Python 2 的 UTF-8 字节串）。
+    """
+    if value is None:
+        return u""
+    if isinstance(value, bytes):
+        try:
+            return value.decode("utf-8")
+        except UnicodeDecodeError:
+            return value.decode("latin-1")
+    return u"%s" % (value,)
+
+
+def row_fingerprint(row):
+    """
+    计算一行数据的内容指纹（键名排序后做 JSON，再取 md5 前 16 位），内容不变指纹就不变。
+    """
+    text = json.dumps(dict((k, item_key(v)) for k, v in row.items()), sort_keys=True)
+    return hashlib.md5(text.encode("utf-8")).hexdigest()[:16]
+
+
+def load_item_sets(items_path):
+    """
+    读取每个数据源上次发送时的条目集合（差异推送用）。
+
+    返回：
+    - 字典 {数据源名: {条目键: 内容指纹}}；文件不存在时返回空字典。
+    """
+    return _load_state(items_path)
+
+
+def save_item_sets(items_path, sets):
+    """
+    更新若干数据源的条目集合（只覆盖传入的数据源，其他数据源保持不变）。
+    """
+    if not sets:
+        return
+    data = _load_state(items_path)
+    data.update(sets)
+    _write_state(items_path, data)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+消息模板（Python 2.7 兼容）
+
+用小白能懂的话：
+- 消息模板里用 {字段名} 表示要替换的位置，例如 "id={id}，{title}"。
+- 以前每组装一条消息都要对每一行重新解析模板（str.format），字段缺失时还会抛异常。
+- 这里把模板只解析一次（编译），记下哪些是固定文字、哪些是字段；渲染时直接按顺序拼接：
+  - 启动时就检查模板里的字段是否都存在，写错字段名会立刻报错，而不是发消息时才出错；
+  - 某一行缺少字段或字段为空时显示为空字符串，不会抛异常；
+  - 可以给整条消息设一个字节上限，达到上限后不再渲染后面的行，直接在末尾提示“已省略 N 条”。
+"""
+
+import re
+import sys
+import threading
+from string import Formatter
+
+_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# 已编译的模板缓存：同一段模板文字只解析一次
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _text(value):
+    # Python 2 下数据库/配置文件返回的字节串按 UTF-8 转成 unicode
+    if isinstance(value, type(u"")):
+        return value
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return u"%s" % value
+
+
+def _error(message):
+    # 异常消息：Python 2 下用 UTF-8 字节串（与其他模块的中文异常一致），Python 3 直接用 str
+    if sys.version_info[0] == 2:
+        return Exception(message.encode("utf-8"))
+    return Exception(message)
+
+
+def _utf8_len(text):
+    return len(text.encode("utf-8"))
+
+
+class Template(object):
+    """
+    编译后的模板。
+
+    - text：模板文字，例如 u"id={id}，{title}"；{{ 和 }} 表示字面的花括号
+    - fields：模板中用到的字段名列表（按出现顺序、去重）
+    """
+
+    def __init__(self, text):
+        self.text = _text(text)
+        self._parts = []
+        self.fields = []
+        try:
+            parsed = list(Formatter().parse(self.text))
+        except ValueError as e:
+            raise _error(u"模板格式错误（%s）：%s" % (_text(str(e)), self.text))
+        for literal, field, spec, conversion in parsed:
+            if field is not None and not _NAME_RE.match(field):
+                raise _error(u"模板中的占位符 {%s} 无效（只能是字段名）：%s" % (field, self.text))
+            if conversion not in (None, "s", "r"):
+                raise _error(u"模板中的占位符 {%s!%s} 无效（只支持 !s 和 !r）：%s" % (field, conversion, self.text))
+            self._parts.append((literal, field, spec or u"", conversion))
+            if field is not None and field not in self.fields:
+                self.fields.append(field)
+
+    def validate(self, allowed, where=u"模板"):
+        """
+        检查模板用到的字段是否都在 allowed 中，有未知字段时抛出异常。
+        """
+        allowed = set(_text(a) for a in allowed)
+        unknown = [f for f in self.fields if f not in allowed]
+        if unknown:
+            raise _error(u"%s 使用了不存在的字段：%s（可用字段：%s）" % (
+                _text(where), u", ".join(u"{%s}" % f for f in unknown), u", ".join(sorted(allowed))
+            ))
+
+    def render(self, values):
+        """
+        用 values（字典）渲染模板；缺少的字段或 None 显示为空字符串。
+        """
+        out = []
+        for literal, field, spec, conversion in self._parts:
+            if literal:
+                out.append(literal)
+            if field is None:
+                continue
+            value = values.get(field)
+            if value is None:
+                continue
+            if conversion == "r":
+                value = repr(value)
+            if spec:
+                try:
+                    out.append(_text(format(value, spec)))
+                    continue
+                except (ValueError, TypeError):
+                    pass
+            out.append(_text(value))
+        return u"".join(out)
+
+
+def compile_template(text):
+    """
+    返回 text 对应的已编译模板（同一段文字只编译一次）。
+    """
+    with _cache_lock:
+        tpl = _cache.get(text)
+        if tpl is None:
+            tpl = Template(text)
+            _cache[text] = tpl
+        return tpl
+
+
+class Digest(object):
+    """
+    摘要消息：标题 + 分隔行 + 每条一行 + “已省略 N 条”提示。
+
+    - title：标题模板，可用 {count}（以及 render 时传入的 extra 字段）
+    - item：条目模板，可用每行的字段
+    - footer：省略提示模板，可用 {omitted}
+    - separator：标题下面的分隔行（文本消息为 "——"，Markdown 为空行）
+    - footer_separator：省略提示前的分隔行（None 表示没有）
+    - prepare：可选函数 prepare(row) → 字典，在渲染前整理每行的值（例如把空值显示为 null）
+    """
+
+    def __init__(self, title, item, footer, separator=u"——", footer_separator=None, prepare=None):
+        self.title = compile_template(title)
+        self.item = compile_template(item)
+        self.footer = compile_template(footer)
+        self.separator = separator
+        self.footer_separator = footer_separator
+        self.prepare = prepare
+
+    def render(self, count, rows, max_bytes=None, extra=None):
+        """
+        渲染整条消息。
+
+        参数：
+        - count：总条数
+        - rows：要展示的行（预览行）
+        - max_bytes：整条消息的 UTF-8 字节上限；达到上限后不再渲染后面的行（None 表示不限制）
+        - extra：标题模板可用的额外字段
+
+        返回：
+        - 字符串消息
+        """
+        values = dict(extra or {})
+        values["count"] = count
+        lines = [self.title.render(values), self.separator]
+        used = sum(_utf8_len(x) + 1 for x in lines)
+        # 给省略提示预留的字节数
+        reserve = 64 if max_bytes else 0
+        shown = 0
+        for r in rows:
+            line = self.item.render(self.prepare(r) if self.prepare else r)
+            size = _utf8_len(line) + 1
+            if max_bytes and shown and used + size + reserve > max_bytes:
+                break
+            lines.append(line)
+            used += size
+            shown += 1
+        if count > shown:
+            if self.footer_separator is not None:
+                lines.append(self.footer_separator)
+            lines.append(self.footer.render({"omitted": count - shown}))
+        return u"\n".join(lines)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+数据库熔断器（CircuitBreaker）的单元测试（Python 2.7 兼容，只用标准库 unittest）
+
+运行：python -m unittest discover -s src -p "test_*_py2.py"
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from breaker_py2 import CircuitBreaker
+
+
+class FakeClock(object):
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeProbe(object):
+
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.calls = 0
+
+    def __call__(self, host, port, timeout):
+        self.calls += 1
+        return self.ok
+
+
+class BreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "breaker.json")
+        self.clock = FakeClock()
+        self.probe = FakeProbe()
+        self.breaker = self.make()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make(self, path=None):
+        return CircuitBreaker(True, self.path if path is None else path, failure_threshold=2, open_seconds=60,
+                              probe_timeout=1, clock=self.clock, probe=self.probe)
+
+    def test_disabled_does_nothing(self):
+        breaker = CircuitBreaker(False, self.path, clock=self.clock, probe=self.probe)
+        breaker.record_failure("db", 3306)
+        breaker.before_connect("db", 3306)
+        self.assertEqual(breaker.status(), {})
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_no_probe_without_failures(self):
+        self.breaker.before_connect("db", 3306)
+        self.assertEqual(self.probe.calls, 0)
+
+    def test_probe_after_a_failure(self):
+        self.breaker.record_failure("db", 3306)
+        self.probe.ok = False
+        self.assertRaises(Exception, self.breaker.before_connect, "db", 3306)
+        self.assertEqual(self.probe.calls, 1)
+        # 探测失败也算一次失败，达到阈值后熔断
+        self.assertIsNotNone(self.breaker.status()["db:3306"]["opened_at"])
+
+    def test_open_skips_without_probing(self):
+        self.breaker.record_failure("db", 3306)
+        self.breaker.record_failure("db", 3306)
+        self.clock.now += 30
+        self.assertRaises(Exception, self.breaker.before_connect, "db", 3306)
+        self.assertEqual(self.probe.calls, 0)
+
+    def test_half_open_lets_only_one_caller_probe(self):
+        self.breaker.record_failure("db", 3306)
+        self.breaker.record_failure("db", 3306)
+        self.clock.now += 61
+        self.breaker.before_connect("db", 3306)
+        self.assertRaises(Exception, self.breaker.before_connect, "db", 3306)
+        # 另一个进程读同一个状态文件，也拿不到探测名额
+        self.assertRaises(Exception, self.make().before_connect, "db", 3306)
+        self.assertEqual(self.probe.calls, 1)
+
+    def test_half_open_success_closes(self):
+        self.breaker.record_failure("db", 3306)
+        self.breaker.record_failure("db", 3306)
+        self.clock.now += 61
+        self.breaker.before_connect("db", 3306)
+        self.breaker.record_success("db", 3306)
+        self.assertEqual(self.breaker.status(), {})
+        self.breaker.before_connect("db", 3306)
+
+    def test_half_open_failure_reopens(self):
+        self.breaker.record_failure("db", 3306)
+        self.breaker.record_failure("db", 3306)
+        self.clock.now += 61
+        self.breaker.before_connect("db", 3306)
+        self.breaker.record_failure("db", 3306)
+        entry = self.breaker.status()["db:3306"]
+        self.assertEqual(entry["opened_at"], self.clock.now)
+        self.assertNotIn("probing_until", entry)
+        self.clock.now += 30
+        self.assertRaises(Exception, self.breaker.before_connect, "db", 3306)
+
+    def test_state_is_shared_through_the_file(self):
+        self.breaker.record_failure("db", 3306)
+        self.breaker.record_failure("db", 3306)
+        with open(self.path) as f:
+            self.assertEqual(json.load(f)["db:3306"]["failures"], 2)
+        self.assertRaises(Exception, self.make().before_connect, "db", 3306)
+
+    def test_concurrent_updates_are_not_lost(self):
+        # 两个实例各自打开状态文件，相当于两个进程同时读改写
+        breakers = [CircuitBreaker(True, self.path, failure_threshold=1000, clock=self.clock, probe=self.probe)
+                    for _ in range(2)]
+
+        def fail(breaker):
+            for _ in range(50):
+                breaker.record_failure("db", 3306)
+
+        threads = [threading.Thread(target=fail, args=(b,)) for b in breakers for _ in range(2)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        self.assertEqual(self.make().status()["db:3306"]["failures"], 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+并发执行多个查询（run_all）的单元测试（Python 2.7 兼容，只用标准库 unittest）
+
+运行：python -m unittest discover -s src -p "test_*_py2.py"
+"""
+
+import threading
+import time
+import unittest
+
+from fanout_py2 import run_all
+
+
+class RunAllTest(unittest.TestCase):
+
+    def test_results_in_submission_order(self):
+        def make(n):
+            return lambda: n
+
+        results = run_all([("t%d" % n, make(n)) for n in range(5)], max_workers=3)
+        self.assertEqual([r.name for r in results], ["t0", "t1", "t2", "t3", "t4"])
+        self.assertEqual([r.value for r in results], [0, 1, 2, 3, 4])
+        self.assertTrue(all(r.ok for r in results))
+
+    def test_error_is_captured(self):
+        def boom():
+            raise ValueError("boom")
+
+        result = run_all([("bad", boom)])[0]
+        self.assertFalse(result.ok)
+        self.assertIsInstance(result.error, ValueError)
+
+    def test_timed_out_result_never_turns_into_success(self):
+        release = threading.Event()
+        finished = threading.Event()
+
+        def slow():
+            release.wait(5)
+            finished.set()
+            return "late"
+
+        result = run_all([("slow", slow, 0.1)])[0]
+        self.assertTrue(result.timed_out)
+        release.set()
+        finished.wait(5)
+        time.sleep(0.05)
+        self.assertFalse(result.ok)
+        self.assertTrue(result.timed_out)
+        self.assertIsNone(result.value)
+
+    def test_queued_task_past_its_deadline_is_skipped(self):
+        calls = []
+        release = threading.Event()
+
+        def blocker():
+            release.wait(5)
+
+        results = run_all([("first", blocker, 0.1), ("second", lambda: calls.append(1), 0.1)], max_workers=1)
+        release.set()
+        time.sleep(0.1)
+        self.assertTrue(results[1].timed_out)
+        self.assertEqual(calls, [])
+
+    def test_run_deadline_caps_task_timeouts(self):
+        release = threading.Event()
+        start = time.time()
+        result = run_all([("slow", lambda: release.wait(5), 30)], deadline=time.time() + 0.1)[0]
+        release.set()
+        self.assertTrue(result.timed_out)
+        self.assertTrue(time.time() - start < 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
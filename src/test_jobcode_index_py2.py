@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+本地 jobcode 计数索引（JobcodeIndex）的单元测试（Python 2.7 兼容，只用标准库 unittest）
+
+运行：python -m unittest discover -s src -p "test_*_py2.py"
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from jobcode_index_py2 import JobcodeIndex
+
+
+class JobcodeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "jobcode_index.sqlite")
+        self.index = JobcodeIndex(self.path)
+        self.rows = [(1, "A"), (2, "B"), (3, " ")]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def fetch_after(self, last_id):
+        return [r for r in self.rows if r[0] > last_id]
+
+    def fetch_counts(self):
+        counts = {}
+        for _, jobcode in self.rows:
+            counts[jobcode] = counts.get(jobcode, 0) + 1
+        return max(r[0] for r in self.rows), sorted(counts.items())
+
+    def refresh(self, now):
+        return self.index.refresh("src", self.fetch_after, self.fetch_counts, full_interval=3600, now=now)
+
+    def test_first_refresh_is_full(self):
+        result = self.refresh(0)
+        self.assertTrue(result["full"])
+        self.assertEqual(self.index.duplicates(), [])
+
+    def test_delta_reports_new_duplicates(self):
+        self.refresh(0)
+        self.rows += [(4, "A"), (5, "B"), (6, "C")]
+        result = self.refresh(10)
+        self.assertFalse(result["full"])
+        self.assertEqual(result["scanned"], 3)
+        self.assertEqual(result["became"], ["A", "B"])
+        self.assertEqual(self.index.duplicates(), [{"jobcode": "B", "dup_count": 2}, {"jobcode": "A", "dup_count": 2}])
+
+    def test_full_check_clears_deleted_duplicates(self):
+        self.refresh(0)
+        self.rows.append((4, "A"))
+        self.refresh(10)
+        self.rows = [r for r in self.rows if r[0] != 4]
+        result = self.refresh(4000)
+        self.assertTrue(result["full"])
+        self.assertEqual(result["cleared"], ["A"])
+
+    def test_rows_counted_by_another_process_are_not_counted_twice(self):
+        self.refresh(0)
+        self.rows += [(4, "A")]
+        other = JobcodeIndex(self.path)
+
+        def fetch_after(last_id):
+            # 本进程读源库期间，另一个进程已经把同一批新行累加进索引
+            rows = self.fetch_after(last_id)
+            other.refresh("src", self.fetch_after, self.fetch_counts, full_interval=3600, now=5)
+            return rows
+
+        result = self.index.refresh("src", fetch_after, self.fetch_counts, full_interval=3600, now=5)
+        self.assertEqual(result["scanned"], 0)
+        self.assertEqual(self.index.duplicates(), [{"jobcode": "A", "dup_count": 2}])
+
+    def test_non_integer_id_gives_clear_error(self):
+        self.refresh(0)
+        self.assertRaises(Exception, self.index.refresh, "src", lambda last_id: [("abc", "A")], self.fetch_counts,
+                          3600, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
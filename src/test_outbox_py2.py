@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+发件箱（Outbox）的单元测试（Python 2.7 兼容，只用标准库 unittest）
+
+运行：python -m unittest discover -s src -p "test_*_py2.py"
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from outbox_py2 import Outbox
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.outbox = Outbox(os.path.join(self.tmp, "outbox.sqlite"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def keys(self, entries):
+        return [e.key for e in entries]
+
+    def test_enqueue_is_idempotent(self):
+        self.assertEqual(self.outbox.enqueue([("k1", "A", "m1"), ("k2", "A", "m2")], now=0), 2)
+        self.assertEqual(self.outbox.enqueue([("k1", "A", "m1"), ("k3", "A", "m3")], now=0), 1)
+        self.assertEqual(self.outbox.stats()["pending"], 3)
+
+    def test_claim_in_order_and_leased(self):
+        self.outbox.enqueue([("a1", "A", "x"), ("b1", "B", "y"), ("a2", "A", "z")], now=0)
+        self.assertEqual(self.keys(self.outbox.claim(10, now=1)), ["a1", "b1", "a2"])
+        # 租约期内不会被再次取出
+        self.assertEqual(self.outbox.claim(10, now=2), [])
+
+    def test_claim_skips_rows_behind_an_older_row_waiting_to_retry(self):
+        self.outbox.enqueue([("a1", "A", "x"), ("a2", "A", "y"), ("b1", "B", "z")], now=0)
+        first = self.outbox.claim(10, now=1)
+        self.outbox.mark_failed(first[0].id, "boom", retry_delay=60, now=1)
+        for e in first[1:]:
+            self.outbox.release(e)
+        # a1 要 61 秒后才重试，a2 不能先发出去；B 通道不受影响
+        self.assertEqual(self.keys(self.outbox.claim(10, now=2)), ["b1"])
+
+    def test_claim_skips_rows_behind_a_row_leased_elsewhere(self):
+        self.outbox.enqueue([("a1", "A", "x"), ("a2", "A", "y")], now=0)
+        self.assertEqual(self.keys(self.outbox.claim(1, now=1)), ["a1"])
+        self.assertEqual(self.outbox.claim(10, now=2), [])
+
+    def test_renew_fails_after_another_drainer_reclaims(self):
+        self.outbox.enqueue([("k1", "A", "m1")], now=0)
+        mine = self.outbox.claim(10, now=1)[0]
+        theirs = self.outbox.claim(10, now=1 + self.outbox.lease + 1)[0]
+        self.assertFalse(self.outbox.renew(mine, now=400))
+        self.assertTrue(self.outbox.renew(theirs, now=400))
+        # 放弃一条已不属于自己的消息，不能清掉别人的租约
+        self.outbox.release(mine)
+        self.assertEqual(self.outbox.claim(10, now=401), [])
+
+    def test_renew_after_expiry_without_reclaim(self):
+        self.outbox.enqueue([("k1", "A", "m1")], now=0)
+        entry = self.outbox.claim(10, now=1)[0]
+        self.assertTrue(self.outbox.renew(entry, now=1000))
+        self.assertEqual(self.outbox.claim(10, now=1001), [])
+
+    def test_mark_failed_backs_off_then_dead(self):
+        self.outbox.enqueue([("k1", "A", "m1")], now=0)
+        entry = self.outbox.claim(10, now=0)[0]
+        self.assertFalse(self.outbox.mark_failed(entry.id, "e1", max_attempts=2, retry_delay=10, now=0))
+        self.assertEqual(self.outbox.claim(10, now=9), [])
+        entry = self.outbox.claim(10, now=10)[0]
+        self.assertTrue(self.outbox.mark_failed(entry.id, "e2", max_attempts=2, retry_delay=10, now=10))
+        self.assertEqual(self.outbox.stats(), {"pending": 0, "sent": 0, "dead": 1})
+
+    def test_drain_blocks_channel_after_failure(self):
+        self.outbox.enqueue([("a1", "A", "x"), ("a2", "A", "y"), ("b1", "B", "z")])
+        sent = []
+
+        def send(entry):
+            if entry.key == "a1":
+                raise Exception("boom")
+            sent.append(entry.key)
+
+        result = self.outbox.drain(send)
+        self.assertEqual(sent, ["b1"])
+        self.assertEqual(result, {"sent": 1, "failed": 1, "dead": 0})
+        self.assertEqual(self.outbox.stats()["pending"], 2)
+
+    def test_drain_permanent_error_goes_dead(self):
+        self.outbox.enqueue([("a1", "A", "x")])
+
+        def send(entry):
+            raise ValueError("bad key")
+
+        result = self.outbox.drain(send, is_permanent=lambda e: isinstance(e, ValueError))
+        self.assertEqual(result["dead"], 1)
+
+    def test_drain_deferred_entry_is_released_without_counting(self):
+        self.outbox.enqueue([("a1", "A", "x")])
+
+        def send(entry):
+            raise KeyError("later")
+
+        result = self.outbox.drain(send, is_deferred=lambda e: isinstance(e, KeyError))
+        self.assertEqual(result, {"sent": 0, "failed": 0, "dead": 0})
+        entry = self.outbox.claim(10)[0]
+        self.assertEqual(entry.attempts, 0)
+
+    def test_drain_stops_after_deadline(self):
+        self.outbox.enqueue([("a1", "A", "x")])
+        sent = []
+        result = self.outbox.drain(lambda e: sent.append(e.key), deadline=time.time() - 1)
+        self.assertEqual(sent, [])
+        self.assertEqual(result["sent"], 0)
+        self.assertEqual(self.outbox.stats()["pending"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+定时调度器（Scheduler）的单元测试（Python 2.7 兼容，只用标准库 unittest）
+
+运行：python -m unittest discover -s src -p "test_*_py2.py"
+"""
+
+import unittest
+
+from scheduler_py2 import Scheduler
+
+
+class FakeClock(object):
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = Scheduler(clock=self.clock)
+        self.fired = []
+
+    def run_until(self, end, step=0.5):
+        while self.clock.now < end:
+            self.clock.now += step
+            self.scheduler.run_pending()
+
+    def test_rejects_non_positive_interval(self):
+        self.assertRaises(Exception, self.scheduler.add_job, "x", lambda: None, 0)
+
+    def test_run_now_fires_immediately(self):
+        self.scheduler.add_job("x", lambda: self.fired.append(self.clock.now), 60)
+        self.scheduler.run_pending()
+        self.assertEqual(self.fired, [0.0])
+
+    def test_run_now_false_waits_one_interval(self):
+        self.scheduler.add_job("x", lambda: self.fired.append(self.clock.now), 60, run_now=False)
+        self.run_until(59)
+        self.assertEqual(self.fired, [])
+        self.run_until(61)
+        self.assertEqual(len(self.fired), 1)
+
+    def test_jitter_does_not_accumulate(self):
+        self.scheduler.add_job("x", lambda: self.fired.append(self.clock.now), 60, jitter=10)
+        self.run_until(60 * 1000)
+        # 每次只比计划时间晚 0~jitter 秒（再加上测试时钟的步长），不会越拖越晚
+        self.assertEqual(len(self.fired), 1000)
+        for i, t in enumerate(self.fired):
+            self.assertTrue(60 * i <= t <= 60 * i + 10.5, (i, t))
+
+    def test_overrunning_job_restarts_from_now(self):
+        def slow():
+            self.fired.append(self.clock.now)
+            self.clock.now += 150
+
+        self.scheduler.add_job("x", slow, 60)
+        self.scheduler.run_pending()
+        self.assertEqual(self.scheduler._jobs[0]["next_run"], 150 + 60)
+
+    def test_failing_job_keeps_running(self):
+        def boom():
+            self.fired.append(self.clock.now)
+            raise Exception("boom")
+
+        self.scheduler.add_job("x", boom, 10)
+        self.run_until(35)
+        self.assertEqual(len(self.fired), 4)
+
+    def test_stop_skips_pending_jobs(self):
+        self.scheduler.add_job("x", lambda: self.fired.append(1), 10)
+        self.scheduler.stop()
+        self.scheduler.run_pending()
+        self.assertEqual(self.fired, [])
+        self.assertTrue(self.scheduler.stopped())
+
+
+if __name__ == "__main__":
+    unittest.main()
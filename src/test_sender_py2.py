@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+消息分段、令牌桶限速与发送重试的单元测试（Python 2.7 兼容，只用标准库 unittest）
+
+运行：python -m unittest discover -s src -p "test_*_py2.py"
+"""
+
+import socket
+import unittest
+
+from sender_py2 import (
+    DeadlineExceeded,
+    RetryPolicy,
+    TokenBucket,
+    classify_error,
+    get_bucket,
+    send_chunks,
+    split_chunks,
+)
+
+
+class FakeTime(object):
+    """假时钟：sleep 只把时间往前拨，不真正等待。"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.slept = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class ApiError(Exception):
+
+    def __init__(self, errcode=None, status=None):
+        Exception.__init__(self, "errcode=%s status=%s" % (errcode, status))
+        self.errcode = errcode
+        self.status = status
+
+
+class SplitChunksTest(unittest.TestCase):
+
+    def test_single_chunk_is_plain_join(self):
+        self.assertEqual(split_chunks([u"a\nb", u"c"], 4096), [u"a\nb\n\nc"])
+
+    def test_chunks_respect_byte_limit_and_are_numbered(self):
+        lines = u"\n".join([u"第%d行：推送失败" % i for i in range(200)])
+        chunks = split_chunks([lines], 512)
+        self.assertTrue(len(chunks) > 1)
+        for i, chunk in enumerate(chunks):
+            self.assertTrue(len(chunk.encode("utf-8")) <= 512)
+            self.assertTrue(chunk.startswith(u"(%d/%d)\n" % (i + 1, len(chunks))))
+
+    def test_long_line_is_cut_on_character_boundaries(self):
+        chunks = split_chunks([u"汉" * 1000], 256)
+        self.assertEqual(u"".join(c.split(u"\n", 1)[1] for c in chunks), u"汉" * 1000)
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def make(self, per_minute=20, capacity=1):
+        self.time = FakeTime()
+        return TokenBucket(per_minute / 60.0, capacity, clock=self.time.clock, sleep=self.time.sleep)
+
+    def test_no_60s_window_exceeds_per_minute(self):
+        bucket = self.make(20)
+        sent = []
+        for _ in range(100):
+            bucket.acquire()
+            sent.append(self.time.now)
+        for i, start in enumerate(sent):
+            in_window = [t for t in sent[i:] if t < start + 60]
+            self.assertTrue(len(in_window) <= 20, (start, len(in_window)))
+
+    def test_get_bucket_caps_capacity_and_rebuilds_on_rate_change(self):
+        bucket = get_bucket("test:channel", 20)
+        self.assertEqual(bucket.capacity, 1)
+        self.assertIs(get_bucket("test:channel", 20), bucket)
+        rebuilt = get_bucket("test:channel", 10)
+        self.assertIsNot(rebuilt, bucket)
+        self.assertAlmostEqual(rebuilt.rate, 10 / 60.0)
+
+    def test_pause_blocks_whole_channel(self):
+        bucket = self.make(60)
+        bucket.acquire()
+        bucket.pause(30)
+        start = self.time.now
+        bucket.acquire()
+        self.assertTrue(self.time.now - start >= 30)
+
+    def test_deadline_raises_without_taking_a_token(self):
+        bucket = self.make(20)
+        bucket.acquire()
+        self.assertRaises(DeadlineExceeded, bucket.acquire, self.time.now + 1)
+        self.assertEqual(self.time.slept, [])
+        self.assertAlmostEqual(bucket.acquire(self.time.now + 10), 3.0)
+
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.time = FakeTime()
+        self.bucket = TokenBucket(1000, 1000, clock=self.time.clock, sleep=self.time.sleep)
+
+    def policy(self, **kwargs):
+        return RetryPolicy(sleep=self.time.sleep, rand=lambda: 1.0, **kwargs)
+
+    def test_classify_error(self):
+        self.assertEqual(classify_error(ApiError(errcode=45009)), "rate_limit")
+        self.assertEqual(classify_error(ApiError(status=429)), "rate_limit")
+        self.assertEqual(classify_error(ApiError(errcode=-1)), "transient")
+        self.assertEqual(classify_error(ApiError(status=502)), "transient")
+        self.assertEqual(classify_error(socket.timeout()), "transient")
+        self.assertEqual(classify_error(ApiError(errcode=93000)), "permanent")
+        self.assertEqual(classify_error(ApiError(status=404)), "permanent")
+        self.assertEqual(classify_error(DeadlineExceeded("late")), "deadline")
+
+    def test_backoff_doubles_up_to_max(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5, rand=lambda: 1.0)
+        self.assertEqual([policy.backoff(n) for n in range(1, 5)], [1, 2, 4, 5])
+        policy = RetryPolicy(base_delay=1, max_delay=5, rand=lambda: 0.0)
+        self.assertEqual(policy.backoff(3), 2)
+
+    def test_transient_errors_are_retried(self):
+        calls = []
+
+        def send(content):
+            calls.append(content)
+            if len(calls) < 3:
+                raise ApiError(errcode=-1)
+
+        self.assertEqual(send_chunks([u"a"], send, self.bucket, self.policy()), 1)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self.time.slept, [1.0, 2.0])
+
+    def test_permanent_error_is_not_retried(self):
+        calls = []
+
+        def send(content):
+            calls.append(content)
+            raise ApiError(errcode=93000)
+
+        self.assertRaises(ApiError, send_chunks, [u"a"], send, self.bucket, self.policy())
+        self.assertEqual(len(calls), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        calls = []
+
+        def send(content):
+            calls.append(content)
+            raise ApiError(status=503)
+
+        self.assertRaises(ApiError, send_chunks, [u"a"], send, self.bucket, self.policy(max_attempts=2))
+        self.assertEqual(len(calls), 2)
+
+    def test_no_retry_past_deadline(self):
+        calls = []
+
+        def send(content):
+            calls.append(content)
+            raise ApiError(errcode=-1)
+
+        policy = self.policy(deadline=0)
+        self.assertRaises(ApiError, send_chunks, [u"a"], send, self.bucket, policy)
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,7 +10,6 @@ SQL Server 连通性与查询测试脚本（Python 2.7 兼容）
 
 import sys
 import os
-import socket
 import argparse
 
 try:
@@ -19,25 +18,12 @@ except Exception:
     from configparser import ConfigParser  # Python 3 调试兼容
 
 from db_client_py2 import (
+    configure_drivers,
     query_duplicate_jobcodes_sqlserver,
     query_duplicate_jobcodes,
     _connect_sqlserver,
 )
-
-
-def check_port(host, port, timeout=5):
-    """
-    端口连通性小测试：尝试 TCP 连接 host:port，成功返回 True，失败返回 False。
-    这个不等于数据库能用，只是说明网络层能到达。
-    """
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(timeout)
-        sock.connect((host, int(port)))
-        sock.close()
-        return True
-    except Exception:
-        return False
+from breaker_py2 import check_port
 
 
 def read_config(path):
@@ -56,6 +42,7 @@ def read_config(path):
         "database": cp.get("db", "database") if cp.has_option("db", "database") else "",
         "user": cp.get("db", "user") if cp.has_option("db", "user") else "",
         "password": cp.get("db", "password") if cp.has_option("db", "password") else "",
+        "drivers": [x.strip() for x in cp.get("db", "drivers").split("|") if x.strip()] if cp.has_option("db", "drivers") else [],
     }
     return {"db": db}
 
@@ -72,13 +59,15 @@ def main():
     db = cfg["db"]
 
     if db["driver"].lower() == "sqlserver":
+        configure_drivers(db)
         # 先做端口连通性测试
         ok_net = check_port(db["host"], db["port"])
         print("网络连通性(%s:%d)：%s" % (db["host"], db["port"], "OK" if ok_net else "失败"))
 
         # 连接确认：打印服务器本地地址、实例名和当前库
         try:
-            conn = _connect_sqlserver(db["host"], db["user"], db["password"], db["database"], db["port"])
+            conn = _connect_sqlserver(db["host"], db["user"], db["password"], db["database"], db["port"],
+                                      drivers=db["drivers"] or None)
             cur = conn.cursor()
             cur.execute("SELECT CONNECTIONPROPERTY('local_net_address') AS server_ip, @@SERVERNAME AS server_name, DB_NAME() AS current_db")
             info = cur.fetchone()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+高水位状态与增量查询的单元测试（Python 2.7 兼容，只用标准库 unittest）
+
+运行：python -m unittest discover -s src -p "test_*_py2.py"
+"""
+
+import datetime
+import decimal
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from db_client_py2 import _incremental_sql, row_mark
+from state_py2 import load_marks, mark_value, save_marks
+
+
+class MarkValueTest(unittest.TestCase):
+
+    def test_integers_stay_integers(self):
+        self.assertEqual(mark_value(7), 7)
+        self.assertEqual(mark_value(decimal.Decimal("12")), 12)
+
+    def test_other_types_become_strings(self):
+        self.assertEqual(mark_value(datetime.datetime(2024, 1, 2, 3, 4, 5)), "2024-01-02 03:04:05")
+        self.assertEqual(mark_value(decimal.Decimal("1.5")), "1.5")
+
+    def test_compound_mark_becomes_list(self):
+        value = (datetime.datetime(2024, 1, 1), decimal.Decimal("9"))
+        self.assertEqual(mark_value(value), ["2024-01-01 00:00:00", 9])
+
+
+class SaveMarksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "state", "last_seen.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_missing_file_means_no_marks(self):
+        self.assertEqual(load_marks(self.path), {})
+
+    def test_save_merges_with_existing_sources(self):
+        save_marks(self.path, {"db": 10, "db_mysql.failed_push": ["2024-01-01 00:00:00", 3]})
+        save_marks(self.path, {"db": 20})
+        self.assertEqual(load_marks(self.path), {"db": 20, "db_mysql.failed_push": ["2024-01-01 00:00:00", 3]})
+
+
+class IncrementalSqlTest(unittest.TestCase):
+
+    QUERY = (["name", "status"], "items", "status='2'")
+
+    def test_full_query_is_unchanged(self):
+        sql, params, columns = _incremental_sql(*self.QUERY)
+        self.assertEqual(sql, "SELECT name, status FROM items WHERE status='2'")
+        self.assertEqual(params, [])
+        self.assertEqual(columns, ["name", "status"])
+
+    def test_id_mark(self):
+        sql, params, columns = _incremental_sql(*self.QUERY, mark_column="id", last_mark=5, limit=10)
+        self.assertEqual(sql, "SELECT name, status, id FROM items WHERE status='2' AND id > %s ORDER BY id LIMIT 10")
+        self.assertEqual(params, [5])
+
+    def test_compound_mark(self):
+        sql, params, columns = _incremental_sql(*self.QUERY, mark_column="updated", last_mark=["t1", 4], limit=10)
+        self.assertEqual(
+            sql,
+            "SELECT name, status, updated, id FROM items WHERE status='2' "
+            "AND (updated > %s OR (updated = %s AND id > %s)) ORDER BY updated, id LIMIT 10",
+        )
+        self.assertEqual(params, ["t1", "t1", 4])
+
+    def test_scalar_mark_from_older_version(self):
+        sql, params, _ = _incremental_sql(*self.QUERY, mark_column="updated", last_mark="t1")
+        self.assertIn("AND updated > %s ORDER BY updated, id", sql)
+        self.assertEqual(params, ["t1"])
+
+    def test_compound_mark_after_switching_to_id(self):
+        sql, params, _ = _incremental_sql(*self.QUERY, mark_column="id", last_mark=["t1", 4])
+        self.assertIn("AND id > %s ORDER BY id", sql)
+        self.assertEqual(params, [4])
+
+    def test_illegal_column_is_rejected(self):
+        self.assertRaises(Exception, _incremental_sql, *self.QUERY, mark_column="id; DROP TABLE items")
+
+    def test_row_mark(self):
+        self.assertEqual(row_mark({"id": 3}, "id"), 3)
+        self.assertEqual(row_mark({"updated": "t1", "id": 3}, "updated"), ("t1", 3))
+        self.assertEqual(row_mark({"updated": None, "id": 3}, "updated"), None)
+
+    def test_paging_does_not_skip_rows_sharing_the_mark(self):
+        # 窗口边界落在取值相同的一组行中间时，下一轮也要把剩下的行读出来
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE items (id INTEGER, name TEXT, status TEXT, updated TEXT)")
+        conn.executemany("INSERT INTO items VALUES (?, ?, '2', ?)", [
+            (1, "a", "t1"), (2, "b", "t2"), (3, "c", "t2"), (4, "d", "t2"), (5, "e", "t3"),
+        ])
+        seen = []
+        mark = None
+        for _ in range(10):
+            sql, params, columns = _incremental_sql(*self.QUERY, mark_column="updated", last_mark=mark, limit=2)
+            rows = [dict(zip(columns, r)) for r in conn.execute(sql.replace("%s", "?"), params)]
+            if not rows:
+                break
+            seen.extend(r["name"] for r in rows)
+            mark = mark_value(max(row_mark(r, "updated") for r in rows))
+        self.assertEqual(seen, ["a", "b", "c", "d", "e"])
+        self.assertEqual(mark, ["t3", 5])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,18 +6,124 @@
 - 先用企业ID（corpid）和应用密钥（corpsecret）去企业微信拿一个临时的令牌（access_token）。
 - 再用这个令牌，把我们要发的文本消息，发送到指定的用户（touser）或部门（toparty）。
 - 这里只实现最常用的文本消息发送，足够满足“查询有结果就提醒”的需求。
+- 取 token 和发消息共用 http_transport_py2 的长连接，不必每次重新握手。
 """
 
+import hashlib
 import json
-import sys
+import os
+import threading
+import time
 try:
-    import urllib2  # Python 2
+    import fcntl  # Linux / macOS 文件锁
 except Exception:
-    # Python 3 兼容导入（用于本地干跑调试）
-    import urllib.request as urllib2
+    fcntl = None
 
+from http_transport_py2 import get_json, post_json
 
-def get_access_token(corpid, corpsecret, timeout=8):
+# access_token 失效相关的错误码：40014 不合法的 token，42001 token 已过期
+TOKEN_INVALID_ERRCODES = (40014, 42001)
+# 距离过期还剩多少秒时提前刷新
+TOKEN_REFRESH_MARGIN = 300
+# 企业微信接口地址；联调/压测时可以改成本地模拟服务（见 wecom_stub_py2.py）
+DEFAULT_API_BASE = "https://qyapi.weixin.qq.com"
+_api_base = DEFAULT_API_BASE
+
+_cache_lock = threading.Lock()
+
+
+def configure_api_base(api_base):
+    """
+    设置企业微信接口地址（[wecom] api_base），例如 "http://127.0.0.1:18080"；为空时恢复默认地址。
+    """
+    global _api_base
+    _api_base = (api_base or DEFAULT_API_BASE).rstrip("/")
+
+
+class WecomApiError(Exception):
+    """
+    企业微信接口返回非 0 errcode 时抛出的异常，errcode 属性便于调用方判断原因。
+    """
+
+    def __init__(self, message, errcode=None, errmsg=None):
+        Exception.__init__(self, message)
+        self.errcode = errcode
+        self.errmsg = errmsg
+
+
+def _fetch_access_token(corpid, corpsecret, timeout=8):
+    """
+    直接请求企业微信 gettoken 接口。
+
+    返回：(access_token, expires_in)
+    """
+    url = _api_base + "/cgi-bin/gettoken?corpid=" + corpid + "&corpsecret=" + corpsecret
+    data = get_json(url, timeout)
+    if data.get("errcode") == 0 and "access_token" in data:
+        return data["access_token"], int(data.get("expires_in") or 7200)
+    raise WecomApiError(
+        "Get access_token failed: errcode=%s errmsg=%s" % (data.get("errcode"), data.get("errmsg")),
+        data.get("errcode"), data.get("errmsg"),
+    )
+
+
+def _cache_key(corpid, corpsecret):
+    # 缓存文件里不保存密钥本身，只保存摘要用于区分不同应用
+    return "%s:%s" % (corpid, hashlib.sha1(corpsecret.encode("utf-8")).hexdigest()[:12])
+
+
+class _FileLock(object):
+    """
+    基于 fcntl.flock 的跨进程互斥锁（cron 进程与常驻进程之间共享）；
+    同一进程内的多个线程另外用 _cache_lock 互斥。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+
+    def __enter__(self):
+        _cache_lock.acquire()
+        try:
+            dir_path = os.path.dirname(self.path) or "."
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+            self._f = open(self.path, "a")
+            if fcntl is not None:
+                fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+        except Exception:
+            _cache_lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+            self._f.close()
+        finally:
+            _cache_lock.release()
+        return False
+
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path, "r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _write_cache(cache_path, data):
+    # 先写临时文件再改名，避免其他进程读到写了一半的文件；token 属于敏感信息，权限设为 600
+    tmp_path = cache_path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.rename(tmp_path, cache_path)
+
+
+def get_access_token(corpid, corpsecret, timeout=8, cache_path=None):
     """
     用企业ID和应用密钥，向企业微信请求 access_token。
 
@@ -25,19 +131,43 @@ def get_access_token(corpid, corpsecret, timeout=8):
     - corpid：企业ID（字符串）
     - corpsecret：应用密钥（字符串）
     - timeout：网络请求超时时间（秒）
+    - cache_path：token 缓存文件路径（可选）。指定后 token 会保存在磁盘上，
+      多个 cron 进程/常驻进程共用同一个 token，过期前 TOKEN_REFRESH_MARGIN 秒才重新获取。
 
     返回：
     - 成功时返回 access_token 字符串；失败时抛出异常。
     """
-    url = (
-        "https://qyapi.weixin.qq.com/cgi-bin/gettoken?corpid=" + corpid + "&corpsecret=" + corpsecret
-    )
-    resp = urllib2.urlopen(url, timeout=timeout)
-    body = resp.read()
-    data = json.loads(body)
-    if data.get("errcode") == 0 and "access_token" in data:
-        return data["access_token"]
-    raise Exception("Get access_token failed: errcode=%s errmsg=%s" % (data.get("errcode"), data.get("errmsg")))
+    if not cache_path:
+        return _fetch_access_token(corpid, corpsecret, timeout)[0]
+    key = _cache_key(corpid, corpsecret)
+    # 持锁期间完成“读缓存→必要时刷新→写缓存”，并发进程只会有一个去请求 gettoken
+    with _FileLock(cache_path + ".lock"):
+        data = _read_cache(cache_path)
+        entry = data.get(key) or {}
+        if entry.get("access_token") and entry.get("expires_at", 0) - TOKEN_REFRESH_MARGIN > time.time():
+            return entry["access_token"]
+        token, expires_in = _fetch_access_token(corpid, corpsecret, timeout)
+        data[key] = {"access_token": token, "expires_at": time.time() + expires_in}
+        _write_cache(cache_path, data)
+        return token
+
+
+def invalidate_access_token(corpid, corpsecret, cache_path, token):
+    """
+    把缓存中的 token 作废（收到 40014/42001 时调用），下次 get_access_token 会重新获取。
+
+    参数：
+    - token：刚才调用失败的 token。只有缓存里还是这个 token 时才删除；
+      如果别的进程已经换上了新 token，就保留新的，避免把刚刷新好的 token 又删掉。
+    """
+    if not cache_path:
+        return
+    key = _cache_key(corpid, corpsecret)
+    with _FileLock(cache_path + ".lock"):
+        data = _read_cache(cache_path)
+        if (data.get(key) or {}).get("access_token") == token:
+            del data[key]
+            _write_cache(cache_path, data)
 
 
 def send_text(access_token, agentid, touser, content, timeout=8):
@@ -54,7 +184,7 @@ def send_text(access_token, agentid, touser, content, timeout=8):
     返回：
     - True 表示发送成功；否则抛出异常。
     """
-    url = "https://qyapi.weixin.qq.com/cgi-bin/message/send?access_token=" + access_token
+    url = _api_base + "/cgi-bin/message/send?access_token=" + access_token
     payload = {
         "touser": touser,
         "agentid": int(agentid),
@@ -62,14 +192,31 @@ def send_text(access_token, agentid, touser, content, timeout=8):
         "text": {"content": content},
         "safe": 0,
     }
-    data_bytes = json.dumps(payload)
-    if sys.version_info[0] >= 3:
-        data_bytes = data_bytes.encode("utf-8")
-    req = urllib2.Request(url, data=data_bytes)
-    req.add_header("Content-Type", "application/json")
-    resp = urllib2.urlopen(req, timeout=timeout)
-    body = resp.read()
-    data = json.loads(body)
+    data = post_json(url, payload, timeout)
     if data.get("errcode") == 0:
         return True
-    raise Exception("Send message failed: errcode=%s errmsg=%s" % (data.get("errcode"), data.get("errmsg")))
+    raise WecomApiError(
+        "Send message failed: errcode=%s errmsg=%s" % (data.get("errcode"), data.get("errmsg")),
+        data.get("errcode"), data.get("errmsg"),
+    )
+
+
+def send_app_text(corpid, corpsecret, agentid, touser, content, cache_path=None, timeout=8):
+    """
+    获取 token（优先用缓存）并发送应用文本消息。
+
+    token 有缓存时只需一次 HTTPS 请求；如果企业微信返回 token 无效/过期（40014/42001），
+    作废缓存、重新获取 token 后再发送一次。
+
+    返回：
+    - True 表示发送成功；否则抛出异常。
+    """
+    token = get_access_token(corpid, corpsecret, timeout, cache_path)
+    try:
+        return send_text(token, agentid, touser, content, timeout)
+    except WecomApiError as e:
+        if not cache_path or e.errcode not in TOKEN_INVALID_ERRCODES:
+            raise
+    invalidate_access_token(corpid, corpsecret, cache_path, token)
+    token = get_access_token(corpid, corpsecret, timeout, cache_path)
+    return send_text(token, agentid, touser, content, timeout)
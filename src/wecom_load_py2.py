@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+企业微信发送压测（Python 2.7 兼容），配合 wecom_stub_py2.py 使用
+
+用小白能懂的话：
+- 用真实的发送代码（长连接、重试、令牌桶限速都与 main_py2 相同），
+  向本地模拟服务连续发送一批消息，统计吞吐量（条/秒）和延迟分布（p50 / p90 / p99 / 最大）。
+- 调整并发数、重试参数、是否复用连接后对比结果，就能离线调优，不会往真实的群里刷消息。
+
+用法（先在另一个终端启动模拟服务）：
+    python src/wecom_stub_py2.py --port 18080 --latency 30 --per-minute 0
+    python src/wecom_load_py2.py --base http://127.0.0.1:18080 --messages 500 --concurrency 4
+    python src/wecom_load_py2.py --mode app --messages 200 --fresh-connections   # 每条都新建连接，对比长连接的收益
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import argparse
+
+from http_transport_py2 import _TRANSPORT, get_json, post_json
+from sender_py2 import RetryPolicy, TokenBucket, send_chunks
+from wecom_client_py2 import configure_api_base, send_app_text
+from wecom_robot_py2 import send_markdown, send_text
+
+MODES = ("robot-markdown", "robot-text", "app")
+
+
+class _Unlimited(object):
+    """不限速（--per-minute 0）时代替令牌桶。"""
+
+    def acquire(self):
+        return 0.0
+
+    def pause(self, seconds):
+        pass
+
+
+def percentile(sorted_values, p):
+    """返回已排序列表的第 p 百分位（0~100），列表为空时返回 None。"""
+    if not sorted_values:
+        return None
+    index = int(round(p / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def make_content(index, size):
+    """生成约 size 字节（UTF-8）的消息内容，每条带序号便于在模拟服务日志中区分。"""
+    head = u"压测消息 #%d " % index
+    filler = size - len(head.encode("utf-8"))
+    return head + u"x" * max(0, filler)
+
+
+def make_sender(args):
+    """按模式返回 send_fn(content)。"""
+    base = args.base.rstrip("/")
+    if args.mode == "app":
+        configure_api_base(base)
+        cache_path = args.token_cache or None
+        return lambda content: send_app_text(
+            args.corpid, args.corpsecret, 1, "@all", content, cache_path=cache_path, timeout=args.timeout
+        )
+    webhook = base + "/cgi-bin/webhook/send?key=" + args.key
+    if args.mode == "robot-markdown":
+        return lambda content: send_markdown(webhook, content, timeout=args.timeout)
+    return lambda content: send_text(webhook, content, timeout=args.timeout)
+
+
+def _stub_stats(base):
+    try:
+        return get_json(base.rstrip("/") + "/stub/stats", 3)
+    except Exception:
+        return None
+
+
+def run_load(args):
+    """
+    按参数压测，返回统计字典：
+    {"sent", "failed", "errors": {原因: 次数}, "elapsed", "latencies"（毫秒，已排序）}
+    """
+    send_fn = make_sender(args)
+    bucket = TokenBucket(args.per_minute / 60.0, 1) if args.per_minute else _Unlimited()
+    retry = RetryPolicy(args.retry_attempts, args.retry_base_delay, args.retry_max_delay, args.rate_limit_pause)
+    lock = threading.Lock()
+    counter = [0]
+    latencies = []
+    errors = {}
+
+    def worker():
+        while True:
+            with lock:
+                index = counter[0]
+                if index >= args.messages:
+                    return
+                counter[0] += 1
+            content = make_content(index, args.size)
+            start = time.time()
+            try:
+                send_chunks([content], send_fn, bucket, retry)
+                elapsed = (time.time() - start) * 1000.0
+                with lock:
+                    latencies.append(elapsed)
+            except Exception as e:
+                reason = "errcode=%s" % e.errcode if getattr(e, "errcode", None) is not None else type(e).__name__
+                with lock:
+                    errors[reason] = errors.get(reason, 0) + 1
+            finally:
+                if args.fresh_connections:
+                    _TRANSPORT.close_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, args.concurrency))]
+    start = time.time()
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    latencies.sort()
+    return {
+        "sent": len(latencies),
+        "failed": sum(errors.values()),
+        "errors": errors,
+        "elapsed": elapsed,
+        "latencies": latencies,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the WeCom send path against a local stub")
+    parser.add_argument("--base", default="http://127.0.0.1:18080", help="模拟服务地址")
+    parser.add_argument("--mode", choices=MODES, default="robot-markdown", help="发送方式")
+    parser.add_argument("--messages", type=int, default=200, help="发送的消息条数")
+    parser.add_argument("--concurrency", type=int, default=1, help="并发发送线程数")
+    parser.add_argument("--size", type=int, default=500, help="每条消息的大小（UTF-8 字节）")
+    parser.add_argument("--per-minute", type=int, default=0, help="客户端令牌桶限速（每分钟条数，0 表示不限）")
+    parser.add_argument("--retry-attempts", type=int, default=4, help="每条最多尝试次数（同 [sender] retry_attempts）")
+    parser.add_argument("--retry-base-delay", type=float, default=0.2, help="第一次重试前的等待秒数")
+    parser.add_argument("--retry-max-delay", type=float, default=5.0, help="单次重试等待上限（秒）")
+    parser.add_argument("--rate-limit-pause", type=float, default=5.0, help="收到 45009 时通道暂停秒数")
+    parser.add_argument("--timeout", type=float, default=8, help="单次请求超时（秒）")
+    parser.add_argument("--fresh-connections", action="store_true", help="每条消息发完后关闭连接（对比长连接的收益）")
+    parser.add_argument("--key", default="loadtest", help="机器人模式下的 webhook key")
+    parser.add_argument("--corpid", default="loadtest", help="应用模式下的 corpid")
+    parser.add_argument("--corpsecret", default="loadtest", help="应用模式下的 corpsecret")
+    parser.add_argument("--token-cache", default=os.path.join(tempfile.gettempdir(), "wecom_load_token.json"),
+                        help="应用模式下的 token 缓存文件（留空表示每条都重新获取 token）")
+    parser.add_argument("--insecure", action="store_true", help="HTTPS 模拟服务使用自签名证书时不校验证书（仅限压测）")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    if args.insecure:
+        import ssl
+        if hasattr(ssl, "_create_unverified_context"):
+            ssl._create_default_https_context = ssl._create_unverified_context
+    if args.mode == "app" and args.token_cache and os.path.exists(args.token_cache):
+        # 每次压测从没有 token 开始，避免用到上一次模拟服务发放的 token
+        os.remove(args.token_cache)
+
+    before = _stub_stats(args.base)
+    result = run_load(args)
+    after = _stub_stats(args.base)
+
+    lat = result["latencies"]
+    summary = {
+        "mode": args.mode,
+        "messages": args.messages,
+        "concurrency": args.concurrency,
+        "sent": result["sent"],
+        "failed": result["failed"],
+        "errors": result["errors"],
+        "elapsed_seconds": round(result["elapsed"], 3),
+        "throughput_per_sec": round(result["sent"] / result["elapsed"], 1) if result["elapsed"] > 0 else None,
+        "latency_ms": dict(
+            (name, round(percentile(lat, p), 1) if lat else None)
+            for name, p in [("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)]
+        ),
+    }
+    if before is not None and after is not None:
+        summary["stub_requests"] = after["requests"] - before["requests"]
+        summary["stub_connections"] = after["connections"] - before["connections"]
+    if args.json:
+        print(json.dumps(summary, sort_keys=True))
+    else:
+        print("模式：%s，并发 %d，共 %d 条（每条约 %d 字节）" % (args.mode, args.concurrency, args.messages, args.size))
+        print("成功 %d 条，失败 %d 条，耗时 %.2f 秒，吞吐 %s 条/秒" % (
+            summary["sent"], summary["failed"], summary["elapsed_seconds"], summary["throughput_per_sec"]))
+        if result["errors"]:
+            print("失败原因：%s" % ", ".join("%s × %d" % (k, v) for k, v in sorted(result["errors"].items())))
+        print("延迟（毫秒，含重试与限速等待）：p50=%s p90=%s p99=%s max=%s" % tuple(
+            summary["latency_ms"][k] for k in ("p50", "p90", "p99", "max")))
+        if "stub_requests" in summary:
+            print("模拟服务收到 %d 个请求，新建 %d 个 TCP 连接" % (summary["stub_requests"], summary["stub_connections"]))
+    return 0 if not result["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
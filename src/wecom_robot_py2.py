@@ -6,14 +6,11 @@
 - 企业微信的“群机器人”提供一个 webhook 地址，像一个“邮箱收件地址”。
 - 我们把要发的文本内容，用 HTTP POST 的方式提交到这个地址，群里就会收到消息。
 - 机器人不需要 corpid/agentid，只需要你在群里创建的 webhook URL。
+- 请求走 http_transport_py2 的长连接，连续发送多段消息时只需一次 TLS 握手。
 """
 
-import json
-import sys
-try:
-    import urllib2  # Python 2
-except Exception:
-    import urllib.request as urllib2  # Python 3 调试兼容
+from http_transport_py2 import post_json
+from wecom_client_py2 import WecomApiError
 
 
 def send_text(webhook_url, content, mentioned_list=None, timeout=8):
@@ -32,18 +29,14 @@ def send_text(webhook_url, content, mentioned_list=None, timeout=8):
     payload = {"msgtype": "text", "text": {"content": content}}
     if mentioned_list:
         payload["text"]["mentioned_list"] = mentioned_list
-    data_bytes = json.dumps(payload)
-    if sys.version_info[0] >= 3:
-        data_bytes = data_bytes.encode("utf-8")
-    req = urllib2.Request(webhook_url, data=data_bytes)
-    req.add_header("Content-Type", "application/json")
-    resp = urllib2.urlopen(req, timeout=timeout)
-    body = resp.read()
-    data = json.loads(body)
+    data = post_json(webhook_url, payload, timeout)
     # 机器人返回 {"errcode":0,"errmsg":"ok"}
     if data.get("errcode") == 0:
         return True
-    raise Exception("Robot send failed: errcode=%s errmsg=%s" % (data.get("errcode"), data.get("errmsg")))
+    raise WecomApiError(
+        "Robot send failed: errcode=%s errmsg=%s" % (data.get("errcode"), data.get("errmsg")),
+        data.get("errcode"), data.get("errmsg"),
+    )
 
 
 def send_markdown(webhook_url, content, timeout=8):
@@ -56,14 +49,10 @@ def send_markdown(webhook_url, content, timeout=8):
     - timeout：网络超时秒数。
     """
     payload = {"msgtype": "markdown", "markdown": {"content": content}}
-    data_bytes = json.dumps(payload)
-    if sys.version_info[0] >= 3:
-        data_bytes = data_bytes.encode("utf-8")
-    req = urllib2.Request(webhook_url, data=data_bytes)
-    req.add_header("Content-Type", "application/json")
-    resp = urllib2.urlopen(req, timeout=timeout)
-    body = resp.read()
-    data = json.loads(body)
+    data = post_json(webhook_url, payload, timeout)
     if data.get("errcode") == 0:
         return True
-    raise Exception("Robot send failed: errcode=%s errmsg=%s" % (data.get("errcode"), data.get("errmsg")))
+    raise WecomApiError(
+        "Robot send failed: errcode=%s errmsg=%s" % (data.get("errcode"), data.get("errmsg")),
+        data.get("errcode"), data.get("errmsg"),
+    )
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+本地企业微信模拟服务（Python 2.7 兼容，只用标准库）
+
+用小白能懂的话：
+- 调试发送逻辑（分段、长连接、重试、限速）时，不想往真实的群里刷消息，也不想被真实接口限流。
+- 这个脚本在本机起一个 HTTP(S) 服务，模仿企业微信的三个接口：
+  - GET  /cgi-bin/gettoken?corpid=...&corpsecret=...       发放 access_token
+  - POST /cgi-bin/message/send?access_token=...             应用消息
+  - POST /cgi-bin/webhook/send?key=...                      群机器人
+- 可以模拟各种“坏情况”：
+  - --latency / --jitter：每个请求固定延迟 + 随机抖动（毫秒）
+  - --inject：按概率返回错误码，例如 "45009:0.05,-1:0.02,40014:0.01"
+    （45009 频率超限、-1 系统繁忙、40014 token 无效，40014 只对应用消息生效）
+  - 消息超过字节上限（文本 2048、Markdown 4096）返回 40058
+  - 每个机器人 key / 每个应用每分钟最多 --per-minute 条，超出返回 45009
+- GET /stub/stats 查看统计（请求数、TCP 连接数、各错误码次数），POST /stub/reset 清零。
+  连接数远小于请求数，说明客户端的长连接复用生效了。
+
+用法：
+    python src/wecom_stub_py2.py --port 18080 --latency 50 --jitter 30 --inject "45009:0.02,-1:0.02"
+    然后把 [wecom] api_base=http://127.0.0.1:18080，[robot] webhook=http://127.0.0.1:18080/cgi-bin/webhook/send?key=test
+    HTTPS：加 --certfile cert.pem --keyfile key.pem（自签名证书时客户端需信任该证书）
+"""
+
+import json
+import random
+import ssl
+import sys
+import threading
+import time
+import argparse
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+except Exception:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # Python 3 调试兼容
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs
+
+ERRCODE_BUSY = -1
+ERRCODE_INVALID_TOKEN = 40014
+ERRCODE_TOO_LONG = 40058
+ERRCODE_RATE_LIMIT = 45009
+ERRCODE_BAD_JSON = 47001
+ERRCODE_INVALID_WEBHOOK = 93000
+TEXT_MAX_BYTES = 2048
+MARKDOWN_MAX_BYTES = 4096
+_ERRMSG = {
+    ERRCODE_BUSY: "system busy",
+    ERRCODE_INVALID_TOKEN: "invalid access_token",
+    ERRCODE_RATE_LIMIT: "api freq out of limit",
+}
+
+
+def parse_inject(value):
+    """
+    解析错误注入配置，例如 "45009:0.05,-1:0.02" → [(45009, 0.05), (-1, 0.02)]。
+    """
+    result = []
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        code, _, prob = part.rpartition(":")
+        result.append((int(code), float(prob)))
+    return result
+
+
+class StubState(object):
+    """
+    模拟服务的状态：已发放的 token、每个 key 的发送记录（用于限速）和统计数据（线程安全）。
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, inject=None, per_minute=20, token_ttl=7200, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.inject = inject or []
+        self.per_minute = per_minute
+        self.token_ttl = token_ttl
+        self._rand = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._sent = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._sent = {}
+            self.stats = {"connections": 0, "requests": 0, "by_path": {}, "by_errcode": {}}
+
+    def count(self, name, key=None):
+        with self._lock:
+            if key is None:
+                self.stats[name] += 1
+            else:
+                self.stats[name][key] = self.stats[name].get(key, 0) + 1
+
+    def delay(self):
+        with self._lock:
+            seconds = (self.latency + self._rand.random() * self.jitter) / 1000.0
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def injected(self, allowed):
+        """按概率抽取一个要注入的错误码（只在 allowed 中选），不注入时返回 None。"""
+        with self._lock:
+            for code, prob in self.inject:
+                if code in allowed and self._rand.random() < prob:
+                    return code
+        return None
+
+    def allow(self, key, now=None):
+        """滑动 60 秒窗口限速：key 在最近 60 秒内已发送 per_minute 条时返回 False。"""
+        if not self.per_minute:
+            return True
+        now = time.time() if now is None else now
+        with self._lock:
+            sent = [t for t in self._sent.get(key, []) if now - t < 60]
+            if len(sent) >= self.per_minute:
+                self._sent[key] = sent
+                return False
+            sent.append(now)
+            self._sent[key] = sent
+            return True
+
+    def issue_token(self, corpid):
+        with self._lock:
+            token = "stub-%s-%08x" % (corpid, self._rand.getrandbits(32))
+            self._tokens[token] = (corpid, time.time() + self.token_ttl)
+            return token
+
+    def token_owner(self, token):
+        """返回 token 对应的 corpid；token 不存在或已过期时返回 None。"""
+        with self._lock:
+            entry = self._tokens.get(token)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    def invalidate(self, token):
+        with self._lock:
+            self._tokens.pop(token, None)
+
+
+def _content_size(payload):
+    msgtype = payload.get("msgtype")
+    body = payload.get(msgtype) if msgtype in ("text", "markdown") else None
+    if not isinstance(body, dict) or not body.get("content"):
+        return msgtype, None
+    content = body["content"]
+    if not isinstance(content, bytes):
+        content = content.encode("utf-8")
+    return msgtype, len(content)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 才支持 keep-alive，每个响应都必须带 Content-Length
+    protocol_version = "HTTP/1.1"
+    state = None
+    quiet = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.state.count("connections")
+
+    def log_message(self, fmt, *args):
+        if not self.quiet:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    def _reply(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, errcode, errmsg=None):
+        self.state.count("by_errcode", str(errcode))
+        self._reply({"errcode": errcode, "errmsg": errmsg or _ERRMSG.get(errcode, "error")})
+
+    def _ok(self, extra=None):
+        self.state.count("by_errcode", "0")
+        data = {"errcode": 0, "errmsg": "ok"}
+        data.update(extra or {})
+        self._reply(data)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw.decode("utf-8"))
+        except Exception:
+            return None
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        if parts.path == "/stub/stats":
+            with self.state._lock:
+                data = json.loads(json.dumps(self.state.stats))
+            return self._reply(data)
+        self.state.count("requests")
+        self.state.count("by_path", parts.path)
+        self.state.delay()
+        if parts.path != "/cgi-bin/gettoken":
+            return self._reply({"errcode": 404, "errmsg": "not found"}, 404)
+        corpid = (query.get("corpid") or [""])[0]
+        if not corpid or not (query.get("corpsecret") or [""])[0]:
+            return self._error(40013, "invalid corpid or corpsecret")
+        code = self.state.injected((ERRCODE_BUSY,))
+        if code is not None:
+            return self._error(code)
+        self._ok({"access_token": self.state.issue_token(corpid), "expires_in": self.state.token_ttl})
+
+    def do_POST(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        if parts.path == "/stub/reset":
+            self._read_json()
+            self.state.reset()
+            return self._ok()
+        payload = self._read_json()
+        self.state.count("requests")
+        self.state.count("by_path", parts.path)
+        self.state.delay()
+        if parts.path == "/cgi-bin/webhook/send":
+            key = (query.get("key") or [""])[0]
+            if not key:
+                return self._error(ERRCODE_INVALID_WEBHOOK, "invalid webhook url")
+            limit_key = "robot:" + key
+            allowed = (ERRCODE_BUSY, ERRCODE_RATE_LIMIT)
+        elif parts.path == "/cgi-bin/message/send":
+            token = (query.get("access_token") or [""])[0]
+            corpid = self.state.token_owner(token)
+            if corpid is None:
+                return self._error(ERRCODE_INVALID_TOKEN)
+            limit_key = "app:%s:%s" % (corpid, (payload or {}).get("agentid"))
+            allowed = (ERRCODE_BUSY, ERRCODE_RATE_LIMIT, ERRCODE_INVALID_TOKEN)
+        else:
+            return self._reply({"errcode": 404, "errmsg": "not found"}, 404)
+        if payload is None:
+            return self._error(ERRCODE_BAD_JSON, "data format error")
+        msgtype, size = _content_size(payload)
+        if size is None:
+            return self._error(44004, "empty content")
+        max_bytes = MARKDOWN_MAX_BYTES if msgtype == "markdown" else TEXT_MAX_BYTES
+        if size > max_bytes:
+            return self._error(ERRCODE_TOO_LONG, "%s.content exceed max length %d" % (msgtype, max_bytes))
+        code = self.state.injected(allowed)
+        if code == ERRCODE_INVALID_TOKEN:
+            # 模拟 token 被提前作废：之后用这个 token 的请求都会失败，客户端需要重新获取
+            self.state.invalidate(token)
+        if code is not None:
+            return self._error(code)
+        if not self.state.allow(limit_key):
+            return self._error(ERRCODE_RATE_LIMIT)
+        self._ok()
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_server(host, port, state, certfile=None, keyfile=None, quiet=True):
+    """
+    创建模拟服务（未启动）；指定 certfile 时使用 HTTPS。调用 serve_forever() 开始服务。
+    """
+    # 用 class 语句派生：Python 2 的 BaseHTTPRequestHandler 是旧式类，不能用 type() 创建子类
+    class BoundStubHandler(StubHandler):
+        pass
+
+    BoundStubHandler.state = state
+    BoundStubHandler.quiet = quiet
+    server = StubServer((host, port), BoundStubHandler)
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the WeCom gettoken / message / webhook APIs")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=18080, help="监听端口")
+    parser.add_argument("--latency", type=float, default=0, help="每个请求的固定延迟（毫秒）")
+    parser.add_argument("--jitter", type=float, default=0, help="每个请求额外的随机延迟上限（毫秒）")
+    parser.add_argument("--inject", default="", help='按概率注入错误码，例如 "45009:0.05,-1:0.02,40014:0.01"')
+    parser.add_argument("--per-minute", type=int, default=20, help="每个机器人 key / 应用每分钟最多条数（0 表示不限）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子（便于复现）")
+    parser.add_argument("--certfile", default=None, help="HTTPS 证书文件（PEM）")
+    parser.add_argument("--keyfile", default=None, help="HTTPS 私钥文件（PEM）")
+    parser.add_argument("--verbose", action="store_true", help="打印每个请求的访问日志")
+    args = parser.parse_args()
+
+    state = StubState(args.latency, args.jitter, parse_inject(args.inject), args.per_minute, seed=args.seed)
+    server = make_server(args.host, args.port, state, args.certfile, args.keyfile, quiet=not args.verbose)
+    print("企业微信模拟服务已启动：%s://%s:%d" % ("https" if args.certfile else "http", args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())